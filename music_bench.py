@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MCP服务器压测
+在本进程内启动服务器，模拟 N 台音响按比例混合发送 搜索/播放/下一首/读取状态 请求，
+统计吞吐量、各类请求的 p50/p95/p99 延迟与每个连接占用的内存，结果写入JSON文件；
+指定 --baseline 时与基准结果比较，吞吐量下降或 p99 上升超过容差时以非零状态退出
+
+    python music_bench.py --server websocket --clients 200 --duration 20 --output bench.json
+    python music_bench.py --server stdio --baseline bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# 默认请求比例
+DEFAULT_MIX = {"search": 20, "play": 10, "next": 20, "read": 50}
+
+QUERIES = ["周杰伦", "青花瓷", "稻香", "薛之谦", "赵雷 成都", "南山南", "体面", "理想", "晴天", "七里香"]
+SONG_IDS = [str(i) for i in range(1, 11)]
+
+
+def make_request(op: str, msg_id: int, rng: random.Random, server: str) -> Dict[str, Any]:
+    """按操作类型生成JSON-RPC请求"""
+    if op == "search":
+        method, params = "tools/call", {"name": "search_music",
+                                        "arguments": {"query": rng.choice(QUERIES), "limit": 5}}
+    elif op == "play":
+        method, params = "tools/call", {"name": "play_music", "arguments": {"song_id": rng.choice(SONG_IDS)}}
+    elif op == "next":
+        method, params = "tools/call", {"name": "next_song", "arguments": {}}
+    elif server == "websocket":
+        method, params = "resources/read", {"uri": "music://current_playing"}
+    else:
+        # stdio 服务器没有 resources/read，以读取播放列表代替
+        method, params = "tools/call", {"name": "get_playlist", "arguments": {}}
+    return {"jsonrpc": "2.0", "id": msg_id, "method": method, "params": params}
+
+
+def setup_requests(rng: random.Random, server: str) -> List[Dict[str, Any]]:
+    """每台音响开始前先加入几首歌，使下一首有歌可切"""
+    return [{"jsonrpc": "2.0", "id": -i - 1, "method": "tools/call",
+             "params": {"name": "add_to_playlist", "arguments": {"song_id": song_id}}}
+            for i, song_id in enumerate(rng.sample(SONG_IDS, 5))]
+
+
+def choose_ops(mix: Dict[str, int], rng: random.Random):
+    ops = list(mix)
+    weights = [mix[op] for op in ops]
+    while True:
+        yield rng.choices(ops, weights)[0]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def format_ms(value: Optional[float]) -> str:
+    """延迟(毫秒)，没有完成的请求时为 -"""
+    return "-" if value is None else f"{value:.2f}ms"
+
+
+def summarize(latencies: Dict[str, List[float]], errors: int, elapsed: float) -> Dict[str, Any]:
+    """汇总各类请求的延迟(毫秒)"""
+    def stats(values: List[float]) -> Dict[str, Any]:
+        values = sorted(values)
+        return {
+            "count": len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+            "max": values[-1] if values else None
+        }
+
+    everything = [value for values in latencies.values() for value in values]
+    return {
+        "requests": len(everything),
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": len(everything) / elapsed if elapsed else 0.0,
+        "latency_ms": stats(everything),
+        "per_op": {op: stats(values) for op, values in sorted(latencies.items())}
+    }
+
+
+def current_rss() -> Optional[int]:
+    """本进程当前常驻内存(字节)，无法获取时返回None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# ---------- WebSocket：服务器在本进程，模拟音响在子进程，避免客户端内存计入服务器 ----------
+
+async def _speaker(url: str, index: int, seed: int, mix: Dict[str, int],
+                   ready: Callable[[], Awaitable[float]],
+                   latencies: Dict[str, List[float]], errors: List[int]):
+    import websockets
+
+    rng = random.Random(seed + index)
+    try:
+        websocket = await websockets.connect(f"{url}/?device_id=bench-{index}", max_size=None)
+    except Exception:
+        # 连接失败也要计入就绪数，否则其余连接一直等待
+        await ready()
+        raise
+    async with websocket:
+        for request in setup_requests(rng, "websocket"):
+            await websocket.send(json.dumps(request))
+            await websocket.recv()
+        deadline = await ready()
+        msg_id = 0
+        for op in choose_ops(mix, rng):
+            if time.monotonic() >= deadline:
+                break
+            msg_id += 1
+            payload = json.dumps(make_request(op, msg_id, rng, "websocket"))
+            start = time.perf_counter()
+            await websocket.send(payload)
+            response = json.loads(await websocket.recv())
+            latencies.setdefault(op, []).append((time.perf_counter() - start) * 1000)
+            if "error" in response:
+                errors[0] += 1
+
+
+def _run_speakers(url: str, clients: int, duration: float, seed: int, mix: Dict[str, int],
+                  connected, go, results):
+    """子进程：建立全部连接后通知主进程测量内存，收到开始信号后压测"""
+    async def run():
+        latencies: Dict[str, List[float]] = {}
+        errors = [0]
+        loop = asyncio.get_running_loop()
+        opened = 0
+        started = asyncio.Event()
+        begin = time.monotonic()
+
+        async def ready() -> float:
+            """等待全部连接就绪与开始信号，返回压测截止时间"""
+            nonlocal opened, begin
+            opened += 1
+            if opened == clients:
+                connected.set()
+                await loop.run_in_executor(None, go.wait)
+                begin = time.monotonic()
+                started.set()
+            await started.wait()
+            return begin + duration
+
+        outcomes = await asyncio.gather(
+            *(_speaker(url, index, seed, mix, ready, latencies, errors) for index in range(clients)),
+            return_exceptions=True)
+        failures = [repr(outcome) for outcome in outcomes if isinstance(outcome, BaseException)]
+        results.put((latencies, errors[0], time.monotonic() - begin, failures[:5]))
+
+    asyncio.run(run())
+
+
+async def bench_websocket(clients: int, duration: float, seed: int, mix: Dict[str, int]) -> Dict[str, Any]:
+    import websockets
+    import music_mcp_websocket_server as ws
+
+    ws.register_tools()
+    server = await websockets.serve(ws.handle_client, "127.0.0.1", 0, max_size=None)
+    port = server.sockets[0].getsockname()[1]
+    context = multiprocessing.get_context("spawn")
+    connected, go, results = context.Event(), context.Event(), context.Queue()
+    loop = asyncio.get_running_loop()
+    rss_before = current_rss()
+    process = context.Process(target=_run_speakers, args=(
+        f"ws://127.0.0.1:{port}", clients, duration, seed, mix, connected, go, results))
+    process.start()
+    try:
+        await loop.run_in_executor(None, connected.wait)
+        rss_connected = current_rss()
+        go.set()
+        latencies, errors, elapsed, failures = await loop.run_in_executor(None, results.get)
+        await loop.run_in_executor(None, process.join)
+    finally:
+        if process.is_alive():
+            process.terminate()
+        server.close()
+        await server.wait_closed()
+
+    summary = summarize(latencies, errors, elapsed)
+    summary["memory_per_connection"] = (
+        (rss_connected - rss_before) / clients if rss_before and rss_connected else None)
+    summary["connection_failures"] = failures
+    return summary
+
+
+# ---------- stdio：直接调用 MCPServer 的消息处理，包含编解码 ----------
+
+async def bench_stdio(clients: int, duration: float, seed: int, mix: Dict[str, int]) -> Dict[str, Any]:
+    import music_mcp_server as stdio
+    from music_codec import loads
+    from music_jsonrpc import encode_message
+
+    stdio.register_tools()
+    server = stdio.server
+    latencies: Dict[str, List[float]] = {}
+    errors = [0]
+
+    async def call(request: Dict[str, Any]) -> Dict[str, Any]:
+        response = await server.handle_message(loads(json.dumps(request)))
+        return loads(encode_message(response))
+
+    # stdio 只有一个客户端连接，clients 表示同时在途的请求数
+    setup_rng = random.Random(seed)
+    for request in setup_requests(setup_rng, "stdio"):
+        await call(request)
+
+    deadline = time.monotonic() + duration
+
+    async def worker(index: int):
+        rng = random.Random(seed + index)
+        msg_id = 0
+        for op in choose_ops(mix, rng):
+            if time.monotonic() >= deadline:
+                break
+            msg_id += 1
+            start = time.perf_counter()
+            response = await call(make_request(op, msg_id, rng, "stdio"))
+            latencies.setdefault(op, []).append((time.perf_counter() - start) * 1000)
+            if "error" in response:
+                errors[0] += 1
+
+    begin = time.monotonic()
+    await asyncio.gather(*(worker(index) for index in range(clients)))
+    summary = summarize(latencies, errors[0], time.monotonic() - begin)
+    summary["memory_per_connection"] = None
+    await stdio.providers.aclose()
+    return summary
+
+
+# ---------- 与基准比较 ----------
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """返回超过容差的退化项"""
+    regressions = []
+    if baseline.get("server") != result["server"] or baseline.get("clients") != result["clients"]:
+        regressions.append(f"基准为 {baseline.get('server')} 服务器 {baseline.get('clients')} 个客户端，条件不一致")
+        return regressions
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"吞吐量 {result['throughput']:.1f}/s 低于基准 {baseline['throughput']:.1f}/s")
+    p99, base_p99 = result["latency_ms"]["p99"], baseline["latency_ms"]["p99"]
+    if p99 is not None and base_p99 and p99 > base_p99 * (1 + tolerance):
+        regressions.append(f"p99 延迟 {p99:.2f}ms 高于基准 {base_p99:.2f}ms")
+    return regressions
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    """解析 search=20,play=10,next=20,read=50"""
+    mix = {}
+    for item in text.split(","):
+        op, _, weight = item.partition("=")
+        if op.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"未知的请求类型: {op}")
+        mix[op.strip()] = int(weight)
+    return mix
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="MCP服务器压测")
+    parser.add_argument("--server", choices=["websocket", "stdio"], default="websocket")
+    parser.add_argument("--clients", type=int, default=100, help="模拟音响数量(stdio 为在途请求数)")
+    parser.add_argument("--duration", type=float, default=10, help="压测时长(秒)")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="请求比例，如 search=20,play=10,next=20,read=50")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench.json", help="结果JSON文件")
+    parser.add_argument("--baseline", help="基准结果JSON文件")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例")
+    args = parser.parse_args(argv)
+
+    # 压测期间不输出每条消息的日志
+    logging.disable(logging.INFO)
+
+    bench = bench_websocket if args.server == "websocket" else bench_stdio
+    result = asyncio.run(bench(args.clients, args.duration, args.seed, args.mix))
+    from music_codec import codec
+
+    result.update({
+        "server": args.server,
+        "clients": args.clients,
+        "duration": args.duration,
+        "mix": args.mix,
+        "seed": args.seed,
+        "python": platform.python_version(),
+        "codec": codec.name,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    })
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    latency = result["latency_ms"]
+    print(f"{args.server}: {result['requests']} 个请求，{result['throughput']:.1f}/s，"
+          f"p50 {format_ms(latency['p50'])} p95 {format_ms(latency['p95'])} p99 {format_ms(latency['p99'])}，"
+          f"错误 {result['errors']}，结果已写入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"性能退化: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
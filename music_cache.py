@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内缓存
+带TTL与LRU容量上限，并对相同键的并发加载做合并(single-flight)；
+元数据缓存支持过期后先返回旧值再后台刷新，以及"未找到"结果的短暂缓存
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """TTL + LRU 缓存
+
+    条目按最近使用顺序保存，超过 max_size 时淘汰最久未使用的条目；
+    过期条目在访问时惰性删除。
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """读取未过期的条目"""
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires, value = item
+        if expires <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """写入条目"""
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+_MISSING = object()
+
+
+class SearchCache:
+    """搜索结果缓存
+
+    相同键的并发请求只会触发一次加载：加载在独立任务中运行，所有请求等待同一个任务，
+    某个请求被取消(例如客户端断开)不会影响其他等待者；
+    空结果不写入缓存，上游暂时失败时下次请求会重新加载。
+    hits/misses/coalesced 统计命中、未命中与被合并的请求数。
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300):
+        self._cache = TTLCache(max_size, ttl)
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """读取缓存，未命中时调用 loader 加载并写入"""
+        value = self._cache.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch(key, loader))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = await loader()
+        if value:
+            self._cache.set(key, value)
+        return value
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 所有等待者都已取消时取出异常，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0
+        }
+
+    def clear(self):
+        self._cache.clear()
+
+
+class MetadataCache:
+    """歌曲元数据/播放地址缓存
+
+    - 条目在 ttl 内为新鲜数据直接返回；
+    - 过期但仍在 stale_ttl 内时立即返回旧值，同时在后台刷新(stale-while-revalidate)；
+    - loader 返回 None 表示"未找到"，只缓存 negative_ttl 秒且不做后台刷新；
+    - provider_ttls 可按提供方覆盖 ttl，例如播放地址有效期较短的上游。
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = 600, stale_ttl: float = 3600,
+                 negative_ttl: float = 30, provider_ttls: Optional[Dict[str, float]] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.provider_ttls = provider_ttls or {}
+        self._data: "OrderedDict[Hashable, Tuple[float, float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def put(self, key: Hashable, value: Any, provider: Optional[str] = None):
+        """写入条目；value 为 None 时作为"未找到"缓存"""
+        now = time.monotonic()
+        if value is None:
+            fresh_until = stale_until = now + self.negative_ttl
+        else:
+            fresh_until = now + self.provider_ttls.get(provider, self.ttl)
+            stale_until = fresh_until + self.stale_ttl
+        self._data[key] = (fresh_until, stale_until, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def peek(self, key: Hashable) -> Any:
+        """读取条目(包括过期未淘汰的旧值)，不触发加载"""
+        entry = self._data.get(key)
+        return entry[2] if entry is not None else None
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                  provider: Optional[str] = None) -> Any:
+        """读取条目，必要时加载或在后台刷新"""
+        entry = self._data.get(key)
+        if entry is not None:
+            fresh_until, stale_until, value = entry
+            now = time.monotonic()
+            if now < fresh_until:
+                self._data.move_to_end(key)
+                if value is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return value
+            if value is not None and now < stale_until:
+                self.stale_hits += 1
+                self._data.move_to_end(key)
+                self._load(key, loader, provider)
+                return value
+
+        self.misses += 1
+        return await asyncio.shield(self._load(key, loader, provider))
+
+    def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+              provider: Optional[str]) -> asyncio.Task:
+        """启动(或复用进行中的)加载任务"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, loader, provider))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return task
+
+    async def _fetch(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                     provider: Optional[str]) -> Any:
+        value = await loader()
+        self.put(key, value, provider)
+        return value
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            # 后台刷新失败时保留旧值，等待下次访问重试
+            logger.warning("元数据加载失败 %s: %s", key, task.exception())
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        lookups = self.hits + self.stale_hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": (lookups - self.misses) / lookups if lookups else 0.0
+        }
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+音乐目录索引
+对歌曲名、歌手、专辑建立n-gram倒排索引，支持百万级曲库的快速检索
+并建立拼音、首字母与编辑距离索引，容忍语音识别产生的同音字和错别字
+"""
+
+import json
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from music_text import edit_distance, normalize_text, to_initials, to_pinyin
+
+# 建立索引的字段，顺序即排序时的字段优先级
+INDEXED_FIELDS = ("name", "artist", "album")
+
+# 匹配类型，数值越小排名越靠前
+MATCH_EXACT = 0
+MATCH_PREFIX = 1
+MATCH_CONTAINS = 2
+
+# 模糊匹配的键类型，数值越小排名越靠前：原文、全拼、首字母
+FUZZY_TEXT = "t"
+FUZZY_PINYIN = "p"
+FUZZY_INITIALS = "i"
+FUZZY_KIND_ORDER = {FUZZY_TEXT: 0, FUZZY_PINYIN: 1, FUZZY_INITIALS: 2}
+
+
+def iter_ngrams(text: str, n: int = 2) -> Iterator[str]:
+    """生成文本的单字与n-gram"""
+    seen = set()
+    for size in range(1, n + 1):
+        for i in range(len(text) - size + 1):
+            gram = text[i:i + size]
+            if gram not in seen:
+                seen.add(gram)
+                yield gram
+
+
+def query_ngrams(text: str, n: int = 2) -> List[str]:
+    """生成查询所需的n-gram，只使用最长的gram以缩小候选集"""
+    if len(text) < n:
+        return [text]
+    return list({text[i:i + n] for i in range(len(text) - n + 1)})
+
+
+def iter_deletes(term: str, max_distance: int) -> Iterator[str]:
+    """生成删除至多 max_distance 个字符后的所有变体(含原词)"""
+    seen = {term}
+    frontier = [term]
+    yield term
+    for _ in range(max_distance):
+        next_frontier = []
+        for word in frontier:
+            for i in range(len(word)):
+                variant = word[:i] + word[i + 1:]
+                if variant not in seen:
+                    seen.add(variant)
+                    next_frontier.append(variant)
+                    yield variant
+        frontier = next_frontier
+
+
+def _add_id(table: Dict[str, Any], key: str, value: int):
+    """向表项追加ID；只有一个ID时直接保存整数，多个时才换成 array，减少大量小列表的开销"""
+    current = table.get(key)
+    if current is None:
+        table[key] = value
+    elif type(current) is int:
+        if current != value:
+            table[key] = array("I", (current, value))
+    elif current[-1] != value:
+        current.append(value)
+
+
+def _ids(entry: Any) -> Sequence[int]:
+    """表项中的全部ID"""
+    if entry is None:
+        return ()
+    return (entry,) if type(entry) is int else entry
+
+
+class FuzzyIndex:
+    """模糊匹配索引
+
+    加载时为每个字段预先计算全拼、首字母，并建立 SymSpell 风格的删除字典，
+    查询时只需生成查询词的删除变体并探测字典，不需要对全曲库逐条计算编辑距离。
+    每个键类型的词编号后保存一次，删除字典与倒排链中只保存编号。
+    """
+
+    def __init__(self, max_distance: int = 1, max_term_length: int = 16):
+        self.max_distance = max_distance
+        self.max_term_length = max_term_length
+        # 键类型 -> 词 -> 词编号
+        self._term_ids: Dict[str, Dict[str, int]] = {kind: {} for kind in FUZZY_KIND_ORDER}
+        self._term_text: List[str] = []
+        # 词编号 -> 文档(整数或 array)
+        self._term_docs: List[Any] = []
+        # 键类型 -> 删除变体 -> 词编号(整数或 array)；首字母本身已是缩写，只做精确匹配
+        self._deletes: Dict[str, Dict[str, Any]] = {FUZZY_TEXT: {}, FUZZY_PINYIN: {}}
+
+    def add(self, doc: int, value: str):
+        """为归一化后的字段值建立模糊索引"""
+        terms = [(FUZZY_TEXT, value)]
+        pinyin = to_pinyin(value)
+        # 不含汉字的字段拼音与原文(去掉空格)相同，不重复索引
+        if pinyin and pinyin != value.replace(" ", ""):
+            terms.append((FUZZY_PINYIN, pinyin))
+            initials = to_initials(value)
+            if initials != pinyin:
+                terms.append((FUZZY_INITIALS, initials))
+
+        for kind, term in terms:
+            ids = self._term_ids[kind]
+            term_id = ids.get(term)
+            if term_id is None:
+                term_id = ids[term] = len(self._term_text)
+                self._term_text.append(term)
+                self._term_docs.append(doc)
+                deletes = self._deletes.get(kind)
+                if deletes is not None and len(term) <= self.max_term_length:
+                    for variant in iter_deletes(term, self.max_distance):
+                        _add_id(deletes, variant, term_id)
+                continue
+            docs = self._term_docs[term_id]
+            if type(docs) is int:
+                if docs != doc:
+                    self._term_docs[term_id] = array("I", (docs, doc))
+            elif docs[-1] != doc:
+                docs.append(doc)
+
+    def _allowed_distance(self, kind: str, term: str) -> int:
+        """按词长限制编辑距离，避免短词匹配出大量无关结果"""
+        if kind == FUZZY_TEXT:
+            return min(self.max_distance, len(term) // 2)
+        if kind == FUZZY_PINYIN:
+            return min(self.max_distance, len(term) // 4)
+        return 0
+
+    def _probe(self, kind: str, term: str) -> Iterator[Tuple[int, int]]:
+        """探测删除字典，返回 (编辑距离, 命中词编号)"""
+        distance = self._allowed_distance(kind, term)
+        if distance == 0 or len(term) > self.max_term_length:
+            term_id = self._term_ids[kind].get(term)
+            if term_id is not None:
+                yield 0, term_id
+            return
+
+        deletes = self._deletes[kind]
+        matched = set()
+        for variant in iter_deletes(term, distance):
+            for term_id in _ids(deletes.get(variant)):
+                if term_id in matched:
+                    continue
+                matched.add(term_id)
+                found = edit_distance(term, self._term_text[term_id], distance)
+                if found <= distance:
+                    yield found, term_id
+
+    def lookup(self, query: str, limit: int = 10) -> List[int]:
+        """模糊查询，query 需已归一化；按 (编辑距离, 键类型, 文档顺序) 排序"""
+        probes = [(FUZZY_TEXT, query)]
+        pinyin = to_pinyin(query)
+        if pinyin:
+            probes.append((FUZZY_PINYIN, pinyin))
+        if query.isascii() and query.isalpha():
+            probes.append((FUZZY_INITIALS, query))
+
+        best: Dict[int, Tuple[int, int]] = {}
+        for kind, term in probes:
+            order = FUZZY_KIND_ORDER[kind]
+            for distance, term_id in self._probe(kind, term):
+                score = (distance, order)
+                for doc in _ids(self._term_docs[term_id]):
+                    if doc not in best or score < best[doc]:
+                        best[doc] = score
+        return sorted(best, key=lambda doc: (best[doc], doc))[:limit]
+
+
+class CatalogIndex:
+    """歌曲目录倒排索引
+
+    每个字段分别建立完整值与 n-gram 两类倒排链，并按字段维护去重后的有序值列表，
+    前缀匹配用二分查找定位，只访问真正以查询开头的值。
+    检索时按 完全匹配 > 前缀匹配 > 包含匹配、歌名 > 歌手 > 专辑 的顺序
+    逐层扫描，凑够 limit 条即停止，不必遍历全部候选；
+    没有完全匹配且仍不足 limit 条时再用模糊索引补足。
+    """
+
+    def __init__(self, songs: Iterable[Dict[str, Any]] = (), ngram: int = 2,
+                 fuzzy: bool = True, max_distance: int = 1):
+        self.ngram = ngram
+        self._fuzzy = FuzzyIndex(max_distance) if fuzzy else None
+        self._songs: List[Dict[str, Any]] = []
+        self._fields: List[Tuple[str, ...]] = []
+        self._postings: Dict[str, array] = {}
+        self._by_id: Dict[str, int] = {}
+        # 每个字段去重后的值，查询前按需排序
+        self._values: List[List[str]] = [[] for _ in INDEXED_FIELDS]
+        self._values_sorted = [True] * len(INDEXED_FIELDS)
+        for song in songs:
+            self.add(song)
+        self.sort_values()
+
+    def __len__(self) -> int:
+        return len(self._songs)
+
+    def _append(self, key: str, doc: int) -> bool:
+        """追加到倒排链，返回是否新建了该键"""
+        posting = self._postings.get(key)
+        if posting is None:
+            self._postings[key] = array("I", (doc,))
+            return True
+        posting.append(doc)
+        return False
+
+    def add(self, song: Dict[str, Any]):
+        """添加一首歌曲到索引"""
+        doc = len(self._songs)
+        fields = tuple(normalize_text(str(song.get(field) or "")) for field in INDEXED_FIELDS)
+        self._songs.append(song)
+        self._fields.append(fields)
+        self._by_id[str(song["id"])] = doc
+
+        for rank, value in enumerate(fields):
+            if not value:
+                continue
+            if self._append(f"{rank}={value}", doc):
+                self._values[rank].append(value)
+                self._values_sorted[rank] = False
+            for gram in iter_ngrams(value, self.ngram):
+                self._append(f"{rank}:{gram}", doc)
+            if self._fuzzy is not None:
+                self._fuzzy.add(doc, value)
+
+    def get(self, song_id: str) -> Optional[Dict[str, Any]]:
+        """按ID获取歌曲"""
+        doc = self._by_id.get(str(song_id))
+        return self._songs[doc] if doc is not None else None
+
+    def sort_values(self):
+        """整理各字段的有序值列表；批量添加后调用，避免首次查询时排序"""
+        for rank in range(len(INDEXED_FIELDS)):
+            self._sorted_values(rank)
+
+    def _sorted_values(self, rank: int) -> List[str]:
+        values = self._values[rank]
+        if not self._values_sorted[rank]:
+            # 增量添加后列表基本有序，Timsort 接近线性
+            values.sort()
+            self._values_sorted[rank] = True
+        return values
+
+    def _prefix_candidates(self, rank: int, query: str) -> Iterator[int]:
+        """以 query 开头的字段值对应的文档，按值的字典序"""
+        values = self._sorted_values(rank)
+        for i in range(bisect_left(values, query), len(values)):
+            value = values[i]
+            if not value.startswith(query):
+                return
+            yield from self._postings[f"{rank}={value}"]
+
+    def _candidates(self, rank: int, match: int, query: str) -> Iterable[int]:
+        """获取某字段某匹配类型的候选文档"""
+        if match == MATCH_EXACT:
+            return self._postings.get(f"{rank}={query}", ())
+        if match == MATCH_PREFIX:
+            return self._prefix_candidates(rank, query)
+
+        postings = []
+        for gram in query_ngrams(query, self.ngram):
+            posting = self._postings.get(f"{rank}:{gram}")
+            if posting is None:
+                return ()
+            postings.append(posting)
+        return min(postings, key=len)
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """检索歌曲，按匹配程度排序返回前limit条"""
+        query = normalize_text(query)
+        if not query or limit <= 0:
+            return []
+
+        found: List[int] = []
+        seen = set()
+        exact = False
+        for match in (MATCH_EXACT, MATCH_PREFIX, MATCH_CONTAINS):
+            for rank in range(len(INDEXED_FIELDS)):
+                for doc in self._candidates(rank, match, query):
+                    if doc in seen:
+                        continue
+                    if match == MATCH_CONTAINS and query not in self._fields[doc][rank]:
+                        continue
+                    seen.add(doc)
+                    found.append(doc)
+                    if len(found) >= limit:
+                        return [self._songs[i] for i in found]
+            if match == MATCH_EXACT:
+                exact = bool(found)
+
+        # 模糊匹配只在没有完全匹配、结果不足时补充
+        if self._fuzzy is not None and not exact:
+            for doc in self._fuzzy.lookup(query, limit):
+                if doc not in seen:
+                    seen.add(doc)
+                    found.append(doc)
+                    if len(found) >= limit:
+                        break
+        return [self._songs[i] for i in found]
+
+
+def load_catalog(path: str) -> List[Dict[str, Any]]:
+    """从JSON数组或JSON Lines文件加载曲库"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
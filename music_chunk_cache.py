@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+音频分块磁盘缓存
+按 歌曲ID哈希 + 分块序号 保存上游音频，多台音响播放同一首歌时只从上游拉取一次；
+按总字节数做LRU淘汰，下载中断的歌曲下次只补拉缺失的分块，重启后从目录恢复索引；
+多个工作进程可以共用同一目录，彼此下载的分块直接复用；每个进程按自己的 max_bytes 淘汰，
+共用目录时总占用可达 进程数 × max_bytes，服务器按进程数平分预算
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from music_metrics import UPSTREAM_LATENCY
+
+logger = logging.getLogger(__name__)
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-\d+/(\d+)")
+_CHUNK_FILE = re.compile(r"^([0-9a-f]{40})\.(\d+)$")
+
+# 超过该时间(秒)仍未完成的 .part 文件视为中断的下载，启动时清理
+STALE_PART_AGE = 600
+
+# 下载时攒够该字节数再交给线程池写盘
+WRITE_BUFFER_SIZE = 256 * 1024
+
+
+class RangeNotSupported(Exception):
+    """上游不支持 Range 请求，无法分块缓存"""
+
+
+class TrackInfo:
+    """歌曲的总长度与类型，由第一个分块的响应得到"""
+
+    __slots__ = ("length", "content_type")
+
+    def __init__(self, length: int, content_type: str):
+        self.length = length
+        self.content_type = content_type
+
+
+class ChunkCache:
+    """音频分块缓存
+
+    文件名为 <sha1(song_id)>.<index>，歌曲信息保存在 <sha1(song_id)>.json；
+    相同分块的并发请求只触发一次上游下载，下载先写入 .part 文件，完成后原子改名。
+    查找分块、读取歌曲信息、下载时的写盘、改名与淘汰删除都在线程池中执行，不阻塞事件循环；
+    启动时扫描目录恢复索引除外。
+    """
+
+    def __init__(self, directory: str, chunk_size: int = 1024 * 1024, max_bytes: int = 1024 ** 3):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._chunks: "OrderedDict[Tuple[str, int], int]" = OrderedDict()
+        self._tracks: Dict[str, TrackInfo] = {}
+        self._inflight: Dict[Tuple[str, int], asyncio.Task] = {}
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def track_key(song_id: str) -> str:
+        return hashlib.sha1(str(song_id).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, index: int) -> str:
+        return os.path.join(self.directory, f"{key}.{index}")
+
+    def _load_index(self):
+        """扫描缓存目录，按修改时间恢复LRU顺序"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".part"):
+                # 其他工作进程可能正在写入，只清理过期的
+                if os.stat(path).st_mtime < time.time() - STALE_PART_AGE:
+                    os.remove(path)
+                continue
+            match = _CHUNK_FILE.match(name)
+            if match:
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, match.group(1), int(match.group(2)), stat.st_size))
+            elif name.endswith(".json"):
+                info = self._read_track(name[:-5])
+                if info is not None:
+                    self._tracks[name[:-5]] = info
+        for _, key, index, size in sorted(entries):
+            self._chunks[(key, index)] = size
+            self.size += size
+        self._remove_files(self._evict())
+        if self._chunks:
+            logger.info("音频缓存: %d 个分块，%d 字节", len(self._chunks), self.size)
+
+    def _read_track(self, key: str) -> Optional[TrackInfo]:
+        try:
+            with open(os.path.join(self.directory, f"{key}.json"), encoding="utf-8") as f:
+                info = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        return TrackInfo(info["length"], info["content_type"])
+
+    async def track(self, song_id: str) -> Optional[TrackInfo]:
+        """已知的歌曲信息，本进程未见过时在线程池中读取其他工作进程保存的信息"""
+        key = self.track_key(song_id)
+        info = self._tracks.get(key)
+        if info is None:
+            info = await asyncio.get_running_loop().run_in_executor(None, self._read_track, key)
+            if info is not None:
+                self._tracks[key] = info
+        return info
+
+    async def get(self, client: httpx.AsyncClient, song_id: str, url: str, index: int) -> str:
+        """返回分块文件路径，未缓存时从上游下载"""
+        loop = asyncio.get_running_loop()
+        key = self.track_key(song_id)
+        path = self._path(key, index)
+        size = await loop.run_in_executor(None, self._file_size, path)
+        if (key, index) in self._chunks:
+            if size is not None:
+                self._chunks.move_to_end((key, index))
+                self.hits += 1
+                return path
+            # 已被其他工作进程淘汰
+            self.size -= self._chunks.pop((key, index))
+        elif size is not None and await self.track(song_id) is not None:
+            # 其他工作进程已下载
+            removed = self._add(key, index, size)
+            if removed:
+                await loop.run_in_executor(None, self._remove_files, removed)
+            self.hits += 1
+            return path
+
+        self.misses += 1
+        task = self._inflight.get((key, index))
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(client, key, url, index))
+            self._inflight[(key, index)] = task
+            task.add_done_callback(lambda done: self._finish((key, index), done))
+        return await asyncio.shield(task)
+
+    async def open_chunk(self, client: httpx.AsyncClient, song_id: str, url: str, index: int):
+        """返回已打开的分块文件；分块在取得路径后被淘汰时重新下载一次，仍然失败时抛出 FileNotFoundError"""
+        loop = asyncio.get_running_loop()
+        path = await self.get(client, song_id, url, index)
+        try:
+            return await loop.run_in_executor(None, open, path, "rb")
+        except FileNotFoundError:
+            # 本进程或共用目录的其他进程刚好淘汰了该分块
+            path = await self.get(client, song_id, url, index)
+            return await loop.run_in_executor(None, open, path, "rb")
+
+    @staticmethod
+    def _file_size(path: str) -> Optional[int]:
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+
+    def _finish(self, chunk: Tuple[str, int], task: asyncio.Task):
+        self._inflight.pop(chunk, None)
+        if not task.cancelled():
+            # 取出异常，等待者已全部离开时避免 "exception was never retrieved" 警告
+            task.exception()
+
+    async def _fetch(self, client: httpx.AsyncClient, key: str, url: str, index: int) -> str:
+        loop = asyncio.get_running_loop()
+        start = index * self.chunk_size
+        headers = {"Range": f"bytes={start}-{start + self.chunk_size - 1}"}
+        path = self._path(key, index)
+        part = f"{path}.{os.getpid()}.part"
+        started = time.perf_counter()
+        f = None
+        try:
+            async with client.stream("GET", url, headers=headers) as response:
+                UPSTREAM_LATENCY.observe(time.perf_counter() - started, "stream_cache",
+                                         "ok" if response.status_code in (206, 416) else "error")
+                if response.status_code == 416:
+                    raise IndexError(f"分块超出音频长度: {index}")
+                match = _CONTENT_RANGE.match(response.headers.get("content-range", ""))
+                if response.status_code != 206 or not match or int(match.group(1)) != start:
+                    raise RangeNotSupported(url)
+                length = int(match.group(2))
+                if start >= length:
+                    raise IndexError(f"分块超出音频长度: {index}")
+                if key not in self._tracks:
+                    await self._save_track(key, TrackInfo(
+                        length, response.headers.get("content-type", "audio/mpeg")))
+                f = await loop.run_in_executor(None, open, part, "wb")
+                buffer = bytearray()
+                async for piece in response.aiter_raw():
+                    buffer += piece
+                    if len(buffer) >= WRITE_BUFFER_SIZE:
+                        data, buffer = buffer, bytearray()
+                        await loop.run_in_executor(None, f.write, data)
+            size = await loop.run_in_executor(None, self._commit, f, bytes(buffer), part, path)
+        except BaseException:
+            # 再次取消时清理仍会在线程池中完成
+            await asyncio.shield(loop.run_in_executor(None, self._discard, f, part))
+            raise
+
+        removed = self._add(key, index, size)
+        if removed:
+            await loop.run_in_executor(None, self._remove_files, removed)
+        return path
+
+    @staticmethod
+    def _commit(f, tail: bytes, part: str, path: str) -> int:
+        """写入剩余数据并把 .part 文件原子改名为分块文件，返回文件大小"""
+        with f:
+            f.write(tail)
+        os.replace(part, path)
+        return os.path.getsize(path)
+
+    @staticmethod
+    def _discard(f, part: str):
+        if f is not None:
+            f.close()
+        if os.path.exists(part):
+            os.remove(part)
+
+    def _add(self, key: str, index: int, size: int) -> List[str]:
+        """登记分块，返回因超出预算需要删除的文件"""
+        self.size += size - self._chunks.pop((key, index), 0)
+        self._chunks[(key, index)] = size
+        return self._evict()
+
+    async def _save_track(self, key: str, info: TrackInfo):
+        self._tracks[key] = info
+        path = os.path.join(self.directory, f"{key}.json")
+        content = json.dumps({"length": info.length, "content_type": info.content_type})
+        await asyncio.get_running_loop().run_in_executor(None, self._write_text, path, content)
+
+    @staticmethod
+    def _write_text(path: str, content: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def _evict(self) -> List[str]:
+        """超过字节预算时淘汰最久未使用的分块，返回要删除的文件；正在发送的文件删除后仍可读完"""
+        removed = []
+        while self.size > self.max_bytes and self._chunks:
+            (key, index), size = self._chunks.popitem(last=False)
+            self.size -= size
+            removed.append(self._path(key, index))
+        return removed
+
+    @staticmethod
+    def _remove_files(paths: List[str]):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "chunks": len(self._chunks),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON 编解码
+安装了 orjson 或 msgspec 时优先使用，否则回退到标准库 json；
+可通过 MUSIC_JSON_CODEC=orjson|msgspec|json 指定。编码结果统一为 UTF-8 bytes
+"""
+
+import importlib.util
+import json
+import logging
+import os
+from typing import Any, Callable, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+# 按优先级排列的可选实现
+PREFERRED_CODECS = ("orjson", "msgspec", "json")
+
+
+class JSONCodec:
+    """一组 loads/dumps 实现；decode_errors 为解析失败时可能抛出的异常类型"""
+
+    def __init__(self, name: str, loads: Callable[[Any], Any], dumps: Callable[[Any], bytes],
+                 decode_errors: Tuple[Type[BaseException], ...]):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.decode_errors = decode_errors
+
+
+def _orjson_codec() -> JSONCodec:
+    import orjson
+    return JSONCodec("orjson", orjson.loads, orjson.dumps, (orjson.JSONDecodeError,))
+
+
+def _msgspec_codec() -> JSONCodec:
+    import msgspec
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+    return JSONCodec("msgspec", decoder.decode, encoder.encode,
+                     (msgspec.DecodeError, UnicodeDecodeError))
+
+
+def _stdlib_codec() -> JSONCodec:
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    return JSONCodec("json", json.loads, lambda obj: encoder.encode(obj).encode("utf-8"),
+                     (json.JSONDecodeError, UnicodeDecodeError))
+
+
+_FACTORIES = {
+    "orjson": _orjson_codec,
+    "msgspec": _msgspec_codec,
+    "json": _stdlib_codec,
+}
+
+
+def get_codec(name: Optional[str] = None) -> JSONCodec:
+    """按名称创建编解码器；未指定时选择已安装的最快实现"""
+    if name:
+        if name not in _FACTORIES:
+            raise ValueError(f"未知的JSON编解码器: {name}")
+        if name == "json" or importlib.util.find_spec(name) is not None:
+            return _FACTORIES[name]()
+        logger.warning("未安装 %s，使用默认JSON编解码器", name)
+    for candidate in PREFERRED_CODECS:
+        if candidate == "json" or importlib.util.find_spec(candidate) is not None:
+            return _FACTORIES[candidate]()
+    return _stdlib_codec()
+
+
+codec = get_codec(os.getenv("MUSIC_JSON_CODEC"))
+loads = codec.loads
+dumps = codec.dumps
+DECODE_ERRORS = codec.decode_errors
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON-RPC 2.0 公共工具
+两个MCP服务器共用的错误码、错误响应、批量请求调度与响应编码
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from music_codec import dumps
+
+# JSON-RPC 标准错误码
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+# 不修改状态、可在批量请求中并发执行的方法
+READ_ONLY_METHODS = frozenset({
+    "initialize",
+    "tools/list",
+    "resources/list",
+    "resources/read",
+})
+
+
+class InvalidParams(ValueError):
+    """请求参数无效，响应 INVALID_PARAMS"""
+
+
+def make_error(msg_id: Any, code: int, message: str) -> Dict[str, Any]:
+    """构造错误响应"""
+    return {
+        "jsonrpc": "2.0",
+        "id": msg_id,
+        "error": {
+            "code": code,
+            "message": message
+        }
+    }
+
+
+def is_notification(request: Any) -> bool:
+    """没有 id 字段的请求是通知，不需要响应"""
+    return isinstance(request, dict) and "id" not in request
+
+
+async def run_batch(batch: List[Any],
+                    handle: Callable[[Any], Awaitable[Optional[Dict[str, Any]]]],
+                    is_read_only: Callable[[Any], bool]) -> Optional[Any]:
+    """执行批量请求
+
+    相邻的只读请求并发执行；会修改状态的请求按原顺序逐个执行，
+    并作为屏障保证其前后请求看到的状态与串行执行一致。
+    返回响应数组；全部为通知时返回 None；空数组返回单个错误响应。
+    """
+    if not batch:
+        return make_error(None, INVALID_REQUEST, "空的批量请求")
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(batch)
+    pending: List[int] = []
+
+    async def flush():
+        if pending:
+            responses = await asyncio.gather(*(handle(batch[i]) for i in pending))
+            for i, response in zip(pending, responses):
+                results[i] = response
+            pending.clear()
+
+    for i, request in enumerate(batch):
+        if is_read_only(request):
+            pending.append(i)
+        else:
+            await flush()
+            results[i] = await handle(request)
+    await flush()
+
+    responses = [response for response in results if response is not None]
+    return responses or None
+
+
+class RawJSON(bytes):
+    """已序列化的JSON片段，编码响应时原样拼接，不再重复序列化"""
+
+
+# 响应信封模板，只有 id 与 result/error 需要编码
+_RESULT_ENVELOPE = b'{"jsonrpc":"2.0","id":%b,"result":%b}'
+_ERROR_ENVELOPE = b'{"jsonrpc":"2.0","id":%b,"error":%b}'
+
+
+def encode_message(message: Any) -> bytes:
+    """编码响应(或批量响应数组)为UTF-8 JSON"""
+    if isinstance(message, list):
+        return b"[" + b",".join(encode_message(item) for item in message) + b"]"
+    if "result" in message:
+        result = message["result"]
+        if not isinstance(result, RawJSON):
+            result = dumps(result)
+        return _RESULT_ENVELOPE % (dumps(message.get("id")), result)
+    if "error" in message:
+        return _ERROR_ENVELOPE % (dumps(message.get("id")), dumps(message["error"]))
+    return dumps(message)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志配置
+日志记录放入队列，由后台线程格式化并写出，请求处理不等待 stderr；
+相同消息模板超过速率上限时丢弃并在之后汇报丢弃数；
+每个请求的日志按比例采样，可选按比例记录 tools/call 的追踪片段；
+LOG_FORMAT=json 时输出带 request_id、耗时等字段的结构化日志
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+# 当前请求ID，由服务器在处理请求时设置，附加到期间产生的所有日志
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# 结构化日志中除标准属性外需要输出的字段
+_STANDARD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+request_logger = logging.getLogger("music.request")
+trace_logger = logging.getLogger("music.trace")
+
+
+class ContextFilter(logging.Filter):
+    """附加当前请求ID"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """按调用位置限速的令牌桶，每秒最多 rate 条，允许 burst 条突发
+
+    以 (logger, 级别, 文件, 行号) 为键，预先格式化好的消息(例如 f-string 中带有异常文本)
+    也归入同一个桶，不会因内容不同绕过限速。
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        # 键 -> [令牌数, 上次更新时间, 丢弃数]
+        self._buckets: Dict[Tuple[str, int, str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.levelno, record.pathname, record.lineno)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                self._buckets.clear()
+            bucket = self._buckets[key] = [self.burst, now, 0]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.dropped = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """每条日志一行JSON，extra 传入的字段原样输出"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """与 basicConfig 相同的文本格式，附带请求ID与丢弃数"""
+
+    def __init__(self):
+        super().__init__("%(levelname)s:%(name)s:%(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if getattr(record, "request_id", None) is not None:
+            text += f" [request_id={record.request_id}]"
+        if getattr(record, "dropped", None):
+            text += f" (此前限速丢弃 {record.dropped} 条)"
+        return text
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """只在调用线程合并异常信息，消息格式化留给后台线程"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _LoggingState:
+    handler: Optional[logging.Handler] = None
+    output: Optional[logging.Handler] = None
+    listener: Optional[logging.handlers.QueueListener] = None
+    sample_rate = 1.0
+    trace_rate = 0.0
+
+
+_state = _LoggingState()
+
+
+def _start_listener():
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _state.handler.queue = log_queue
+    _state.listener = logging.handlers.QueueListener(log_queue, _state.output, respect_handler_level=True)
+    _state.listener.start()
+
+
+def _restart_in_child():
+    """fork 后子进程没有后台线程，换用新的队列重新启动"""
+    if _state.listener is not None:
+        _start_listener()
+
+
+def _stop_listener():
+    if _state.listener is not None:
+        _state.listener.stop()
+        _state.listener = None
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None,
+                  use_queue: Optional[bool] = None, rate_limit: Optional[float] = None,
+                  sample_rate: Optional[float] = None, trace_rate: Optional[float] = None):
+    """配置根日志；参数未给出时读取 LOG_LEVEL / LOG_FORMAT / LOG_ASYNC / LOG_RATE_LIMIT /
+    LOG_SAMPLE_RATE / TRACE_SAMPLE_RATE 环境变量"""
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    fmt = fmt or os.getenv("LOG_FORMAT", "text")
+    if use_queue is None:
+        use_queue = os.getenv("LOG_ASYNC", "1") != "0"
+    if rate_limit is None:
+        rate_limit = float(os.getenv("LOG_RATE_LIMIT", 50))
+    _state.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+    _state.trace_rate = trace_rate if trace_rate is not None else float(os.getenv("TRACE_SAMPLE_RATE", 0))
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JSONFormatter() if fmt == "json" else TextFormatter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    _stop_listener()
+
+    if use_queue:
+        _state.output = output
+        _state.handler = handler = _QueueHandler(None)
+        _start_listener()
+    else:
+        handler = output
+    handler.addFilter(ContextFilter())
+    if rate_limit > 0:
+        handler.addFilter(RateLimitFilter(rate_limit))
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_in_child)
+atexit.register(_stop_listener)
+
+
+def log_request(method: Any, msg_id: Any, duration: float, error_code: Optional[int] = None):
+    """按 LOG_SAMPLE_RATE 采样记录一条请求日志"""
+    if _state.sample_rate <= 0 or not request_logger.isEnabledFor(logging.INFO):
+        return
+    if _state.sample_rate < 1 and random.random() >= _state.sample_rate:
+        return
+    request_logger.info("请求 %s 完成，耗时 %.2fms", method, duration * 1000, extra={
+        "method": method,
+        "id": msg_id,
+        "duration_ms": round(duration * 1000, 3),
+        "error_code": error_code,
+        "sample_rate": _state.sample_rate
+    })
+
+
+class Span:
+    """追踪片段，finish 时写入 music.trace 日志"""
+
+    __slots__ = ("name", "trace_id", "attributes", "started")
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.attributes = attributes
+        self.started = time.perf_counter()
+
+    def finish(self, status: str = "ok", **attributes):
+        duration = time.perf_counter() - self.started
+        trace_logger.info("%s %s %.2fms", self.name, status, duration * 1000, extra={
+            "span": self.name,
+            "trace_id": self.trace_id,
+            "status": status,
+            "duration_ms": round(duration * 1000, 3),
+            **self.attributes,
+            **attributes
+        })
+
+
+def start_span(name: str, **attributes) -> Optional[Span]:
+    """按 TRACE_SAMPLE_RATE 采样开始追踪片段，未采中时返回None"""
+    if _state.trace_rate <= 0 or random.random() >= _state.trace_rate:
+        return None
+    return Span(name, attributes)
@@ -6,82 +6,246 @@
 """
 
 import asyncio
-import json
-import sys
+import hmac
+import os
+import time
 from typing import Any, Dict, List, Optional
 import httpx
 import logging
 
+from music_cache import MetadataCache, SearchCache
+from music_codec import DECODE_ERRORS, loads
+from music_jsonrpc import (INTERNAL_ERROR, INVALID_PARAMS, INVALID_REQUEST, METHOD_NOT_FOUND,
+                           PARSE_ERROR, READ_ONLY_METHODS, InvalidParams, RawJSON, encode_message,
+                           is_notification, make_error, run_batch)
+from music_logging import log_request, request_id, setup_logging, start_span
+from music_metrics import (ERRORS, REQUEST_LATENCY, REQUESTS, TOOL_CALLS, TOOL_LATENCY,
+                           cache_counters, record_response, serve_metrics)
+from music_playlist import REPEAT_ALL, REPEAT_OFF, REPEAT_ONE
+from music_prefetch import Prefetcher
+from music_profiling import LoopMonitor, Profiler, install_profiling, profile_command
+from music_providers import create_providers, fan_out_search
+from music_registry import ToolRegistry
+from music_render import (PLAYLIST_OUTPUT_SCHEMA, SEARCH_OUTPUT_SCHEMA, ToolResult, call_result,
+                          render_playlist, render_search)
+from music_schema import SchemaError
+from music_session import SessionManager
+from music_stdio import DEFAULT_LINE_LIMIT, open_stdio, read_line
+from music_text import normalize_text
+
 # 简化的MCP服务器实现
 class MCPServer:
     def __init__(self, name: str):
         self.name = name
-        self.tools = []
-        self.resources = []
+        self.registry = ToolRegistry()
+        self.tools = self.registry.tools
+        self.resources = self.registry.resources
+        # 方法分发表
+        self._methods = {
+            'tools/list': self._tools_list,
+            'tools/call': self._tools_call,
+            'resources/list': self._resources_list,
+        }
+        if ADMIN_TOKEN:
+            self._methods['admin/profile'] = self._admin_profile
         
-    def add_tool(self, name: str, description: str, schema: dict, handler):
-        self.tools.append({
-            'name': name,
-            'description': description,
-            'schema': schema,
-            'handler': handler
-        })
+    def add_tool(self, name: str, description: str, schema: dict, handler, read_only: bool = False,
+                 output_schema: Optional[dict] = None):
+        self.registry.add_tool(name, description, schema, handler, read_only, output_schema)
     
     def add_resource(self, uri: str, name: str, description: str):
-        self.resources.append({
-            'uri': uri,
-            'name': name,
-            'description': description
-        })
+        self.registry.add_resource(uri, name, description)
     
-    async def handle_request(self, request: dict) -> dict:
+    def is_read_only(self, request: Any) -> bool:
+        """判断请求是否可以在批量请求中并发执行"""
+        if not isinstance(request, dict):
+            return True
         method = request.get('method')
-        params = request.get('params', {})
+        if method == 'tools/call':
+            params = request.get('params')
+            tool = self.registry.get_tool(params.get('name') if isinstance(params, dict) else None)
+            return bool(tool and tool['readOnly'])
+        return method in READ_ONLY_METHODS
+    
+    async def handle_message(self, message: Any) -> Optional[Any]:
+        """处理单个请求或批量数组，返回JSON-RPC响应；通知返回None"""
+        if isinstance(message, list):
+            return await run_batch(message, self._handle_single, self.is_read_only)
+        return await self._handle_single(message)
+    
+    async def _handle_single(self, request: Any) -> Optional[dict]:
+        if not isinstance(request, dict):
+            return make_error(None, INVALID_REQUEST, 'Invalid request')
         
-        if method == 'tools/list':
-            return {
-                'tools': [{
-                    'name': tool['name'],
-                    'description': tool['description'],
-                    'inputSchema': tool['schema']
-                } for tool in self.tools]
-            }
-        elif method == 'tools/call':
-            tool_name = params.get('name')
-            arguments = params.get('arguments', {})
-            
-            for tool in self.tools:
-                if tool['name'] == tool_name:
-                    result = await tool['handler'](arguments)
-                    return {'content': [{'type': 'text', 'text': result}]}
-            
-            return {'error': f'Unknown tool: {tool_name}'}
-        elif method == 'resources/list':
-            return {'resources': self.resources}
+        msg_id = request.get('id')
+        method = request.get('method')
+        started = time.perf_counter()
+        request_id.set(msg_id)
+        try:
+            result = await self.handle_request(request)
+        except (SchemaError, InvalidParams) as e:
+            response = make_error(msg_id, INVALID_PARAMS, str(e))
+        except Exception as e:
+            response = make_error(msg_id, INTERNAL_ERROR, str(e))
+        else:
+            if isinstance(result, dict) and 'error' in result:
+                response = make_error(msg_id, METHOD_NOT_FOUND, result['error'])
+            else:
+                response = {'jsonrpc': '2.0', 'id': msg_id, 'result': result}
+        
+        elapsed = time.perf_counter() - started
+        # 未知方法统一计为 other，避免客户端随意的方法名产生大量标签
+        if method in self._methods:
+            REQUESTS.inc(method)
+            REQUEST_LATENCY.observe(elapsed, method)
         else:
+            REQUESTS.inc('other')
+        log_request(method, msg_id, elapsed, record_response(response))
+        return None if is_notification(request) else response
+    
+    async def handle_request(self, request: dict) -> dict:
+        method = request.get('method')
+        handler = self._methods.get(method)
+        if handler is None:
             return {'error': f'Unknown method: {method}'}
+        params = request.get('params')
+        if params is None:
+            params = {}
+        elif not isinstance(params, dict):
+            raise InvalidParams('Params must be an object')
+        return await handler(params)
+    
+    async def _tools_list(self, params: dict) -> RawJSON:
+        return self.registry.tools_list()
+    
+    async def _tools_call(self, params: dict) -> dict:
+        tool_name = params.get('name')
+        arguments = params.get('arguments', {})
+        
+        tool = self.registry.get_tool(tool_name)
+        if tool is None:
+            return {'error': f'Unknown tool: {tool_name}'}
+        arguments = tool['validate'](arguments)
+        span = start_span('tools/call', tool=tool_name)
+        started = time.perf_counter()
+        try:
+            result = await tool['handler'](arguments)
+        except Exception as e:
+            TOOL_CALLS.inc(tool_name, 'error')
+            if span is not None:
+                span.finish('error', error=str(e))
+            raise
+        elapsed = time.perf_counter() - started
+        TOOL_LATENCY.observe(elapsed, tool_name)
+        TOOL_CALLS.inc(tool_name, 'ok')
+        profiler.record_call(tool_name, arguments, elapsed)
+        if span is not None:
+            span.finish()
+        return call_result(result)
+    
+    async def _resources_list(self, params: dict) -> RawJSON:
+        return self.registry.resources_list()
+    
+    async def _admin_profile(self, params: dict) -> dict:
+        """开始/结束性能剖析窗口或查询状态，需要 ADMIN_TOKEN"""
+        if not hmac.compare_digest(str(params.get('token', '')).encode(), ADMIN_TOKEN.encode()):
+            raise InvalidParams('Invalid admin token')
+        try:
+            return profile_command(profiler, params.get('action', 'status'),
+                                   params.get('seconds', PROFILE_WINDOW))
+        except ValueError as e:
+            raise InvalidParams(str(e))
     
-    async def run_stdio(self):
-        while True:
+    async def run_stdio(self, max_concurrency: int = 16, line_limit: int = DEFAULT_LINE_LIMIT):
+        """通过标准输入输出提供服务
+        
+        每行消息作为独立任务处理，响应按完成顺序写出，由客户端按 id 匹配；
+        修改播放状态的请求(以及包含这类请求的批量请求)依次执行，保持客户端发送的顺序。输入结束后等待处理中的请求完成。
+        """
+        reader, writer = await open_stdio(line_limit)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        ordered = asyncio.Lock()
+        # (响应, 是否占用并发名额)；名额在响应写出之后才释放，宿主不读取输出时暂停读取新请求
+        outbox: asyncio.Queue = asyncio.Queue()
+        tasks = set()
+        
+        async def dispatch(line: bytes):
+            response = None
             try:
-                line = await asyncio.get_event_loop().run_in_executor(None, sys.stdin.readline)
+                request = loads(line)
+                # 包含修改状态请求的批量请求同样排队，不与其他修改交错
+                batch = request if isinstance(request, list) else [request]
+                if not all(self.is_read_only(item) for item in batch):
+                    async with ordered:
+                        response = await self.handle_message(request)
+                else:
+                    response = await self.handle_message(request)
+            except DECODE_ERRORS as e:
+                ERRORS.inc(PARSE_ERROR)
+                response = make_error(None, PARSE_ERROR, f'Parse error: {e}')
+            except Exception as e:
+                response = make_error(None, INTERNAL_ERROR, str(e))
+            finally:
+                if response is None:
+                    semaphore.release()
+                else:
+                    outbox.put_nowait((response, True))
+        
+        async def write_loop():
+            while True:
+                # 一次取出所有已完成的响应，合并为一次写入
+                items = [await outbox.get()]
+                while not outbox.empty():
+                    items.append(outbox.get_nowait())
+                try:
+                    writer.write(b''.join(encode_message(response) + b'\n' for response, _ in items))
+                    await writer.drain()
+                finally:
+                    for _, permit in items:
+                        if permit:
+                            semaphore.release()
+                        outbox.task_done()
+        
+        writing = asyncio.create_task(write_loop())
+        try:
+            while True:
+                try:
+                    line = await read_line(reader)
+                except ValueError:
+                    # 超过 line_limit 的消息整行丢弃，只回复一次错误
+                    outbox.put_nowait((make_error(None, INVALID_REQUEST, 'Message too large'), False))
+                    continue
                 if not line:
                     break
-                
-                request = json.loads(line.strip())
-                response = await self.handle_request(request)
-                
-                print(json.dumps(response))
-                sys.stdout.flush()
-            except Exception as e:
-                error_response = {'error': str(e)}
-                print(json.dumps(error_response))
-                sys.stdout.flush()
-
-# 配置日志
-logging.basicConfig(level=logging.INFO)
+                if not line.strip():
+                    continue
+                # 达到并发上限(含未写出的响应)时暂停读取
+                await semaphore.acquire()
+                task = asyncio.create_task(dispatch(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            await outbox.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            writing.cancel()
+            writer.close()
+    
+# 配置日志，输出到 stderr，stdout 只用于协议消息
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# 性能剖析：SIGUSR1 或 admin/profile 开启 PROFILE_WINDOW 秒的剖析窗口，结果写入 PROFILE_DIR；
+# 最慢的 PROFILE_SLOWEST 次工具调用始终记录(admin/profile action=slowest 查询)；
+# LOOP_MONITOR=1 时监视事件循环阻塞。设置 ADMIN_TOKEN 后才提供 admin/profile 方法
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_WINDOW = float(os.getenv('PROFILE_WINDOW', 30))
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+profiler = Profiler(PROFILE_DIR, slowest=int(os.getenv('PROFILE_SLOWEST', 20)))
+
 # 创建MCP服务器实例
 server = MCPServer("music-mcp-server")
 
@@ -92,14 +256,35 @@ MUSIC_APIS = {
     "kugou": "http://mobilecdn.kugou.com/api/v3/search/song"
 }
 
-# 当前播放状态
-playback_state = {
-    "current_song": None,
-    "playlist": [],
-    "is_playing": False,
-    "volume": 50,
-    "position": 0
-}
+# 上游提供方，通过 MUSIC_PROVIDERS 环境变量启用，每个提供方共享一个连接池
+providers = create_providers(MUSIC_APIS)
+
+# 多提供方并发搜索的截止时间(秒)
+SEARCH_DEADLINE = float(os.getenv('MUSIC_SEARCH_DEADLINE', 2.0))
+
+# 搜索结果缓存
+search_cache = SearchCache(
+    max_size=int(os.getenv('SEARCH_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('SEARCH_CACHE_TTL', 300))
+)
+
+# 歌曲元数据与播放地址缓存；各上游播放地址有效期不同
+metadata_cache = MetadataCache(
+    ttl=float(os.getenv('METADATA_TTL', 600)),
+    negative_ttl=float(os.getenv('METADATA_NEGATIVE_TTL', 30)),
+    provider_ttls={"netease": 1200, "qq": 300, "kugou": 600}
+)
+
+# 缓存命中统计
+cache_counters("music_cache_requests_total",
+               {"search": search_cache.stats, "metadata": metadata_cache.stats},
+               ("hits", "misses", "coalesced", "stale_hits", "negative_hits"))
+
+# 播放状态；stdio 模式下只有一个客户端，使用默认会话
+sessions = SessionManager()
+
+# 下一首预取，在 main 中创建
+prefetcher: Optional[Prefetcher] = None
 
 # 添加资源
 server.add_resource("music://playlist", "当前播放列表", "显示当前的音乐播放列表")
@@ -107,7 +292,22 @@ server.add_resource("music://current", "当前播放", "显示当前正在播放
 
 async def search_music_api(query: str, limit: int = 10) -> List[Dict[str, Any]]:
     """调用免费音乐API搜索歌曲"""
-    # 这里使用模拟数据，实际使用时可以接入真实的免费音乐API
+    # 并发查询已启用的上游提供方，归一化后相同的查询共享缓存结果
+    searchable = providers.searchable()
+    if searchable:
+        async def load() -> List[Dict[str, Any]]:
+            results = await fan_out_search(searchable, query, limit, SEARCH_DEADLINE)
+            # 刚从上游取得的结果已带元数据，顺带预热元数据缓存，之后播放不必再查上游；
+            # 只在加载时写入，缓存命中的旧结果中的播放地址可能已过期，不能刷新其有效期
+            for song in results:
+                metadata_cache.put(song["id"], song, song.get("provider"))
+            return results
+        
+        results = await search_cache.get_or_load((normalize_text(query), limit), load)
+        if results:
+            return results
+    
+    # 全部失败或未启用时使用模拟数据
     mock_results = [
         {
             "id": f"song_{i}",
@@ -120,67 +320,77 @@ async def search_music_api(query: str, limit: int = 10) -> List[Dict[str, Any]]:
         for i in range(1, min(limit + 1, 6))
     ]
     
-    # 实际项目中，这里应该调用真实的音乐API
-    # 例如：
-    # async with httpx.AsyncClient() as client:
-    #     response = await client.get(f"{MUSIC_APIS['netease']}/search", params={"keywords": query})
-    #     data = response.json()
-    #     return parse_search_results(data)
-    
     return mock_results
 
+async def resolve_track(song_id: str) -> Optional[Dict[str, Any]]:
+    """获取歌曲元数据与播放地址；最近见过的歌曲直接返回缓存(过期时后台刷新)"""
+    provider_name, _, raw_id = song_id.partition(":")
+    provider = providers.get(provider_name) if raw_id else None
+    if provider is None:
+        # 模拟数据的歌曲ID没有提供方前缀
+        return {"id": song_id, "url": f"https://music.example.com/{song_id}.mp3", "duration": 240}
+    return await metadata_cache.get(song_id, lambda: provider.get_song(raw_id), provider_name)
+
 # 工具处理函数
-async def search_music_handler(arguments: Dict[str, Any]) -> str:
+async def search_music_handler(arguments: Dict[str, Any]) -> ToolResult:
     query = arguments["query"]
     limit = arguments.get("limit", 10)
     
     results = await search_music_api(query, limit)
-    
-    response = f"搜索 '{query}' 的结果：\n\n"
-    for i, song in enumerate(results, 1):
-        response += f"{i}. {song['name']} - {song['artist']}\n"
-        response += f"   专辑: {song['album']}\n"
-        response += f"   时长: {song['duration']}秒\n"
-        response += f"   ID: {song['id']}\n\n"
-    
-    return response
+    return render_search(query, results)
 
 async def play_music_handler(arguments: Dict[str, Any]) -> str:
     song_id = arguments["song_id"]
-    song_name = arguments.get("song_name", "未知歌曲")
-    artist = arguments.get("artist", "未知歌手")
     
-    playback_state["current_song"] = {
+    try:
+        track = await resolve_track(song_id) or {}
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning("获取歌曲信息失败 %s: %s", song_id, e)
+        track = {}
+    
+    song_name = arguments.get("song_name") or track.get("name") or "未知歌曲"
+    artist = arguments.get("artist") or track.get("artist") or "未知歌手"
+    
+    state = sessions.current()
+    state.current_song = {
         "id": song_id,
         "name": song_name,
-        "artist": artist
+        "artist": artist,
+        "url": track.get("url"),
+        "duration": track.get("duration")
     }
-    playback_state["is_playing"] = True
-    playback_state["position"] = 0
+    state.is_playing = True
+    state.position = 0
+    # 歌曲在播放列表中时，游标跟随，下一首从它之后继续
+    state.playlist.seek(song_id)
+    if prefetcher is not None:
+        prefetcher.request(state)
     
     return f"正在播放: {song_name} - {artist}"
 
 async def pause_music_handler(arguments: Dict[str, Any]) -> str:
-    playback_state["is_playing"] = False
+    sessions.current().is_playing = False
     return "音乐已暂停"
 
 async def resume_music_handler(arguments: Dict[str, Any]) -> str:
-    playback_state["is_playing"] = True
-    current = playback_state["current_song"]
+    state = sessions.current()
+    state.is_playing = True
+    current = state.current_song
     if current:
         return f"继续播放: {current['name']} - {current['artist']}"
     else:
         return "没有可继续播放的歌曲"
 
 async def stop_music_handler(arguments: Dict[str, Any]) -> str:
-    playback_state["is_playing"] = False
-    playback_state["current_song"] = None
-    playback_state["position"] = 0
+    state = sessions.current()
+    state.is_playing = False
+    state.current_song = None
+    state.position = 0
     return "音乐已停止"
 
 async def set_volume_handler(arguments: Dict[str, Any]) -> str:
     volume = arguments["volume"]
-    playback_state["volume"] = volume
+    sessions.current().volume = volume
     return f"音量已设置为: {volume}%"
 
 async def add_to_playlist_handler(arguments: Dict[str, Any]) -> str:
@@ -188,78 +398,73 @@ async def add_to_playlist_handler(arguments: Dict[str, Any]) -> str:
     song_name = arguments.get("song_name", "未知歌曲")
     artist = arguments.get("artist", "未知歌手")
     
+    playlist = sessions.current().playlist
+    if len(playlist) >= sessions.max_playlist_length:
+        return f"播放列表已满（最多 {sessions.max_playlist_length} 首）"
+    
     song = {
         "id": song_id,
         "name": song_name,
         "artist": artist
     }
-    playback_state["playlist"].append(song)
+    playlist.append(song)
     
     return f"已添加到播放列表: {song_name} - {artist}"
 
-async def get_playlist_handler(arguments: Dict[str, Any]) -> str:
-    playlist = playback_state["playlist"]
-    if not playlist:
-        return "播放列表为空"
-    
-    response = "当前播放列表:\n\n"
-    for i, song in enumerate(playlist, 1):
-        response += f"{i}. {song['name']} - {song['artist']}\n"
-    
-    return response
+async def get_playlist_handler(arguments: Dict[str, Any]) -> ToolResult:
+    playlist = sessions.current().playlist
+    return render_playlist(playlist, playlist.current)
 
 async def clear_playlist_handler(arguments: Dict[str, Any]) -> str:
-    playback_state["playlist"] = []
+    sessions.current().playlist.clear()
     return "播放列表已清空"
 
 async def next_song_handler(arguments: Dict[str, Any]) -> str:
-    playlist = playback_state["playlist"]
-    current = playback_state["current_song"]
+    state = sessions.current()
     
-    if not playlist:
+    if not state.playlist:
         return "播放列表为空，无法切换到下一首"
     
-    if current:
-        try:
-            current_index = next(i for i, song in enumerate(playlist) if song["id"] == current["id"])
-            next_index = (current_index + 1) % len(playlist)
-        except StopIteration:
-            next_index = 0
-    else:
-        next_index = 0
+    next_song = state.playlist.next()
+    if next_song is None:
+        return "已经是最后一首了"
     
-    next_song = playlist[next_index]
-    playback_state["current_song"] = next_song
-    playback_state["is_playing"] = True
+    state.current_song = next_song
+    state.is_playing = True
+    state.position = 0
+    if prefetcher is not None:
+        prefetcher.request(state)
     
     return f"下一首: {next_song['name']} - {next_song['artist']}"
 
 async def previous_song_handler(arguments: Dict[str, Any]) -> str:
-    playlist = playback_state["playlist"]
-    current = playback_state["current_song"]
+    state = sessions.current()
     
-    if not playlist:
+    if not state.playlist:
         return "播放列表为空，无法切换到上一首"
     
-    if current:
-        try:
-            current_index = next(i for i, song in enumerate(playlist) if song["id"] == current["id"])
-            prev_index = (current_index - 1) % len(playlist)
-        except StopIteration:
-            prev_index = len(playlist) - 1
-    else:
-        prev_index = len(playlist) - 1
+    prev_song = state.playlist.previous()
+    if prev_song is None:
+        return "已经是第一首了"
     
-    prev_song = playlist[prev_index]
-    playback_state["current_song"] = prev_song
-    playback_state["is_playing"] = True
+    state.current_song = prev_song
+    state.is_playing = True
+    state.position = 0
+    if prefetcher is not None:
+        prefetcher.request(state)
     
     return f"上一首: {prev_song['name']} - {prev_song['artist']}"
 
-async def main():
-    """主函数"""
-    logger.info("启动免费音乐MCP服务器...")
+async def set_play_mode_handler(arguments: Dict[str, Any]) -> str:
+    playlist = sessions.current().playlist
+    playlist.set_mode(shuffle=arguments.get("shuffle"), repeat=arguments.get("repeat"))
     
+    order = "随机播放" if playlist.shuffle else "顺序播放"
+    repeat = {REPEAT_OFF: "不循环", REPEAT_ALL: "列表循环", REPEAT_ONE: "单曲循环"}[playlist.repeat]
+    return f"播放模式: {order}，{repeat}"
+
+def register_tools():
+    """注册工具"""
     # 注册工具
     server.add_tool("search_music", "搜索音乐", {
         "type": "object",
@@ -268,7 +473,7 @@ async def main():
             "limit": {"type": "integer", "description": "返回结果数量", "default": 10}
         },
         "required": ["query"]
-    }, search_music_handler)
+    }, search_music_handler, read_only=True, output_schema=SEARCH_OUTPUT_SCHEMA)
     
     server.add_tool("play_music", "播放音乐", {
         "type": "object",
@@ -316,7 +521,7 @@ async def main():
     server.add_tool("get_playlist", "获取播放列表", {
         "type": "object",
         "properties": {}
-    }, get_playlist_handler)
+    }, get_playlist_handler, read_only=True, output_schema=PLAYLIST_OUTPUT_SCHEMA)
     
     server.add_tool("clear_playlist", "清空播放列表", {
         "type": "object",
@@ -333,8 +538,52 @@ async def main():
         "properties": {}
     }, previous_song_handler)
     
+    server.add_tool("set_play_mode", "设置播放模式", {
+        "type": "object",
+        "properties": {
+            "shuffle": {"type": "boolean", "description": "是否随机播放"},
+            "repeat": {"type": "string", "description": "循环模式: off 不循环, all 列表循环, one 单曲循环",
+                       "enum": ["off", "all", "one"]}
+        }
+    }, set_play_mode_handler)
+    server.registry.freeze()
+
+async def main():
+    """主函数"""
+    global prefetcher
+    logger.info("启动免费音乐MCP服务器...")
+    
+    register_tools()
+    
+    # 预取下一首的元数据与播放地址
+    prefetcher = Prefetcher(sessions, lambda song: resolve_track(str(song["id"])),
+                            lead_time=float(os.getenv('PREFETCH_LEAD_TIME', 30)),
+                            max_concurrency=int(os.getenv('PREFETCH_CONCURRENCY', 4)))
+    prefetch_task = asyncio.create_task(prefetcher.run())
+    
+    # stdio 模式没有监听端口，设置 METRICS_PORT 后单独提供 /metrics
+    metrics_port = int(os.getenv('METRICS_PORT', 0))
+    metrics_server = await serve_metrics(os.getenv('HOST', '127.0.0.1'), metrics_port) if metrics_port else None
+    
+    # SIGUSR1 开始/结束剖析窗口
+    loop_monitor = LoopMonitor(threshold=float(os.getenv('LOOP_LAG_THRESHOLD', 0.2)),
+                               directory=PROFILE_DIR) if os.getenv('LOOP_MONITOR') == '1' else None
+    install_profiling(profiler, PROFILE_WINDOW, loop_monitor)
+    
     # 运行服务器
-    await server.run_stdio()
+    try:
+        await server.run_stdio(
+            max_concurrency=int(os.getenv('MAX_CONCURRENT_REQUESTS', 16)),
+            line_limit=int(os.getenv('STDIO_LINE_LIMIT', DEFAULT_LINE_LIMIT)))
+    finally:
+        prefetch_task.cancel()
+        await prefetcher.aclose()
+        if loop_monitor is not None:
+            loop_monitor.stop()
+        profiler.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+        await providers.aclose()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
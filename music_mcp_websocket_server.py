@@ -5,26 +5,59 @@
 为小智AI音响提供音乐控制服务 - WebSocket版本
 """
 
+import argparse
 import asyncio
-import json
+import gc
+import hmac
 import logging
 import os
+import signal
+import time
 import websockets
-from typing import Dict, Any, List
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional
 from datetime import datetime
+from urllib.parse import parse_qs, quote, urlsplit
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
+from music_cache import SearchCache
+from music_catalog import CatalogIndex, load_catalog
+from music_chunk_cache import ChunkCache
+from music_codec import DECODE_ERRORS, dumps, loads
+from music_jsonrpc import (INTERNAL_ERROR, INVALID_PARAMS, INVALID_REQUEST, METHOD_NOT_FOUND,
+                           PARSE_ERROR, READ_ONLY_METHODS, encode_message, is_notification,
+                           make_error, run_batch)
+from music_logging import log_request, request_id, setup_logging, start_span
+from music_metrics import (ERRORS, REGISTRY, REQUEST_LATENCY, REQUESTS, TOOL_CALLS, TOOL_LATENCY,
+                           cache_counters, record_response, serve_metrics, serve_metrics_in_thread)
+from music_playlist import REPEAT_ALL, REPEAT_OFF, REPEAT_ONE
+from music_prefetch import Prefetcher
+from music_profiling import LoopMonitor, Profiler, install_profiling, profile_command
+from music_registry import ToolRegistry
+from music_render import (PLAYLIST_OUTPUT_SCHEMA, SEARCH_OUTPUT_SCHEMA, ToolResult, call_result,
+                          render_playlist, render_search, render_now_playing, resource_contents)
+from music_schema import SchemaError
+from music_session import SessionManager
+from music_session_store import MemorySessionStore, create_session_store
+from music_stream import StreamServer
+from music_subscriptions import ResourceSubscriptions
+from music_text import normalize_text
+from music_workers import REUSE_PORT_AVAILABLE, WorkerSupervisor
+
+# 配置日志：LOG_FORMAT=json 输出结构化日志，LOG_SAMPLE_RATE 为请求日志采样比例
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# 播放状态管理
-playback_state = {
-    "is_playing": False,
-    "current_song": None,
-    "volume": 50,
-    "position": 0,
-    "playlist": []
-}
+# websockets>=14 可以把UTF-8 bytes直接作为文本帧发送，旧版本需要先解码
+SEND_BYTES_AS_TEXT = int(websockets.__version__.split(".")[0]) >= 14
+
+# 每个连接同时处理的请求数上限
+MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', 16))
+
+# 设备会话管理，每个音响独立的播放状态
+sessions = SessionManager(
+    max_sessions=int(os.getenv('MAX_SESSIONS', 10000)),
+    idle_timeout=float(os.getenv('SESSION_IDLE_TIMEOUT', 3600))
+)
 
 # 模拟音乐数据库
 MOCK_MUSIC_DATABASE = [
@@ -40,278 +73,394 @@ MOCK_MUSIC_DATABASE = [
     {"id": "10", "name": "理想", "artist": "赵雷", "album": "吉姆餐厅", "duration": 279}
 ]
 
+# 曲库索引，可通过 MUSIC_CATALOG_PATH 加载外部曲库；
+# 拼音/错别字模糊索引约使建索引的内存与时间翻倍，超大曲库可设置 MUSIC_FUZZY_INDEX=0 关闭
+catalog_index = CatalogIndex(
+    MOCK_MUSIC_DATABASE,
+    fuzzy=os.getenv('MUSIC_FUZZY_INDEX', '1').lower() not in ('0', 'false', 'no', 'off')
+)
+
+# 音频流代理端口，设为 0 时不启动；STREAM_PUBLIC_URL 为音响可访问的地址
+STREAM_PORT = int(os.getenv('STREAM_PORT', 8766))
+STREAM_PUBLIC_URL = os.getenv('STREAM_PUBLIC_URL', f"http://localhost:{STREAM_PORT}")
+
+# 预取下一首：剩余时长(秒)阈值、并发上限、预热的音频分块数
+PREFETCH_LEAD_TIME = float(os.getenv('PREFETCH_LEAD_TIME', 30))
+PREFETCH_CONCURRENCY = int(os.getenv('PREFETCH_CONCURRENCY', 4))
+PREFETCH_CHUNKS = int(os.getenv('PREFETCH_CHUNKS', 1))
+
+# 工作进程数，由命令行 --workers 设置
+worker_count = 1
+
+# 在 main 中创建
+stream_server: Optional[StreamServer] = None
+prefetcher: Optional[Prefetcher] = None
+
+# 资源变化推送：最后一次变化后等待的秒数，持续变化时的最长延迟
+RESOURCE_NOTIFY_DEBOUNCE = float(os.getenv('RESOURCE_NOTIFY_DEBOUNCE', 0.2))
+RESOURCE_NOTIFY_MAX_DELAY = float(os.getenv('RESOURCE_NOTIFY_MAX_DELAY', 1.0))
+
+# Prometheus 指标端口，设为 0 时不启动
+METRICS_PORT = int(os.getenv('METRICS_PORT', 8767))
+
+# 性能剖析：SIGUSR1 或 admin/profile 开启 PROFILE_WINDOW 秒的剖析窗口，结果写入 PROFILE_DIR；
+# 最慢的 PROFILE_SLOWEST 次工具调用始终记录(admin/profile action=slowest 查询)；
+# LOOP_MONITOR=1 时监视事件循环阻塞。设置 ADMIN_TOKEN 后才提供 admin/profile 方法
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_WINDOW = float(os.getenv('PROFILE_WINDOW', 30))
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+profiler = Profiler(PROFILE_DIR, slowest=int(os.getenv('PROFILE_SLOWEST', 20)))
+
+# 当前请求所属的连接，由 handle_client 绑定
+_current_connection: ContextVar[Optional["ClientConnection"]] = ContextVar("current_connection", default=None)
+
+# 搜索结果缓存
+search_cache = SearchCache(
+    max_size=int(os.getenv('SEARCH_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('SEARCH_CACHE_TTL', 300))
+)
+
 class MCPWebSocketServer:
     """MCP WebSocket服务器"""
     
     def __init__(self):
-        self.tools = {}
-        self.resources = {}
-        
-    def add_tool(self, name: str, description: str, input_schema: Dict[str, Any], handler):
-        """添加工具"""
-        self.tools[name] = {
-            "name": name,
-            "description": description,
-            "inputSchema": input_schema,
-            "handler": handler
+        self.registry = ToolRegistry()
+        self.tools = self.registry.tools
+        self.resources = self.registry.resources
+        self.connections = set()
+        self.requests = 0
+        self.registry.on_change(self._on_list_changed)
+        self.subscriptions = ResourceSubscriptions(
+            self._resource_fingerprint, RESOURCE_NOTIFY_DEBOUNCE, RESOURCE_NOTIFY_MAX_DELAY)
+        # 方法分发表
+        self._methods = {
+            "initialize": self._initialize,
+            "tools/list": self._tools_list,
+            "tools/call": self._tools_call,
+            "resources/list": self._resources_list,
+            "resources/read": self._resources_read,
+            "resources/subscribe": self._resources_subscribe,
+            "resources/unsubscribe": self._resources_unsubscribe,
         }
+        if ADMIN_TOKEN:
+            self._methods["admin/profile"] = self._admin_profile
+        
+    def add_tool(self, name: str, description: str, input_schema: Dict[str, Any], handler,
+                 read_only: bool = False, output_schema: Optional[Dict[str, Any]] = None):
+        """添加工具，read_only 的工具在批量请求中可以并发执行"""
+        self.registry.add_tool(name, description, input_schema, handler, read_only, output_schema)
         
     def add_resource(self, uri: str, name: str, description: str = ""):
         """添加资源"""
-        self.resources[uri] = {
-            "uri": uri,
-            "name": name,
-            "description": description
-        }
+        self.registry.add_resource(uri, name, description)
+    
+    def _on_list_changed(self, kind: str):
+        """工具/资源列表变更后通知所有客户端重新获取"""
+        notification = {"jsonrpc": "2.0", "method": f"notifications/{kind}/list_changed"}
+        for connection in self.connections:
+            connection.send(notification)
     
     async def handle_message(self, websocket, message: str):
-        """处理WebSocket消息"""
+        """处理WebSocket消息并直接发送响应"""
+        response = await self.process_message(message)
+        if response is not None:
+            await send_frame(websocket, encode_message(response))
+    
+    def is_read_only(self, request: Any) -> bool:
+        """判断请求是否不修改播放状态"""
+        if not isinstance(request, dict):
+            return True
+        method = request.get("method")
+        if method == "tools/call":
+            params = request.get("params")
+            tool = self.tools.get(params.get("name") if isinstance(params, dict) else None)
+            return bool(tool and tool["readOnly"])
+        return method in READ_ONLY_METHODS
+    
+    async def process_message(self, message: str) -> Optional[Any]:
+        """处理一帧JSON-RPC消息(单个请求或批量数组)，返回响应；通知返回None"""
+        try:
+            data = loads(message)
+        except DECODE_ERRORS as e:
+            logger.error("JSON解析错误: %s", e)
+            ERRORS.inc(PARSE_ERROR)
+            return make_error(None, PARSE_ERROR, "JSON解析错误")
+        
+        if isinstance(data, list):
+            return await run_batch(data, self.handle_request, self.is_read_only)
+        return await self.handle_request(data)
+    
+    async def handle_request(self, data: Any) -> Optional[Dict[str, Any]]:
+        """处理单个JSON-RPC请求"""
+        if not isinstance(data, dict):
+            return make_error(None, INVALID_REQUEST, "无效的请求")
+        
         try:
-            data = json.loads(message)
             method = data.get("method")
             msg_id = data.get("id")
-            params = data.get("params", {})
+            params = data.get("params")
+            if params is None:
+                params = {}
             
-            logger.info(f"收到消息: {method}")
+            started = time.perf_counter()
+            request_id.set(msg_id)
+            logger.debug("收到消息: %s", method)
+            self.requests += 1
             
-            if method == "initialize":
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": msg_id,
-                    "result": {
-                        "protocolVersion": "2024-11-05",
-                        "capabilities": {
-                            "tools": {"listChanged": True},
-                            "resources": {"subscribe": True, "listChanged": True}
-                        },
-                        "serverInfo": {
-                            "name": "music-mcp-server",
-                            "version": "1.0.0"
-                        }
-                    }
-                }
-                
-            elif method == "tools/list":
-                tools_list = [{
-                    "name": tool["name"],
-                    "description": tool["description"],
-                    "inputSchema": tool["inputSchema"]
-                } for tool in self.tools.values()]
-                
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": msg_id,
-                    "result": {
-                        "tools": tools_list
-                    }
-                }
-                
-            elif method == "tools/call":
-                tool_name = params.get("name")
-                arguments = params.get("arguments", {})
-                
-                if tool_name in self.tools:
-                    try:
-                        result = await self.tools[tool_name]["handler"](arguments)
-                        response = {
-                            "jsonrpc": "2.0",
-                            "id": msg_id,
-                            "result": {
-                                "content": [{
-                                    "type": "text",
-                                    "text": result
-                                }]
-                            }
-                        }
-                    except Exception as e:
-                        logger.error(f"工具调用错误: {e}")
-                        response = {
-                            "jsonrpc": "2.0",
-                            "id": msg_id,
-                            "error": {
-                                "code": -32603,
-                                "message": f"工具执行错误: {str(e)}"
-                            }
-                        }
-                else:
-                    response = {
-                        "jsonrpc": "2.0",
-                        "id": msg_id,
-                        "error": {
-                            "code": -32601,
-                            "message": f"未知工具: {tool_name}"
-                        }
-                    }
-                    
-            elif method == "resources/list":
-                resources_list = list(self.resources.values())
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": msg_id,
-                    "result": {
-                        "resources": resources_list
-                    }
-                }
-                
-            elif method == "resources/read":
-                uri = params.get("uri")
-                if uri in self.resources:
-                    content = await self.get_resource_content(uri)
-                    response = {
-                        "jsonrpc": "2.0",
-                        "id": msg_id,
-                        "result": {
-                            "contents": [{
-                                "uri": uri,
-                                "mimeType": "text/plain",
-                                "text": content
-                            }]
-                        }
-                    }
-                else:
-                    response = {
-                        "jsonrpc": "2.0",
-                        "id": msg_id,
-                        "error": {
-                            "code": -32602,
-                            "message": f"未知资源: {uri}"
-                        }
-                    }
+            handler = self._methods.get(method)
+            if handler is None:
+                response = make_error(msg_id, METHOD_NOT_FOUND, f"未知方法: {method}")
+            elif not isinstance(params, dict):
+                response = make_error(msg_id, INVALID_PARAMS, "params 必须是对象")
             else:
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": msg_id,
-                    "error": {
-                        "code": -32601,
-                        "message": f"未知方法: {method}"
-                    }
-                }
+                response = await handler(msg_id, params)
+            elapsed = time.perf_counter() - started
+            # 未知方法统一计为 other，避免客户端随意的方法名产生大量标签
+            if handler is not None:
+                REQUEST_LATENCY.observe(elapsed, method)
+            REQUESTS.inc(method if handler is not None else "other")
+            log_request(method, msg_id, elapsed, record_response(response))
             
-            await websocket.send(json.dumps(response))
+            if is_notification(data):
+                return None
+            return response
             
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON解析错误: {e}")
-            error_response = {
-                "jsonrpc": "2.0",
-                "id": None,
-                "error": {
-                    "code": -32700,
-                    "message": "JSON解析错误"
+        except Exception as e:
+            logger.error("处理消息错误: %s", e)
+            ERRORS.inc(INTERNAL_ERROR)
+            if is_notification(data):
+                return None
+            return make_error(data.get("id"), INTERNAL_ERROR, f"内部错误: {str(e)}")
+    
+    async def _initialize(self, msg_id: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "result": {
+                "protocolVersion": "2024-11-05",
+                "capabilities": {
+                    "tools": {"listChanged": True},
+                    "resources": {"subscribe": True, "listChanged": True}
+                },
+                "serverInfo": {
+                    "name": "music-mcp-server",
+                    "version": "1.0.0"
                 }
             }
-            await websocket.send(json.dumps(error_response))
-            
+        }
+    
+    async def _tools_list(self, msg_id: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "result": self.registry.tools_list()
+        }
+    
+    async def _tools_call(self, msg_id: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+        tool_name = params.get("name")
+        arguments = params.get("arguments", {})
+        
+        tool = self.registry.get_tool(tool_name)
+        if tool is None:
+            return make_error(msg_id, METHOD_NOT_FOUND, f"未知工具: {tool_name}")
+        
+        try:
+            arguments = tool["validate"](arguments)
+        except SchemaError as e:
+            return make_error(msg_id, INVALID_PARAMS, str(e))
+        
+        span = start_span("tools/call", tool=tool_name, id=msg_id)
+        started = time.perf_counter()
+        try:
+            result = await tool["handler"](arguments)
         except Exception as e:
-            logger.error(f"处理消息错误: {e}")
-            error_response = {
-                "jsonrpc": "2.0",
-                "id": data.get("id") if 'data' in locals() else None,
-                "error": {
-                    "code": -32603,
-                    "message": f"内部错误: {str(e)}"
-                }
+            logger.error("工具调用错误: %s", e)
+            TOOL_CALLS.inc(tool_name, "error")
+            if span is not None:
+                span.finish("error", error=str(e))
+            return make_error(msg_id, INTERNAL_ERROR, f"工具执行错误: {str(e)}")
+        elapsed = time.perf_counter() - started
+        TOOL_LATENCY.observe(elapsed, tool_name)
+        TOOL_CALLS.inc(tool_name, "ok")
+        profiler.record_call(tool_name, arguments, elapsed)
+        if span is not None:
+            span.finish()
+        
+        if not tool["readOnly"]:
+            # 播放状态可能已变化，通知订阅了该会话资源的连接
+            self.subscriptions.changed(sessions.current().session_id)
+        
+        return {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "result": call_result(result)
+        }
+    
+    async def _resources_list(self, msg_id: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "result": self.registry.resources_list()
+        }
+    
+    async def _resources_read(self, msg_id: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+        uri = params.get("uri")
+        if uri not in self.resources:
+            return make_error(msg_id, INVALID_PARAMS, f"未知资源: {uri}")
+        
+        content = await self.get_resource_content(uri)
+        return {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "result": {
+                "contents": resource_contents(uri, content)
             }
-            await websocket.send(json.dumps(error_response))
+        }
     
-    async def get_resource_content(self, uri: str) -> str:
+    async def _resources_subscribe(self, msg_id: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+        uri = params.get("uri")
+        if uri not in self.resources:
+            return make_error(msg_id, INVALID_PARAMS, f"未知资源: {uri}")
+        connection = _current_connection.get()
+        if connection is not None:
+            self.subscriptions.subscribe(connection, sessions.current().session_id, uri)
+        return {"jsonrpc": "2.0", "id": msg_id, "result": {}}
+    
+    async def _resources_unsubscribe(self, msg_id: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+        connection = _current_connection.get()
+        if connection is not None:
+            self.subscriptions.unsubscribe(connection, sessions.current().session_id, params.get("uri"))
+        return {"jsonrpc": "2.0", "id": msg_id, "result": {}}
+    
+    async def _admin_profile(self, msg_id: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+        """开始/结束性能剖析窗口或查询状态，需要 ADMIN_TOKEN"""
+        if not hmac.compare_digest(str(params.get("token", "")).encode(), ADMIN_TOKEN.encode()):
+            return make_error(msg_id, INVALID_PARAMS, "管理令牌无效")
+        try:
+            status = profile_command(profiler, params.get("action", "status"),
+                                     params.get("seconds", PROFILE_WINDOW))
+        except ValueError as e:
+            return make_error(msg_id, INVALID_PARAMS, str(e))
+        return {"jsonrpc": "2.0", "id": msg_id, "result": status}
+    
+    def _resource_fingerprint(self, session_id: str, uri: str) -> bytes:
+        """资源当前内容，用于判断变化后是否需要推送；结构化数据包含文本中没有的字段(如未播放时的音量)"""
+        content = self.render_resource(sessions.get(session_id), uri)
+        return dumps([content.text, content.data])
+    
+    async def get_resource_content(self, uri: str) -> ToolResult:
         """获取资源内容"""
+        return self.render_resource(sessions.current(), uri)
+    
+    @staticmethod
+    def render_resource(state, uri: str) -> ToolResult:
+        """渲染会话的资源"""
         if uri == "music://current_playlist":
-            playlist = playback_state["playlist"]
-            if not playlist:
-                return "播放列表为空"
-            
-            content = "当前播放列表:\n\n"
-            for i, song in enumerate(playlist, 1):
-                content += f"{i}. {song['name']} - {song['artist']}\n"
-            return content
+            return render_playlist(state.playlist, state.playlist.current)
             
         elif uri == "music://current_playing":
-            current = playback_state["current_song"]
-            if not current:
-                return "当前没有播放歌曲"
-            
-            status = "播放中" if playback_state["is_playing"] else "已暂停"
-            return f"当前播放: {current['name']} - {current['artist']}\n状态: {status}\n音量: {playback_state['volume']}%"
+            return render_now_playing(state.current_song, state.is_playing, state.volume)
             
-        return "未知资源"
+        return ToolResult("未知资源")
 
 # 音乐搜索API
 async def search_music_api(query: str, limit: int = 10) -> List[Dict[str, Any]]:
-    """搜索音乐API"""
+    """搜索音乐API，归一化后相同的查询共享缓存结果"""
+    return await search_cache.get_or_load(
+        (normalize_text(query), limit),
+        lambda: _search_catalog(query, limit)
+    )
+
+async def _search_catalog(query: str, limit: int) -> List[Dict[str, Any]]:
+    """检索曲库"""
     # 模拟搜索延迟
     await asyncio.sleep(0.1)
     
-    # 简单的关键词匹配
-    results = []
-    query_lower = query.lower()
-    
-    for song in MOCK_MUSIC_DATABASE:
-        if (query_lower in song["name"].lower() or 
-            query_lower in song["artist"].lower() or 
-            query_lower in song["album"].lower()):
-            results.append(song)
-            
-        if len(results) >= limit:
+    # 通过倒排索引检索，limit 下推到索引内的 top-k 选择；没有匹配时返回空结果
+    return catalog_index.search(query, limit)
+
+def stream_url(song_id: str, device_id: str) -> str:
+    """音响拉取音频的代理地址"""
+    return f"{STREAM_PUBLIC_URL}/stream/{quote(str(song_id), safe='')}?device_id={quote(device_id, safe='')}"
+
+async def resolve_stream_url(song_id: str) -> Optional[str]:
+    """曲库中歌曲的上游播放地址"""
+    song = catalog_index.get(song_id)
+    return song.get("url") if song else None
+
+def track_duration(song: Dict[str, Any]) -> Optional[float]:
+    """歌曲时长，播放列表中的歌曲没有时长时从曲库查找"""
+    if song.get("duration"):
+        return song["duration"]
+    entry = catalog_index.get(song["id"])
+    return entry.get("duration") if entry else None
+
+async def warm_track(song: Dict[str, Any]):
+    """预热歌曲开头的音频分块"""
+    cache = stream_server.cache if stream_server is not None else None
+    if cache is None:
+        return
+    url = await resolve_stream_url(song["id"])
+    if not url:
+        return
+    for index in range(PREFETCH_CHUNKS):
+        try:
+            await cache.get(stream_server.client, str(song["id"]), url, index)
+        except IndexError:
             break
-    
-    # 如果没有匹配结果，返回一些默认结果
-    if not results:
-        results = MOCK_MUSIC_DATABASE[:limit]
-    
-    return results
 
 # 工具处理函数
-async def search_music_handler(arguments: Dict[str, Any]) -> str:
+async def search_music_handler(arguments: Dict[str, Any]) -> ToolResult:
     query = arguments["query"]
     limit = arguments.get("limit", 10)
     
     results = await search_music_api(query, limit)
-    
-    response = f"搜索 '{query}' 的结果：\n\n"
-    for i, song in enumerate(results, 1):
-        response += f"{i}. {song['name']} - {song['artist']}\n"
-        response += f"   专辑: {song['album']}\n"
-        response += f"   时长: {song['duration']}秒\n"
-        response += f"   ID: {song['id']}\n\n"
-    
-    return response
+    return render_search(query, results)
 
-async def play_music_handler(arguments: Dict[str, Any]) -> str:
+async def play_music_handler(arguments: Dict[str, Any]) -> ToolResult:
     song_id = arguments["song_id"]
     song_name = arguments.get("song_name", "未知歌曲")
     artist = arguments.get("artist", "未知歌手")
     
-    playback_state["current_song"] = {
+    state = sessions.current()
+    state.current_song = {
         "id": song_id,
         "name": song_name,
-        "artist": artist
+        "artist": artist,
+        "stream_url": stream_url(song_id, state.session_id) if STREAM_PORT else None
     }
-    playback_state["is_playing"] = True
-    playback_state["position"] = 0
-    
-    return f"正在播放: {song_name} - {artist}"
+    state.is_playing = True
+    state.position = 0
+    # 歌曲在播放列表中时，游标跟随，下一首从它之后继续
+    state.playlist.seek(song_id)
+    if prefetcher is not None:
+        prefetcher.request(state)
+    
+    return ToolResult(f"正在播放: {song_name} - {artist}", {"song": state.current_song})
 
 async def pause_music_handler(arguments: Dict[str, Any]) -> str:
-    playback_state["is_playing"] = False
+    sessions.current().is_playing = False
     return "音乐已暂停"
 
 async def resume_music_handler(arguments: Dict[str, Any]) -> str:
-    playback_state["is_playing"] = True
-    current = playback_state["current_song"]
+    state = sessions.current()
+    state.is_playing = True
+    current = state.current_song
     if current:
         return f"继续播放: {current['name']} - {current['artist']}"
     else:
         return "没有可继续播放的歌曲"
 
 async def stop_music_handler(arguments: Dict[str, Any]) -> str:
-    playback_state["is_playing"] = False
-    playback_state["current_song"] = None
-    playback_state["position"] = 0
+    state = sessions.current()
+    state.is_playing = False
+    state.current_song = None
+    state.position = 0
     return "音乐已停止"
 
 async def set_volume_handler(arguments: Dict[str, Any]) -> str:
     volume = arguments["volume"]
-    playback_state["volume"] = volume
+    sessions.current().volume = volume
     return f"音量已设置为: {volume}%"
 
 async def add_to_playlist_handler(arguments: Dict[str, Any]) -> str:
@@ -319,93 +468,196 @@ async def add_to_playlist_handler(arguments: Dict[str, Any]) -> str:
     song_name = arguments.get("song_name", "未知歌曲")
     artist = arguments.get("artist", "未知歌手")
     
+    playlist = sessions.current().playlist
+    if len(playlist) >= sessions.max_playlist_length:
+        return f"播放列表已满（最多 {sessions.max_playlist_length} 首）"
+    
     song = {
         "id": song_id,
         "name": song_name,
         "artist": artist
     }
-    playback_state["playlist"].append(song)
+    playlist.append(song)
     
     return f"已添加到播放列表: {song_name} - {artist}"
 
-async def get_playlist_handler(arguments: Dict[str, Any]) -> str:
-    playlist = playback_state["playlist"]
-    if not playlist:
-        return "播放列表为空"
-    
-    response = "当前播放列表:\n\n"
-    for i, song in enumerate(playlist, 1):
-        response += f"{i}. {song['name']} - {song['artist']}\n"
-    
-    return response
+async def get_playlist_handler(arguments: Dict[str, Any]) -> ToolResult:
+    playlist = sessions.current().playlist
+    return render_playlist(playlist, playlist.current)
 
 async def clear_playlist_handler(arguments: Dict[str, Any]) -> str:
-    playback_state["playlist"] = []
+    sessions.current().playlist.clear()
     return "播放列表已清空"
 
 async def next_song_handler(arguments: Dict[str, Any]) -> str:
-    playlist = playback_state["playlist"]
-    current = playback_state["current_song"]
+    state = sessions.current()
     
-    if not playlist:
+    if not state.playlist:
         return "播放列表为空，无法切换到下一首"
     
-    if current:
-        try:
-            current_index = next(i for i, song in enumerate(playlist) if song["id"] == current["id"])
-            next_index = (current_index + 1) % len(playlist)
-        except StopIteration:
-            next_index = 0
-    else:
-        next_index = 0
+    next_song = state.playlist.next()
+    if next_song is None:
+        return "已经是最后一首了"
     
-    next_song = playlist[next_index]
-    playback_state["current_song"] = next_song
-    playback_state["is_playing"] = True
+    state.current_song = next_song
+    state.is_playing = True
+    state.position = 0
+    if prefetcher is not None:
+        prefetcher.request(state)
     
     return f"下一首: {next_song['name']} - {next_song['artist']}"
 
 async def previous_song_handler(arguments: Dict[str, Any]) -> str:
-    playlist = playback_state["playlist"]
-    current = playback_state["current_song"]
+    state = sessions.current()
     
-    if not playlist:
+    if not state.playlist:
         return "播放列表为空，无法切换到上一首"
     
-    if current:
-        try:
-            current_index = next(i for i, song in enumerate(playlist) if song["id"] == current["id"])
-            prev_index = (current_index - 1) % len(playlist)
-        except StopIteration:
-            prev_index = len(playlist) - 1
-    else:
-        prev_index = len(playlist) - 1
+    prev_song = state.playlist.previous()
+    if prev_song is None:
+        return "已经是第一首了"
     
-    prev_song = playlist[prev_index]
-    playback_state["current_song"] = prev_song
-    playback_state["is_playing"] = True
+    state.current_song = prev_song
+    state.is_playing = True
+    state.position = 0
+    if prefetcher is not None:
+        prefetcher.request(state)
     
     return f"上一首: {prev_song['name']} - {prev_song['artist']}"
 
+async def set_play_mode_handler(arguments: Dict[str, Any]) -> str:
+    playlist = sessions.current().playlist
+    playlist.set_mode(shuffle=arguments.get("shuffle"), repeat=arguments.get("repeat"))
+    
+    order = "随机播放" if playlist.shuffle else "顺序播放"
+    repeat = {REPEAT_OFF: "不循环", REPEAT_ALL: "列表循环", REPEAT_ONE: "单曲循环"}[playlist.repeat]
+    return f"播放模式: {order}，{repeat}"
+
+async def send_frame(websocket, data: bytes):
+    """以文本帧发送已编码的JSON"""
+    if SEND_BYTES_AS_TEXT:
+        await websocket.send(data, text=True)
+    else:
+        await websocket.send(data.decode("utf-8"))
+
+class ClientConnection:
+    """单个客户端连接
+
+    每条请求作为独立任务并发处理，并发数受 max_concurrency 限制；
+    响应按完成顺序进入队列，由唯一的写协程发送，客户端按 id 匹配。
+    并发名额在响应发送之后才释放，客户端不读取响应时服务器暂停读取新请求，
+    待发送的响应不会超过 max_concurrency 条。
+    """
+    
+    def __init__(self, server: MCPWebSocketServer, websocket, max_concurrency: int = 16):
+        self.server = server
+        self.websocket = websocket
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # (消息, 是否占用并发名额)
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._tasks = set()
+    
+    async def run(self):
+        """读取消息并分发，直到连接关闭"""
+        writer = asyncio.create_task(self._write_loop())
+        try:
+            async for message in self.websocket:
+                # 达到并发上限时暂停读取，形成背压
+                await self._semaphore.acquire()
+                task = asyncio.create_task(self._dispatch(message))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+            writer.cancel()
+            await asyncio.gather(writer, *self._tasks, return_exceptions=True)
+    
+    async def _dispatch(self, message: str):
+        try:
+            response = await self.server.process_message(message)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        if response is None:
+            self._semaphore.release()
+        else:
+            # 名额由写协程在发送后释放
+            self._outbox.put_nowait((response, True))
+    
+    def send(self, message: Dict[str, Any]):
+        """排队发送服务器主动推送的通知"""
+        self._outbox.put_nowait((message, False))
+    
+    async def _write_loop(self):
+        while True:
+            message, permit = await self._outbox.get()
+            try:
+                await send_frame(self.websocket, encode_message(message))
+            finally:
+                if permit:
+                    self._semaphore.release()
+
+def get_device_id(websocket) -> str:
+    """从握手请求中获取设备ID：优先 Device-Id 请求头，其次 ?device_id= 参数，否则按连接区分"""
+    request = getattr(websocket, "request", None)
+    headers = getattr(request, "headers", None) or getattr(websocket, "request_headers", None) or {}
+    path = getattr(request, "path", None) or getattr(websocket, "path", None) or ""
+    device_id = headers.get("Device-Id") or parse_qs(urlsplit(path).query).get("device_id", [None])[0]
+    if device_id:
+        return device_id
+    host, port = websocket.remote_address[:2]
+    return f"conn-{host}:{port}"
+
 async def handle_client(websocket):
     """处理WebSocket客户端连接"""
-    logger.info(f"新客户端连接: {websocket.remote_address}")
-    
+    device_id = get_device_id(websocket)
+    logger.info("新客户端连接: %s 设备: %s", websocket.remote_address, device_id)
+    
+    # 设备可能上次连接在其他进程，先从会话存储刷新
+    await sessions.load(device_id)
+    # 绑定会话后，本连接派生的请求任务都使用该设备的播放状态
+    sessions.bind(device_id)
+    connection = ClientConnection(server, websocket, MAX_CONCURRENT_REQUESTS)
+    _current_connection.set(connection)
+    server.connections.add(connection)
     try:
-        async for message in websocket:
-            await server.handle_message(websocket, message)
+        await connection.run()
     except websockets.exceptions.ConnectionClosed:
-        logger.info(f"客户端断开连接: {websocket.remote_address}")
+        logger.info("客户端断开连接: %s", websocket.remote_address)
     except Exception as e:
-        logger.error(f"处理客户端错误: {e}")
+        logger.error("处理客户端错误: %s", e)
+    finally:
+        server.connections.discard(connection)
+        server.subscriptions.discard(connection)
+        # 立即写回，设备重连到其他进程时能读到最新状态
+        await sessions.flush()
 
 # 创建服务器实例
 server = MCPWebSocketServer()
 
-async def main():
-    """主函数"""
-    logger.info("启动免费音乐MCP WebSocket服务器...")
-    
+# 采集时读取的状态指标
+REGISTRY.gauge("mcp_active_connections", "当前WebSocket连接数",
+               function=lambda: {(): len(server.connections)})
+REGISTRY.gauge("mcp_resource_subscriptions", "资源订阅数",
+               function=lambda: {(): len(server.subscriptions)})
+REGISTRY.gauge("music_sessions", "本进程内的设备会话数", function=lambda: {(): len(sessions)})
+REGISTRY.gauge("music_active_streams", "正在转发的音频流数",
+               function=lambda: {(): stream_server.active} if stream_server is not None else {})
+
+def _chunk_cache_stats() -> Optional[Dict[str, Any]]:
+    if stream_server is None or stream_server.cache is None:
+        return None
+    return stream_server.cache.stats()
+
+cache_counters("music_cache_requests_total",
+               {"search": search_cache.stats, "chunk": _chunk_cache_stats},
+               ("hits", "misses", "coalesced"))
+REGISTRY.gauge("music_chunk_cache_bytes", "音频分块缓存占用字节数",
+               function=lambda: {(): _chunk_cache_stats()["bytes"]} if _chunk_cache_stats() else {})
+
+def register_tools():
+    """注册资源与工具"""
     # 添加资源
     server.add_resource("music://current_playlist", "当前播放列表", "显示当前播放列表中的所有歌曲")
     server.add_resource("music://current_playing", "当前播放", "显示当前正在播放的歌曲信息")
@@ -418,7 +670,7 @@ async def main():
             "limit": {"type": "integer", "description": "返回结果数量", "default": 10, "minimum": 1, "maximum": 50}
         },
         "required": ["query"]
-    }, search_music_handler)
+    }, search_music_handler, read_only=True, output_schema=SEARCH_OUTPUT_SCHEMA)
     
     server.add_tool("play_music", "播放音乐", {
         "type": "object",
@@ -466,7 +718,7 @@ async def main():
     server.add_tool("get_playlist", "获取播放列表", {
         "type": "object",
         "properties": {}
-    }, get_playlist_handler)
+    }, get_playlist_handler, read_only=True, output_schema=PLAYLIST_OUTPUT_SCHEMA)
     
     server.add_tool("clear_playlist", "清空播放列表", {
         "type": "object",
@@ -483,16 +735,177 @@ async def main():
         "properties": {}
     }, previous_song_handler)
     
+    server.add_tool("set_play_mode", "设置播放模式", {
+        "type": "object",
+        "properties": {
+            "shuffle": {"type": "boolean", "description": "是否随机播放"},
+            "repeat": {"type": "string", "description": "循环模式: off 不循环, all 列表循环, one 单曲循环",
+                       "enum": ["off", "all", "one"]}
+        }
+    }, set_play_mode_handler)
+    
+    # 注册完成，之后的变更会推送 list_changed 通知
+    server.registry.freeze()
+
+async def main(worker_id: Optional[int] = None, metrics_queue=None):
+    """主函数；worker_id/metrics_queue 由多进程模式的主进程传入"""
+    global stream_server, prefetcher
+    reuse_port = worker_id is not None
+    background = []
+    logger.info("启动免费音乐MCP WebSocket服务器...")
+    
+    register_tools()
+    
     # 启动WebSocket服务器
     # 支持云端部署的动态端口配置
     host = os.getenv('HOST', '0.0.0.0')  # 云端部署需要监听所有接口
     port = int(os.getenv('PORT', 8765))  # 支持云平台的动态端口
     
-    start_server = websockets.serve(handle_client, host, port)
-    logger.info(f"WebSocket服务器启动在 ws://{host}:{port}")
-    
-    await start_server
-    await asyncio.Future()  # 保持服务器运行
+    # 定期淘汰空闲会话
+    background.append(asyncio.create_task(sessions.run_eviction()))
+    
+    # 会话存储：SESSION_STORE=memory 或 redis://host:port/db，多进程/多节点部署时使用 Redis
+    sessions.store = create_session_store(os.getenv('SESSION_STORE'))
+    if sessions.store is not None:
+        if reuse_port and isinstance(sessions.store, MemorySessionStore):
+            logger.warning("多进程模式下进程内会话存储不能在进程间共享")
+        background.append(asyncio.create_task(
+            sessions.run_flush(float(os.getenv('SESSION_FLUSH_INTERVAL', 1)))))
+    
+    # 音频流代理
+    if STREAM_PORT:
+        # 设置 STREAM_CACHE_DIR 后启用磁盘分块缓存
+        cache_dir = os.getenv('STREAM_CACHE_DIR')
+        stream_server = StreamServer(
+            resolve_stream_url, sessions,
+            chunk_size=int(os.getenv('STREAM_CHUNK_SIZE', 64 * 1024)),
+            bitrate=int(os.getenv('STREAM_BITRATE', 128000)),
+            cache=ChunkCache(
+                cache_dir,
+                chunk_size=int(os.getenv('STREAM_CACHE_CHUNK_SIZE', 1024 * 1024)),
+                # 多进程模式下各进程共用目录，预算按进程数平分，总占用不超过 STREAM_CACHE_MAX_BYTES
+                max_bytes=int(os.getenv('STREAM_CACHE_MAX_BYTES', 1024 ** 3)) // worker_count
+            ) if cache_dir else None
+        )
+        await stream_server.start(host, STREAM_PORT, reuse_port=reuse_port)
+        logger.info("音频流代理启动在 http://%s:%s/stream/<song_id>", host, STREAM_PORT)
+    
+    # 预取下一首
+    prefetcher = Prefetcher(sessions, warm_track, lead_time=PREFETCH_LEAD_TIME,
+                            max_concurrency=PREFETCH_CONCURRENCY, duration=track_duration)
+    background.append(asyncio.create_task(prefetcher.run()))
+    
+    # 多进程模式下由主进程输出汇总后的指标
+    metrics_server = None
+    if METRICS_PORT and worker_id is None:
+        metrics_server = await serve_metrics(host, METRICS_PORT)
+        logger.info("指标端点启动在 http://%s:%s/metrics", host, METRICS_PORT)
+    
+    ws_server = await websockets.serve(handle_client, host, port, reuse_port=reuse_port)
+    logger.info("WebSocket服务器启动在 ws://%s:%s%s", host, port,
+                f" (工作进程 {worker_id})" if worker_id is not None else "")
+    
+    # 工作进程定期向主进程上报指标
+    if metrics_queue is not None:
+        background.append(asyncio.create_task(report_metrics(worker_id, metrics_queue)))
+    
+    # 收到 SIGTERM/SIGINT 后停止接受新连接，关闭现有连接(1001)后退出
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except NotImplementedError:
+            pass
+    
+    # SIGUSR1 开始/结束剖析窗口
+    loop_monitor = LoopMonitor(threshold=float(os.getenv('LOOP_LAG_THRESHOLD', 0.2)),
+                               directory=PROFILE_DIR) if os.getenv('LOOP_MONITOR') == '1' else None
+    install_profiling(profiler, PROFILE_WINDOW, loop_monitor)
+    try:
+        await stop.wait()
+    finally:
+        logger.info("正在关闭服务器...")
+        ws_server.close()
+        await ws_server.wait_closed()
+        await prefetcher.aclose()
+        if stream_server is not None:
+            await stream_server.aclose()
+        if metrics_server is not None:
+            metrics_server.close()
+        if loop_monitor is not None:
+            loop_monitor.stop()
+        profiler.stop()
+        for task in background:
+            task.cancel()
+        if sessions.store is not None:
+            await sessions.flush()
+            await sessions.store.aclose()
+        if metrics_queue is not None:
+            metrics_queue.put((worker_id, worker_metrics()))
+
+def worker_metrics() -> Dict[str, Any]:
+    """本进程的计数指标，多进程模式下由主进程累加"""
+    metrics = {
+        "connections": len(server.connections),
+        "requests": server.requests,
+        "sessions": len(sessions),
+        "subscriptions": len(server.subscriptions),
+        "resource_notifications": server.subscriptions.sent,
+        "search_cache": {key: value for key, value in search_cache.stats().items() if key != "hit_ratio"}
+    }
+    if stream_server is not None:
+        metrics["streams"] = stream_server.active
+        if stream_server.cache is not None:
+            metrics["chunk_cache"] = stream_server.cache.stats()
+    if prefetcher is not None:
+        metrics["prefetched"] = prefetcher.warmed
+    # Prometheus 指标快照，多进程模式下由主进程累加后在 /metrics 输出
+    metrics["prometheus"] = REGISTRY.snapshot()
+    return metrics
+
+async def report_metrics(worker_id: int, metrics_queue, interval: float = 10):
+    while True:
+        await asyncio.sleep(interval)
+        metrics_queue.put((worker_id, worker_metrics()))
+
+def load_catalog_index():
+    """加载 MUSIC_CATALOG_PATH 指定的外部曲库；多进程模式下在主进程 fork 前调用，工作进程共享"""
+    catalog_path = os.getenv('MUSIC_CATALOG_PATH')
+    if catalog_path:
+        for song in load_catalog(catalog_path):
+            catalog_index.add(song)
+        catalog_index.sort_values()
+        logger.info("已加载曲库: %d 首歌曲", len(catalog_index))
+
+def run_worker(worker_id: int, metrics_queue):
+    """工作进程入口"""
+    asyncio.run(main(worker_id, metrics_queue))
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="免费音乐MCP WebSocket服务器")
+    parser.add_argument("--workers", type=int, default=int(os.getenv('WORKERS', 1)),
+                        help="工作进程数，大于1时通过 SO_REUSEPORT 共享端口；"
+                             "音频分块缓存的 STREAM_CACHE_MAX_BYTES 由各进程平分")
+    args = parser.parse_args()
+    
+    if args.workers > 1 and not REUSE_PORT_AVAILABLE:
+        logger.warning("当前平台不支持 SO_REUSEPORT，使用单进程模式")
+        args.workers = 1
+    worker_count = args.workers
+    
+    # 曲库只解析、建索引一次
+    load_catalog_index()
+    
+    if args.workers > 1:
+        # 已建好的索引移出垃圾回收跟踪，避免工作进程中的回收扫描触发写时复制
+        gc.freeze()
+        supervisor = WorkerSupervisor(run_worker, args.workers)
+        if METRICS_PORT:
+            # 工作进程各自上报指标快照，由主进程汇总输出
+            serve_metrics_in_thread(
+                os.getenv('HOST', '0.0.0.0'), METRICS_PORT,
+                lambda: REGISTRY.render(supervisor.totals().get("prometheus", {})))
+        supervisor.run()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus 指标
+计数器、仪表与直方图，按 Prometheus 文本格式输出，通过 HTTP /metrics 暴露；
+snapshot() 得到只含数值的嵌套字典，多进程模式下由主进程累加各工作进程的快照后统一输出
+"""
+
+import asyncio
+import bisect
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 延迟直方图的默认分桶(秒)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """指标基类，样本按标签值保存，标签值拼接为 Prometheus 的标签字符串作为键"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._labels: Dict[Tuple, str] = {}
+
+    def _key(self, labels: Tuple) -> str:
+        """标签值对应的标签字符串，缓存以免热路径重复拼接"""
+        key = self._labels.get(labels)
+        if key is None:
+            if len(labels) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+            key = self._labels[labels] = ",".join(
+                f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+        return key
+
+    def samples(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def render(self, samples: Dict[str, Any]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(samples.items()):
+            lines.append(f"{self.name}{{{labels}}} {_format_value(value)}" if labels
+                         else f"{self.name} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[str, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Dict[str, Any]:
+        return dict(self._values)
+
+
+class Gauge(Metric):
+    """仪表；设置了 function 时在采集时调用，返回 {标签值元组: 数值}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+        self._values: Dict[str, float] = {}
+
+    def set(self, value: float, *labels):
+        self._values[self._key(labels)] = value
+
+    def samples(self) -> Dict[str, Any]:
+        if self.function is None:
+            return dict(self._values)
+        try:
+            return {self._key(labels): value for labels, value in self.function().items()}
+        except Exception as e:
+            logger.warning("采集指标失败 %s: %s", self.name, e)
+            return {}
+
+
+class CallbackCounter(Gauge):
+    """由已有统计数据(如缓存命中数)在采集时生成的计数器"""
+
+    kind = "counter"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签字符串 -> [各分桶计数(非累计，最后一个为 +Inf), 总和]
+        self._values: Dict[str, list] = {}
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self) -> Dict[str, Any]:
+        samples = {}
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                buckets[_format_value(bound)] = cumulative
+            samples[key] = {"bucket": buckets, "sum": total, "count": cumulative}
+        return samples
+
+    def render(self, samples: Dict[str, Any]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        bounds = [_format_value(bound) for bound in self.buckets + (float("inf"),)]
+        for labels, sample in sorted(samples.items()):
+            prefix = f"{labels}," if labels else ""
+            for bound in bounds:
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {sample["bucket"].get(bound, 0)}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {_format_value(sample['sum'])}")
+            lines.append(f"{self.name}_count{suffix} {sample['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            # 模块被重复导入时复用已有指标
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              function: Optional[Callable[[], Dict[Tuple, float]]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def callback_counter(self, name: str, documentation: str, labelnames: Sequence[str],
+                         function: Callable[[], Dict[Tuple, float]]) -> CallbackCounter:
+        return self.register(CallbackCounter(name, documentation, labelnames, function))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """当前全部样本，可以跨进程传递与累加"""
+        return {name: metric.samples() for name, metric in self._metrics.items()}
+
+    def render(self, snapshot: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+        """Prometheus 文本格式；snapshot 为累加后的快照时按其输出"""
+        if snapshot is None:
+            snapshot = self.snapshot()
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.extend(metric.render(snapshot.get(name) or {}))
+        return "\n".join(lines) + "\n"
+
+
+# 进程内默认注册表
+REGISTRY = MetricsRegistry()
+
+# MCP 请求，两种服务器共用
+REQUESTS = REGISTRY.counter("mcp_requests_total", "JSON-RPC 请求数", ("method",))
+REQUEST_LATENCY = REGISTRY.histogram("mcp_request_duration_seconds", "JSON-RPC 请求处理时间(秒)", ("method",))
+TOOL_CALLS = REGISTRY.counter("mcp_tool_calls_total", "工具调用次数", ("tool", "outcome"))
+TOOL_LATENCY = REGISTRY.histogram("mcp_tool_duration_seconds", "工具执行时间(秒)", ("tool",))
+ERRORS = REGISTRY.counter("mcp_errors_total", "JSON-RPC 错误响应数", ("code",))
+
+# 上游请求延迟，按提供方记录
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "music_upstream_request_seconds", "上游请求延迟(秒)", ("provider", "outcome"))
+
+
+def record_response(response: Any) -> Optional[int]:
+    """统计错误响应，返回单个响应的错误码"""
+    if isinstance(response, dict):
+        error = response.get("error")
+        if isinstance(error, dict):
+            ERRORS.inc(error.get("code"))
+            return error.get("code")
+    elif isinstance(response, list):
+        for item in response:
+            record_response(item)
+    return None
+
+
+def cache_counters(name: str, caches: Dict[str, Callable[[], Dict[str, Any]]],
+                   results: Sequence[str]):
+    """把各缓存 stats() 中的计数注册为 <name>{cache, result} 计数器"""
+    def collect() -> Dict[Tuple, float]:
+        samples = {}
+        for cache, stats in caches.items():
+            values = stats()
+            if values is None:
+                continue
+            for result in results:
+                if result in values:
+                    samples[(cache, result)] = values[result]
+        return samples
+
+    return REGISTRY.callback_counter(name, "缓存查询次数", ("cache", "result"), collect)
+
+
+async def serve_metrics(host: str, port: int, render: Callable[[], str] = REGISTRY.render,
+                        reuse_port: bool = False) -> asyncio.AbstractServer:
+    """启动 HTTP 指标端点，GET /metrics 返回 render() 的结果"""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            while (await asyncio.wait_for(reader.readline(), 10)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] in ("GET", "HEAD") and parts[1].split("?")[0] == "/metrics":
+                body = render().encode("utf-8")
+                status = "200 OK"
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                body, status, content_type = b"Not Found\n", "404 Not Found", "text/plain"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+            if parts[:1] != ["HEAD"]:
+                writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.warning("输出指标失败: %s", e)
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port, reuse_port=reuse_port or None)
+
+
+def serve_metrics_in_thread(host: str, port: int, render: Callable[[], str]) -> threading.Thread:
+    """在后台线程的事件循环中运行指标端点，用于没有事件循环的多进程主进程"""
+    async def run():
+        server = await serve_metrics(host, port, render)
+        async with server:
+            await server.serve_forever()
+
+    thread = threading.Thread(target=lambda: asyncio.run(run()), name="metrics-http", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+播放列表
+双向链表 + 游标实现常数时间的上一首/下一首/插入/删除，
+并支持随机播放与循环模式，切换模式时不需要重建列表
+"""
+
+import random
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional
+
+# 循环模式
+REPEAT_OFF = "off"
+REPEAT_ALL = "all"
+REPEAT_ONE = "one"
+REPEAT_MODES = (REPEAT_OFF, REPEAT_ALL, REPEAT_ONE)
+
+# 随机播放时可回退的历史长度
+SHUFFLE_HISTORY_LENGTH = 100
+
+
+class PlaylistEntry:
+    """播放列表中的一项，同一首歌可以出现多次"""
+
+    __slots__ = ("song", "prev", "next", "slot")
+
+    def __init__(self, song: Dict[str, Any]):
+        self.song = song
+        self.prev: Optional["PlaylistEntry"] = None
+        self.next: Optional["PlaylistEntry"] = None
+        self.slot = -1
+
+
+class Playlist:
+    """播放列表
+
+    - 链表保存播放顺序，游标指向当前项，上一首/下一首只需移动指针；
+    - id -> 条目 的映射用于按歌曲ID定位和删除，重复ID互不影响；
+    - 随机播放使用条目数组的分区：slots[:unplayed] 为本轮尚未播放的条目，
+      抽取、插入、删除都通过交换完成，不需要重新洗牌整个列表。
+    """
+
+    def __init__(self, shuffle: bool = False, repeat: str = REPEAT_ALL):
+        self._head: Optional[PlaylistEntry] = None
+        self._tail: Optional[PlaylistEntry] = None
+        self._cursor: Optional[PlaylistEntry] = None
+        self._positions: Dict[str, Dict[PlaylistEntry, None]] = {}
+        self._slots: List[PlaylistEntry] = []
+        self._unplayed = 0
+        self._shuffle_next: Optional[PlaylistEntry] = None
+        self._history: deque = deque(maxlen=SHUFFLE_HISTORY_LENGTH)
+        self.shuffle = shuffle
+        self.repeat = repeat
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __bool__(self) -> bool:
+        return bool(self._slots)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        entry = self._head
+        while entry is not None:
+            yield entry.song
+            entry = entry.next
+
+    @property
+    def current(self) -> Optional[Dict[str, Any]]:
+        """游标所在的歌曲"""
+        return self._cursor.song if self._cursor is not None else None
+
+    def songs(self) -> List[Dict[str, Any]]:
+        """按播放顺序返回所有歌曲"""
+        return list(self)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """可序列化的列表状态：歌曲、游标位置与播放模式(随机轮次不保存)"""
+        cursor = None
+        for index, entry in enumerate(self._iter_entries()):
+            if entry is self._cursor:
+                cursor = index
+                break
+        return {"songs": self.songs(), "cursor": cursor, "shuffle": self.shuffle, "repeat": self.repeat}
+
+    @classmethod
+    def restore(cls, snapshot: Dict[str, Any]) -> "Playlist":
+        """从 snapshot() 的结果重建列表"""
+        playlist = cls(shuffle=snapshot.get("shuffle", False), repeat=snapshot.get("repeat", REPEAT_ALL))
+        entries = [playlist.append(song) for song in snapshot.get("songs", ())]
+        cursor = snapshot.get("cursor")
+        if cursor is not None and 0 <= cursor < len(entries):
+            playlist._move(entries[cursor])
+        return playlist
+
+    def _iter_entries(self) -> Iterator[PlaylistEntry]:
+        entry = self._head
+        while entry is not None:
+            yield entry
+            entry = entry.next
+
+    # ---- 随机分区维护 ----
+
+    def _swap(self, i: int, j: int):
+        slots = self._slots
+        slots[i], slots[j] = slots[j], slots[i]
+        slots[i].slot = i
+        slots[j].slot = j
+
+    def _mark_played(self, entry: PlaylistEntry):
+        """把条目移出本轮未播放区"""
+        if entry.slot < self._unplayed:
+            self._swap(entry.slot, self._unplayed - 1)
+            self._unplayed -= 1
+
+    def _pick_shuffle(self) -> Optional[PlaylistEntry]:
+        """从本轮未播放的条目中随机抽取一项"""
+        if self._unplayed == 0:
+            if self.repeat == REPEAT_OFF:
+                return None
+            # 开始新的一轮，当前歌曲不会紧接着再次抽中
+            self._unplayed = len(self._slots)
+            if self._cursor is not None and len(self._slots) > 1:
+                self._mark_played(self._cursor)
+        return self._slots[random.randrange(self._unplayed)]
+
+    # ---- 增删 ----
+
+    def _link_after(self, entry: PlaylistEntry, after: Optional[PlaylistEntry]):
+        if after is None:
+            entry.next = self._head
+            if self._head is not None:
+                self._head.prev = entry
+            self._head = entry
+        else:
+            entry.prev = after
+            entry.next = after.next
+            if after.next is not None:
+                after.next.prev = entry
+            after.next = entry
+        if entry.next is None:
+            self._tail = entry
+
+        entry.slot = len(self._slots)
+        self._slots.append(entry)
+        self._swap(entry.slot, self._unplayed)
+        self._unplayed += 1
+        self._positions.setdefault(str(entry.song["id"]), {})[entry] = None
+
+    def append(self, song: Dict[str, Any]) -> PlaylistEntry:
+        """添加到末尾"""
+        entry = PlaylistEntry(song)
+        self._link_after(entry, self._tail)
+        return entry
+
+    def insert_next(self, song: Dict[str, Any]) -> PlaylistEntry:
+        """插入到当前歌曲之后(下一首播放)"""
+        entry = PlaylistEntry(song)
+        self._link_after(entry, self._cursor)
+        if self.shuffle:
+            self._shuffle_next = entry
+        return entry
+
+    def remove(self, entry: PlaylistEntry):
+        """删除条目"""
+        if entry.slot < 0:
+            return
+        if entry is self._cursor:
+            self._cursor = entry.prev
+        if entry is self._shuffle_next:
+            self._shuffle_next = None
+
+        if entry.prev is not None:
+            entry.prev.next = entry.next
+        else:
+            self._head = entry.next
+        if entry.next is not None:
+            entry.next.prev = entry.prev
+        else:
+            self._tail = entry.prev
+
+        self._mark_played(entry)
+        self._swap(entry.slot, len(self._slots) - 1)
+        self._slots.pop()
+        entry.slot = -1
+
+        song_id = str(entry.song["id"])
+        positions = self._positions[song_id]
+        del positions[entry]
+        if not positions:
+            del self._positions[song_id]
+
+    def remove_id(self, song_id: str) -> int:
+        """删除某首歌的所有条目，返回删除数量"""
+        entries = list(self._positions.get(str(song_id), ()))
+        for entry in entries:
+            self.remove(entry)
+        return len(entries)
+
+    def clear(self):
+        """清空列表，保留播放模式"""
+        self.__init__(shuffle=self.shuffle, repeat=self.repeat)
+
+    def find(self, song_id: str) -> Optional[PlaylistEntry]:
+        """按歌曲ID查找第一次出现的条目"""
+        positions = self._positions.get(str(song_id))
+        return next(iter(positions)) if positions else None
+
+    def seek(self, song_id: str) -> Optional[Dict[str, Any]]:
+        """将游标移到指定歌曲；歌曲不在列表中时游标复位"""
+        self._move(self.find(song_id))
+        return self.current
+
+    # ---- 模式与导航 ----
+
+    def set_mode(self, shuffle: Optional[bool] = None, repeat: Optional[str] = None):
+        """设置随机/循环模式"""
+        if repeat is not None:
+            if repeat not in REPEAT_MODES:
+                raise ValueError(f"未知循环模式: {repeat}")
+            self.repeat = repeat
+        if shuffle is not None and shuffle != self.shuffle:
+            self.shuffle = shuffle
+            self._shuffle_next = None
+            self._history.clear()
+            if shuffle:
+                self._unplayed = len(self._slots)
+                if self._cursor is not None:
+                    self._mark_played(self._cursor)
+
+    def _move(self, entry: Optional[PlaylistEntry]) -> Optional[Dict[str, Any]]:
+        if self.shuffle and self._cursor is not None and entry is not self._cursor:
+            self._history.append(self._cursor)
+        self._cursor = entry
+        if entry is not None:
+            self._mark_played(entry)
+        return self.current
+
+    def _linear_next(self) -> Optional[PlaylistEntry]:
+        if self._cursor is None:
+            return self._head
+        if self._cursor.next is not None:
+            return self._cursor.next
+        return self._head if self.repeat != REPEAT_OFF else None
+
+    def _linear_previous(self) -> Optional[PlaylistEntry]:
+        if self._cursor is None:
+            return self._tail
+        if self._cursor.prev is not None:
+            return self._cursor.prev
+        return self._tail if self.repeat != REPEAT_OFF else None
+
+    def peek_next(self, auto: bool = True) -> Optional[Dict[str, Any]]:
+        """查看下一首但不移动游标；随机模式下抽中的歌曲会保留给下一次 next()"""
+        if not self._slots:
+            return None
+        if auto and self.repeat == REPEAT_ONE and self._cursor is not None:
+            return self._cursor.song
+        if not self.shuffle:
+            entry = self._linear_next()
+        else:
+            if self._shuffle_next is None:
+                self._shuffle_next = self._pick_shuffle()
+            entry = self._shuffle_next
+        return entry.song if entry is not None else None
+
+    def next(self, auto: bool = False) -> Optional[Dict[str, Any]]:
+        """切换到下一首；auto 表示自动连播，此时单曲循环生效。到达末尾且不循环时返回None"""
+        if not self._slots:
+            return None
+        if auto and self.repeat == REPEAT_ONE and self._cursor is not None:
+            return self._cursor.song
+        if not self.shuffle:
+            entry = self._linear_next()
+        else:
+            entry = self._shuffle_next or self._pick_shuffle()
+            self._shuffle_next = None
+        return self._move(entry) if entry is not None else None
+
+    def previous(self) -> Optional[Dict[str, Any]]:
+        """切换到上一首；随机模式下回到上一首实际播放过的歌曲"""
+        if not self._slots:
+            return None
+        if self.shuffle:
+            while self._history:
+                entry = self._history.pop()
+                if entry.slot >= 0:
+                    self._cursor = entry
+                    self._shuffle_next = None
+                    return entry.song
+        entry = self._linear_previous()
+        if entry is None:
+            return None
+        self._cursor = entry
+        if self.shuffle:
+            self._mark_played(entry)
+        return entry.song
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下一首预取
+定期检查各会话的播放进度，当前歌曲接近结束时预热下一首的元数据/播放地址缓存与开头的音频分块；
+切歌后也会立即预热新的下一首。预热任务数受并发上限约束，同一首歌同时只预热一次
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from music_session import PlaybackSession, SessionManager
+
+logger = logging.getLogger(__name__)
+
+
+def song_duration(song: Dict[str, Any]) -> Optional[float]:
+    """歌曲时长(秒)，未知时返回None"""
+    return song.get("duration")
+
+
+class Prefetcher:
+    """下一首预取器
+
+    warm 为预热单首歌曲的协程函数；剩余时长不足 lead_time 秒时开始预热下一首。
+    并发中的预热达到 max_pending 时新的请求被跳过，下一轮检查时重试。
+    """
+
+    def __init__(self, sessions: SessionManager, warm: Callable[[Dict[str, Any]], Awaitable[Any]],
+                 lead_time: float = 30, max_concurrency: int = 4, max_pending: int = 64,
+                 duration: Callable[[Dict[str, Any]], Optional[float]] = song_duration):
+        self.sessions = sessions
+        self.warm = warm
+        self.lead_time = lead_time
+        self.max_pending = max_pending
+        self.duration = duration
+        self.warmed = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def request(self, session: PlaybackSession):
+        """预热会话的下一首；已为当前下一首预热过(或正在预热)时不重复，预热失败后下次检查时重试"""
+        song = session.playlist.peek_next(auto=True)
+        if song is None:
+            return
+        song_id = str(song["id"])
+        if session.prefetched == song_id:
+            return
+        task = self._pending.get(song_id)
+        if task is None:
+            if len(self._pending) >= self.max_pending:
+                return
+            task = asyncio.ensure_future(self._warm(song))
+            self._pending[song_id] = task
+            task.add_done_callback(lambda done: self._pending.pop(song_id, None))
+        session.prefetched = song_id
+        task.add_done_callback(lambda done: self._finish(session, song_id, done))
+
+    @staticmethod
+    def _finish(session: PlaybackSession, song_id: str, task: asyncio.Task):
+        """预热失败或被取消时清除标记"""
+        if (task.cancelled() or not task.result()) and session.prefetched == song_id:
+            session.prefetched = None
+
+    def check(self):
+        """为即将播完的会话预热下一首"""
+        for session in self.sessions:
+            song = session.current_song
+            if not session.is_playing or not song or not session.playlist:
+                continue
+            duration = self.duration(song)
+            if duration and duration - session.position <= self.lead_time:
+                self.request(session)
+
+    async def _warm(self, song: Dict[str, Any]) -> bool:
+        """预热一首歌，返回是否成功"""
+        async with self._semaphore:
+            try:
+                await self.warm(song)
+            except Exception as e:
+                logger.warning("预取失败 %s: %s", song.get('id'), e)
+                return False
+            self.warmed += 1
+            return True
+
+    async def run(self, interval: float = 2):
+        """定期检查播放进度"""
+        while True:
+            await asyncio.sleep(interval)
+            self.check()
+
+    async def aclose(self):
+        """取消进行中的预热，在关闭上游连接池之前调用"""
+        tasks = list(self._pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
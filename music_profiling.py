@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能剖析
+按需开启的 cProfile 时间窗口，结束后在线程池中写入 PROFILE_DIR；
+最慢的 N 次工具调用始终记录，不需要开启剖析窗口即可查询，窗口摘要中另附窗口内最慢的调用；
+事件循环延迟监视：心跳超时时由监视线程抓取事件循环线程当前的调用栈，定位阻塞事件循环的代码
+"""
+
+import asyncio
+import cProfile
+import heapq
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+from music_metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = REGISTRY.histogram(
+    "music_event_loop_lag_seconds", "事件循环调度延迟(秒)",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+
+def _dump_path(directory: str, prefix: str, suffix: str) -> str:
+    return os.path.join(directory, f"{prefix}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}{suffix}")
+
+
+def _push_slowest(calls: List[tuple], limit: int, entry: tuple):
+    """把调用加入最小堆，只保留最慢的 limit 次"""
+    if len(calls) < limit:
+        heapq.heappush(calls, entry)
+    elif entry[0] > calls[0][0]:
+        heapq.heapreplace(calls, entry)
+
+
+class Profiler:
+    """工具调用剖析
+
+    start(seconds) 在事件循环线程开启 cProfile，到时自动 stop；stop 在线程池中写出 .pstats 与文本摘要，
+    摘要中包含按累计时间排序的函数与窗口内最慢的 slowest 次工具调用。
+    record_call 始终保留进程内最慢的 slowest 次工具调用，由 slowest_calls 查询。
+    """
+
+    def __init__(self, directory: str = "profiles", slowest: int = 20):
+        self.directory = directory
+        self.slowest = slowest
+        self.last_dump: Optional[str] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._started = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 剖析窗口内与进程启动以来最慢的调用，(耗时, 序号, 工具, 参数, 开始时间) 的最小堆
+        self._calls: List[tuple] = []
+        self._slowest: List[tuple] = []
+        self._sequence = itertools.count()
+
+    @property
+    def active(self) -> bool:
+        return self._profile is not None
+
+    def start(self, seconds: float = 30) -> bool:
+        """开始剖析窗口，已在进行时返回 False"""
+        if self._profile is not None:
+            return False
+        self._calls = []
+        self._started = time.time()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self._timer = asyncio.get_running_loop().call_later(seconds, self.stop)
+        logger.info("开始性能剖析，%s 秒后写入 %s", seconds, self.directory)
+        return True
+
+    def stop(self) -> Optional[str]:
+        """结束剖析并在线程池中写出结果，返回文件路径(不含扩展名)；不在事件循环中调用时直接写出"""
+        if self._profile is None:
+            return None
+        self._profile.disable()
+        profile, self._profile = self._profile, None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        base = _dump_path(self.directory, "profile", "")
+        args = (profile, base, sorted(self._calls, reverse=True), self._started, time.time())
+        self._calls = []
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(*args)
+            return base
+        # 汇总与写盘可能耗时数百毫秒，不阻塞事件循环；asyncio.run 退出前会等待线程池任务完成
+        loop.run_in_executor(None, self._write, *args).add_done_callback(self._written)
+        return base
+
+    def _write(self, profile: cProfile.Profile, base: str, calls: List[tuple], started: float, ended: float):
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(base + ".pstats")
+        summary = io.StringIO()
+        summary.write(f"剖析窗口: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))} "
+                      f"起 {ended - started:.1f} 秒\n\n最慢的工具调用:\n")
+        for duration, _, tool, arguments, called in calls:
+            summary.write(f"  {duration * 1000:9.2f}ms  {tool}  {arguments}  "
+                          f"@{time.strftime('%H:%M:%S', time.localtime(called))}\n")
+        summary.write("\n")
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(40)
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(summary.getvalue())
+        self.last_dump = base
+        logger.info("性能剖析结果已写入 %s.pstats / .txt", base)
+
+    @staticmethod
+    def _written(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("写入性能剖析结果失败: %s", future.exception())
+
+    def toggle(self, seconds: float = 30) -> Optional[str]:
+        """未在剖析时开始，否则立即结束"""
+        if self._profile is None:
+            self.start(seconds)
+            return None
+        return self.stop()
+
+    def record_call(self, tool: str, arguments: Any, duration: float):
+        """记录一次工具调用，只保留最慢的 slowest 次；比已记录的都快时不做其他处理"""
+        if self.slowest <= 0:
+            return
+        keep = len(self._slowest) < self.slowest or duration > self._slowest[0][0]
+        in_window = self.active and (len(self._calls) < self.slowest or duration > self._calls[0][0])
+        if not (keep or in_window):
+            return
+        arguments = json.dumps(arguments, ensure_ascii=False, default=str)[:200]
+        entry = (duration, next(self._sequence), tool, arguments, time.time() - duration)
+        if keep:
+            _push_slowest(self._slowest, self.slowest, entry)
+        if in_window:
+            _push_slowest(self._calls, self.slowest, entry)
+
+    def slowest_calls(self) -> List[Dict[str, Any]]:
+        """进程启动以来最慢的工具调用，按耗时从长到短"""
+        return [
+            {"tool": tool, "duration_ms": round(duration * 1000, 2), "arguments": arguments,
+             "started": started}
+            for duration, _, tool, arguments, started in sorted(self._slowest, reverse=True)
+        ]
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "elapsed": time.time() - self._started if self.active else None,
+            "last_dump": self.last_dump
+        }
+
+
+class LoopMonitor:
+    """事件循环延迟监视
+
+    事件循环每 interval 秒记录一次心跳并统计调度延迟；监视线程发现心跳超过 threshold 秒未更新时，
+    抓取事件循环线程的调用栈写入日志与 PROFILE_DIR 下的 loop-blocks-<pid>.jsonl，每次阻塞只记录一次。
+    """
+
+    def __init__(self, interval: float = 0.05, threshold: float = 0.2, directory: Optional[str] = None):
+        self.interval = interval
+        self.threshold = threshold
+        self.directory = directory
+        self.blocks = 0
+        self._beat = time.monotonic()
+        self._thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+        self._path: Optional[str] = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-monitor", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG.observe(max(0.0, now - expected))
+            self._beat = now
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat
+            if blocked < self.threshold or reported == beat:
+                continue
+            # 同一次阻塞只记录一次
+            reported = beat
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            self.blocks += 1
+            logger.warning("事件循环已阻塞 %.0fms，当前调用栈:\n%s", blocked * 1000, stack)
+            if self.directory:
+                self._record(blocked, stack)
+
+    def _record(self, blocked: float, stack: str):
+        try:
+            if self._path is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._path = os.path.join(self.directory, f"loop-blocks-{os.getpid()}.jsonl")
+            with open(self._path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"ts": time.time(), "blocked_ms": round(blocked * 1000, 1),
+                                    "stack": stack}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning("写入阻塞记录失败: %s", e)
+
+
+def profile_command(profiler: Profiler, action: str = "status", seconds: Any = 30) -> Dict[str, Any]:
+    """管理命令：start 开始剖析窗口，stop 立即结束并写出，status 查询状态，slowest 查询最慢的工具调用；
+    参数不合法时抛出 ValueError"""
+    if action == "start":
+        try:
+            seconds = float(seconds)
+        except (TypeError, ValueError):
+            raise ValueError(f"剖析时长必须是数字: {seconds!r}")
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise ValueError(f"剖析时长必须是正数: {seconds}")
+        profiler.start(seconds)
+    elif action == "stop":
+        profiler.stop()
+    elif action == "slowest":
+        return dict(profiler.status(), slowest_calls=profiler.slowest_calls())
+    elif action != "status":
+        raise ValueError(f"未知的剖析操作: {action}")
+    return profiler.status()
+
+
+def install_profiling(profiler: Profiler, window: float, loop_monitor: Optional[LoopMonitor] = None):
+    """SIGUSR1 开始/结束剖析窗口，并启动事件循环监视；在事件循环中调用"""
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            getattr(signal, "SIGUSR1"), profiler.toggle, window)
+    except (AttributeError, NotImplementedError):
+        pass
+    if loop_monitor is not None:
+        loop_monitor.start()
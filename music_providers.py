@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游音乐API提供方
+每个提供方持有一个共享的 httpx.AsyncClient 连接池(keep-alive，可用时启用HTTP/2)，
+并有独立的超时与并发上限；fan_out_search 并发查询多个提供方并对慢请求做对冲
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import httpx
+
+from music_metrics import UPSTREAM_LATENCY
+from music_text import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# 安装了 h2 时启用 HTTP/2
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# 各提供方默认超时(秒)
+DEFAULT_TIMEOUTS = {
+    "netease": 3.0,
+    "qq": 3.0,
+    "kugou": 5.0,
+}
+
+# 计算对冲延迟所需的最少延迟样本数，样本不足时使用超时的一半
+MIN_LATENCY_SAMPLES = 20
+
+
+class MusicProvider:
+    """上游音乐API提供方基类"""
+
+    name = ""
+    # 是否支持搜索，不支持的提供方只用于按ID回查歌曲
+    searchable = True
+
+    def __init__(self, base_url: str, timeout: float = 5.0, max_connections: int = 20,
+                 max_concurrency: int = 10, http2: Optional[bool] = None):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.http2 = HTTP2_AVAILABLE if http2 is None else http2
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=30
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self.latencies: deque = deque(maxlen=200)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """共享的连接池客户端，首次使用时创建"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=self._limits,
+                http2=self.http2,
+                headers={"User-Agent": "music-mcp-server/1.0"}
+            )
+        return self._client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """并发上限，首次使用时在运行中的事件循环内创建；
+        提供方在导入时构造，Python 3.9 的 Semaphore 会绑定创建时的默认事件循环"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def request_json(self, path: str = "", params: Optional[Dict[str, Any]] = None) -> Any:
+        """在并发上限内发起GET请求并解析JSON"""
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self.client.get(path, params=params)
+                response.raise_for_status()
+            except httpx.HTTPError:
+                UPSTREAM_LATENCY.observe(time.perf_counter() - started, self.name, "error")
+                raise
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, self.name, "ok")
+            return response.json()
+
+    def make_song(self, song_id: Any, name: str, artist: str, album: str,
+                  duration: int, url: Optional[str] = None) -> Dict[str, Any]:
+        """构造统一格式的歌曲记录，ID带提供方前缀以便回查"""
+        return {
+            "id": f"{self.name}:{song_id}",
+            "name": name,
+            "artist": artist,
+            "album": album,
+            "duration": duration,
+            "url": url,
+            "provider": self.name
+        }
+
+    async def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """搜索歌曲"""
+        return []
+
+    async def timed_search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """搜索并记录成功请求的延迟"""
+        started = time.monotonic()
+        results = await self.search(query, limit)
+        self.latencies.append(time.monotonic() - started)
+        return results
+
+    def hedge_delay(self) -> float:
+        """发起对冲请求前的等待时间：近期延迟的p95"""
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return self.timeout / 2
+        samples = sorted(self.latencies)
+        return samples[int(len(samples) * 0.95) - 1]
+
+    async def get_song(self, song_id: str) -> Optional[Dict[str, Any]]:
+        """获取歌曲详情，song_id 不带提供方前缀；不存在时返回None"""
+        return None
+
+    async def aclose(self):
+        """关闭连接池"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class NeteaseProvider(MusicProvider):
+    """网易云音乐"""
+
+    name = "netease"
+
+    def _parse_song(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        artists = item.get("artists") or item.get("ar") or [{}]
+        album = item.get("album") or item.get("al") or {}
+        song_id = item["id"]
+        return self.make_song(
+            song_id,
+            item.get("name", ""),
+            artists[0].get("name", ""),
+            album.get("name", ""),
+            (item.get("duration") or item.get("dt") or 0) // 1000,
+            f"https://music.163.com/song/media/outer/url?id={song_id}.mp3"
+        )
+
+    async def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        data = await self.request_json("/search/get/web", {"s": query, "type": 1, "limit": limit, "offset": 0})
+        songs = (data.get("result") or {}).get("songs") or []
+        return [self._parse_song(item) for item in songs[:limit]]
+
+    async def get_song(self, song_id: str) -> Optional[Dict[str, Any]]:
+        data = await self.request_json("/song/detail", {"ids": f"[{song_id}]"})
+        songs = data.get("songs") or []
+        return self._parse_song(songs[0]) if songs else None
+
+
+class KugouProvider(MusicProvider):
+    """酷狗音乐"""
+
+    name = "kugou"
+
+    async def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        data = await self.request_json("", {"keyword": query, "page": 1, "pagesize": limit, "format": "json"})
+        songs = (data.get("data") or {}).get("info") or []
+        return [
+            self.make_song(
+                item.get("hash", ""),
+                item.get("songname", ""),
+                item.get("singername", ""),
+                item.get("album_name", ""),
+                int(item.get("duration") or 0)
+            )
+            for item in songs[:limit]
+        ]
+
+
+class QQProvider(MusicProvider):
+    """QQ音乐，配置的接口只支持按 songmid 查询单曲"""
+
+    name = "qq"
+    searchable = False
+
+    async def get_song(self, song_id: str) -> Optional[Dict[str, Any]]:
+        data = await self.request_json("", {"songmid": song_id, "format": "json"})
+        songs = data.get("data") or []
+        if not songs:
+            return None
+        item = songs[0]
+        singers = item.get("singer") or [{}]
+        return self.make_song(
+            item.get("mid", song_id),
+            item.get("name", ""),
+            singers[0].get("name", ""),
+            (item.get("album") or {}).get("name", ""),
+            int(item.get("interval") or 0),
+            (data.get("url") or {}).get(str(item.get("id"))) or None
+        )
+
+
+PROVIDER_CLASSES = {
+    "netease": NeteaseProvider,
+    "qq": QQProvider,
+    "kugou": KugouProvider,
+}
+
+
+class ProviderPool:
+    """已启用的提供方集合"""
+
+    def __init__(self, providers: Iterable[MusicProvider] = ()):
+        self.providers: Dict[str, MusicProvider] = {provider.name: provider for provider in providers}
+
+    def __bool__(self) -> bool:
+        return bool(self.providers)
+
+    def __iter__(self):
+        return iter(self.providers.values())
+
+    def get(self, name: str) -> Optional[MusicProvider]:
+        return self.providers.get(name)
+
+    def searchable(self) -> List[MusicProvider]:
+        """参与搜索的提供方"""
+        return [provider for provider in self if provider.searchable]
+
+    async def aclose(self):
+        await asyncio.gather(*(provider.aclose() for provider in self))
+
+
+def create_providers(apis: Dict[str, str], enabled: Optional[Iterable[str]] = None) -> ProviderPool:
+    """按配置创建提供方
+
+    enabled 默认读取 MUSIC_PROVIDERS(逗号分隔)，未配置时不启用任何上游；
+    MUSIC_API_<NAME> 可覆盖接口地址(例如指向本地桩服务器)，
+    MUSIC_API_<NAME>_TIMEOUT / MUSIC_API_CONCURRENCY 调整超时与并发上限。
+    """
+    if enabled is None:
+        enabled = [name.strip() for name in os.getenv("MUSIC_PROVIDERS", "").split(",") if name.strip()]
+
+    providers = []
+    for name in enabled:
+        provider_class = PROVIDER_CLASSES.get(name)
+        if provider_class is None or name not in apis:
+            logger.warning("未知的音乐提供方: %s", name)
+            continue
+        env_name = name.upper()
+        providers.append(provider_class(
+            os.getenv(f"MUSIC_API_{env_name}", apis[name]),
+            timeout=float(os.getenv(f"MUSIC_API_{env_name}_TIMEOUT", DEFAULT_TIMEOUTS.get(name, 5.0))),
+            max_concurrency=int(os.getenv("MUSIC_API_CONCURRENCY", 10))
+        ))
+        if not provider_class.searchable:
+            logger.info("音乐提供方 %s 不支持搜索，只用于按ID查询歌曲", name)
+    return ProviderPool(providers)
+
+
+def song_key(song: Dict[str, Any]) -> Tuple[str, str]:
+    """去重键：归一化后的歌名与歌手"""
+    return normalize_text(song.get("name", "")), normalize_text(song.get("artist", ""))
+
+
+async def _cancel_all(tasks: Iterable[asyncio.Task]):
+    tasks = [task for task in tasks if not task.done()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def hedged_search(provider: MusicProvider, query: str, limit: int,
+                        hedge: bool = True) -> List[Dict[str, Any]]:
+    """搜索单个提供方；超过 p95 延迟仍未返回时再发一个相同请求，取先成功的结果"""
+    attempts = {asyncio.create_task(provider.timed_search(query, limit))}
+    try:
+        if hedge:
+            done, _ = await asyncio.wait(attempts, timeout=provider.hedge_delay())
+            if not done:
+                attempts.add(asyncio.create_task(provider.timed_search(query, limit)))
+
+        error: Optional[BaseException] = None
+        pending: Set[asyncio.Task] = set(attempts)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        await _cancel_all(attempts)
+
+
+async def fan_out_search(providers: Iterable[MusicProvider], query: str, limit: int = 10,
+                         deadline: float = 2.0, hedge: bool = True) -> List[Dict[str, Any]]:
+    """并发查询多个提供方
+
+    结果按到达顺序合并并按歌名+歌手去重，凑够 limit 条立即返回；
+    到达 deadline 时返回已有结果，未完成的请求全部取消。
+    """
+    tasks = {
+        asyncio.create_task(hedged_search(provider, query, limit, hedge)): provider
+        for provider in providers
+    }
+    results: List[Dict[str, Any]] = []
+    seen: Set[Tuple[str, str]] = set()
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    pending = set(tasks)
+    try:
+        while pending and len(results) < limit:
+            remaining = end - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                provider = tasks[task]
+                if task.exception() is not None:
+                    logger.warning("%s 搜索失败: %s", provider.name, task.exception())
+                    continue
+                for song in task.result():
+                    key = song_key(song)
+                    if key not in seen:
+                        seen.add(key)
+                        results.append(song)
+        if pending:
+            logger.info("搜索提前返回，取消 %d 个未完成的提供方请求", len(pending))
+    finally:
+        await _cancel_all(pending)
+    return results[:limit]
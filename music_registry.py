@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工具与资源注册表
+按名称字典分发工具调用，并缓存 tools/list、resources/list 的序列化结果
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+
+from music_codec import dumps
+from music_jsonrpc import RawJSON
+from music_render import STRUCTURED_CONTENT
+from music_schema import compile_schema
+
+# 变更类型，用于 notifications/<kind>/list_changed
+TOOLS = "tools"
+RESOURCES = "resources"
+
+
+class ToolRegistry:
+    """工具与资源注册表
+
+    启动完成后调用 freeze()。列表响应按版本号缓存为已序列化的JSON，
+    每次增删工具或资源都会递增版本号使缓存失效；冻结后的变更还会通知监听者，
+    以便服务器向客户端推送 list_changed 通知。
+    structured_content 为 False 时工具结果不含 structuredContent，tools/list 也不声明 outputSchema。
+    """
+
+    def __init__(self, structured_content: bool = STRUCTURED_CONTENT):
+        self.structured_content = structured_content
+        self.tools: Dict[str, Dict[str, Any]] = {}
+        self.resources: Dict[str, Dict[str, Any]] = {}
+        self.version = 0
+        self.frozen = False
+        self._listeners: List[Callable[[str], None]] = []
+        self._cache: Dict[str, RawJSON] = {}
+
+    def add_tool(self, name: str, description: str, input_schema: Dict[str, Any], handler,
+                 read_only: bool = False, output_schema: Optional[Dict[str, Any]] = None):
+        """注册工具，read_only 的工具在批量请求中可以并发执行；inputSchema 在此编译为校验函数，
+        output_schema 描述处理函数返回的 structuredContent"""
+        self.tools[name] = {
+            "name": name,
+            "description": description,
+            "inputSchema": input_schema,
+            "outputSchema": output_schema,
+            "handler": handler,
+            "readOnly": read_only,
+            "validate": compile_schema(input_schema)
+        }
+        self._changed(TOOLS)
+
+    def remove_tool(self, name: str):
+        """注销工具"""
+        if self.tools.pop(name, None) is not None:
+            self._changed(TOOLS)
+
+    def add_resource(self, uri: str, name: str, description: str = ""):
+        """注册资源"""
+        self.resources[uri] = {
+            "uri": uri,
+            "name": name,
+            "description": description
+        }
+        self._changed(RESOURCES)
+
+    def get_tool(self, name: Optional[str]) -> Optional[Dict[str, Any]]:
+        return self.tools.get(name)
+
+    def freeze(self):
+        """启动完成，之后的变更会通知监听者"""
+        self.frozen = True
+
+    def on_change(self, listener: Callable[[str], None]):
+        """注册变更监听者，参数为变更类型 tools/resources"""
+        self._listeners.append(listener)
+
+    def _changed(self, kind: str):
+        self.version += 1
+        self._cache.clear()
+        if self.frozen:
+            for listener in self._listeners:
+                listener(kind)
+
+    def _describe(self, tool: Dict[str, Any]) -> Dict[str, Any]:
+        description = {
+            "name": tool["name"],
+            "description": tool["description"],
+            "inputSchema": tool["inputSchema"]
+        }
+        # 声明了 outputSchema 的工具必须返回 structuredContent
+        if self.structured_content and tool["outputSchema"] is not None:
+            description["outputSchema"] = tool["outputSchema"]
+        return description
+
+    def tools_list(self) -> RawJSON:
+        """tools/list 的结果，已序列化"""
+        payload = self._cache.get(TOOLS)
+        if payload is None:
+            payload = self._cache[TOOLS] = RawJSON(dumps({
+                "tools": [self._describe(tool) for tool in self.tools.values()]
+            }))
+        return payload
+
+    def resources_list(self) -> RawJSON:
+        """resources/list 的结果，已序列化"""
+        payload = self._cache.get(RESOURCES)
+        if payload is None:
+            payload = self._cache[RESOURCES] = RawJSON(dumps({
+                "resources": list(self.resources.values())
+            }))
+        return payload
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工具结果渲染
+处理函数返回 ToolResult：text 为给语音助手朗读的中文文本(按模板用 join 拼接)，
+data 为结构化数据，作为 MCP structuredContent 一并返回，客户端无需再从文本中解析歌曲ID
+"""
+
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+from music_codec import dumps
+
+# 是否在工具结果中附带 structuredContent，资源内容中附带 application/json
+STRUCTURED_CONTENT = os.getenv("MCP_STRUCTURED_CONTENT", "1").lower() not in ("0", "false", "no", "off")
+
+SEARCH_HEADER = "搜索 '{}' 的结果：\n\n"
+SEARCH_EMPTY = "未找到与 '{}' 相关的歌曲"
+SEARCH_ITEM = "{}. {} - {}\n   专辑: {}\n   时长: {}秒\n   ID: {}\n\n"
+PLAYLIST_HEADER = "当前播放列表:\n\n"
+PLAYLIST_ITEM = "{}. {} - {}\n"
+NOW_PLAYING = "当前播放: {} - {}\n状态: {}\n音量: {}%"
+
+# 结构化结果的 outputSchema
+SONG_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": ["string", "integer"]},
+        "name": {"type": "string"},
+        "artist": {"type": "string"},
+        "album": {"type": "string"},
+        "duration": {"type": "integer"}
+    },
+    "required": ["id", "name", "artist"]
+}
+
+SEARCH_OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "query": {"type": "string"},
+        "songs": {"type": "array", "items": SONG_SCHEMA}
+    },
+    "required": ["query", "songs"]
+}
+
+PLAYLIST_OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "songs": {"type": "array", "items": SONG_SCHEMA},
+        "current": {"type": ["string", "integer", "null"]}
+    },
+    "required": ["songs"]
+}
+
+
+class ToolResult:
+    """工具或资源的结果：朗读文本 + 可选的结构化数据"""
+
+    __slots__ = ("text", "data")
+
+    def __init__(self, text: str, data: Optional[Dict[str, Any]] = None):
+        self.text = text
+        self.data = data
+
+
+def call_result(result: Any) -> Dict[str, Any]:
+    """构造 tools/call 的 result；处理函数也可以直接返回字符串"""
+    if not isinstance(result, ToolResult):
+        return {"content": [{"type": "text", "text": result}]}
+    body = {"content": [{"type": "text", "text": result.text}]}
+    if STRUCTURED_CONTENT and result.data is not None:
+        body["structuredContent"] = result.data
+    return body
+
+
+def resource_contents(uri: str, result: Any) -> List[Dict[str, Any]]:
+    """构造 resources/read 的 contents"""
+    if not isinstance(result, ToolResult):
+        return [{"uri": uri, "mimeType": "text/plain", "text": result}]
+    contents = [{"uri": uri, "mimeType": "text/plain", "text": result.text}]
+    if STRUCTURED_CONTENT and result.data is not None:
+        contents.append({"uri": uri, "mimeType": "application/json",
+                         "text": dumps(result.data).decode("utf-8")})
+    return contents
+
+
+def render_search(query: str, songs: List[Dict[str, Any]]) -> ToolResult:
+    """搜索结果"""
+    if not songs:
+        return ToolResult(SEARCH_EMPTY.format(query), {"query": query, "songs": []})
+    text = "".join([SEARCH_HEADER.format(query), *(
+        SEARCH_ITEM.format(i, song["name"], song["artist"], song["album"], song["duration"], song["id"])
+        for i, song in enumerate(songs, 1)
+    )])
+    return ToolResult(text, {"query": query, "songs": songs})
+
+
+def render_playlist(songs: Iterable[Dict[str, Any]], current: Optional[Dict[str, Any]] = None) -> ToolResult:
+    """播放列表"""
+    songs = list(songs)
+    if not songs:
+        return ToolResult("播放列表为空", {"songs": [], "current": None})
+    text = "".join([PLAYLIST_HEADER, *(
+        PLAYLIST_ITEM.format(i, song["name"], song["artist"]) for i, song in enumerate(songs, 1)
+    )])
+    return ToolResult(text, {"songs": songs, "current": current["id"] if current else None})
+
+
+def render_now_playing(song: Optional[Dict[str, Any]], is_playing: bool, volume: int) -> ToolResult:
+    """当前播放状态"""
+    if not song:
+        return ToolResult("当前没有播放歌曲", {"song": None, "isPlaying": False, "volume": volume})
+    status = "播放中" if is_playing else "已暂停"
+    return ToolResult(NOW_PLAYING.format(song["name"], song["artist"], status, volume),
+                      {"song": song, "isPlaying": is_playing, "volume": volume})
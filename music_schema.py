@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工具参数校验
+注册工具时把 inputSchema 编译成校验函数，调用前检查必填字段、类型、取值范围并补全默认值；
+只支持工具定义中用到的 JSON Schema 子集
+"""
+
+from typing import Any, Callable, Dict, List
+
+# 校验函数：返回补全默认值后的参数，不合法时抛出 SchemaError
+Validator = Callable[[Any], Any]
+
+
+class SchemaError(ValueError):
+    """参数不符合 inputSchema"""
+
+
+_TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "string": lambda value: isinstance(value, str),
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "boolean": lambda value: isinstance(value, bool),
+    "array": lambda value: isinstance(value, list),
+    "object": lambda value: isinstance(value, dict),
+    "null": lambda value: value is None,
+}
+
+
+def _compile(schema: Dict[str, Any], path: str) -> Validator:
+    checks: List[Validator] = []
+
+    types = schema.get("type")
+    if types is not None:
+        if isinstance(types, str):
+            types = [types]
+        type_checks = [_TYPE_CHECKS[name] for name in types]
+        expected = " | ".join(types)
+
+        def check_type(value):
+            if not any(check(value) for check in type_checks):
+                raise SchemaError(f"参数 {path} 应为 {expected}")
+            return value
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = list(schema["enum"])
+        choices = ", ".join(str(item) for item in allowed)
+
+        def check_enum(value):
+            if value not in allowed:
+                raise SchemaError(f"参数 {path} 必须是以下之一: {choices}")
+            return value
+        checks.append(check_enum)
+
+    if "minimum" in schema:
+        minimum = schema["minimum"]
+
+        def check_minimum(value):
+            if value < minimum:
+                raise SchemaError(f"参数 {path} 不能小于 {minimum}")
+            return value
+        checks.append(check_minimum)
+
+    if "maximum" in schema:
+        maximum = schema["maximum"]
+
+        def check_maximum(value):
+            if value > maximum:
+                raise SchemaError(f"参数 {path} 不能大于 {maximum}")
+            return value
+        checks.append(check_maximum)
+
+    if "minLength" in schema:
+        min_length = schema["minLength"]
+
+        def check_min_length(value):
+            if len(value) < min_length:
+                raise SchemaError(f"参数 {path} 长度不能小于 {min_length}")
+            return value
+        checks.append(check_min_length)
+
+    if "maxLength" in schema:
+        max_length = schema["maxLength"]
+
+        def check_max_length(value):
+            if len(value) > max_length:
+                raise SchemaError(f"参数 {path} 长度不能大于 {max_length}")
+            return value
+        checks.append(check_max_length)
+
+    if "items" in schema:
+        check_item = _compile(schema["items"], f"{path}[]")
+        checks.append(lambda value: [check_item(item) for item in value])
+
+    if "properties" in schema or "required" in schema:
+        checks.append(_compile_object(schema, path))
+
+    def validate(value):
+        for check in checks:
+            value = check(value)
+        return value
+    return validate
+
+
+def _compile_object(schema: Dict[str, Any], path: str) -> Validator:
+    properties = schema.get("properties") or {}
+    required = tuple(schema.get("required") or ())
+    defaults = {name: prop["default"] for name, prop in properties.items() if "default" in prop}
+    prefix = f"{path}." if path else ""
+    fields = [(name, _compile(prop, prefix + name)) for name, prop in properties.items()]
+
+    def validate(value):
+        for name in required:
+            if name not in value:
+                raise SchemaError(f"缺少必填参数: {prefix}{name}")
+        if defaults:
+            value = {**defaults, **value}
+        for name, check in fields:
+            if name in value:
+                value[name] = check(value[name])
+        return value
+    return validate
+
+
+def compile_schema(schema: Dict[str, Any]) -> Validator:
+    """编译工具的 inputSchema；省略或为 null 的 arguments 按空对象处理"""
+    check = _compile(dict(schema, type="object"), "")
+
+    def validate(arguments):
+        if arguments is None:
+            arguments = {}
+        if not isinstance(arguments, dict):
+            raise SchemaError("参数 arguments 应为 object")
+        return check(arguments)
+    return validate
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+设备会话管理
+按设备/连接隔离播放状态，支持空闲淘汰与会话数量上限；
+配置了会话存储时，本地会话作为热缓存，变化定期批量写回存储
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from music_codec import dumps, loads
+from music_playlist import Playlist
+from music_session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+# 当前请求所属的会话键，由传输层在连接开始时绑定
+_current_session_key: ContextVar[Optional[str]] = ContextVar("current_session_key", default=None)
+
+DEFAULT_SESSION_KEY = "default"
+
+
+class PlaybackSession:
+    """单个设备的播放状态"""
+
+    __slots__ = ("session_id", "is_playing", "current_song", "volume", "position",
+                 "playlist", "prefetched", "last_active")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.is_playing = False
+        self.current_song: Optional[Dict[str, Any]] = None
+        self.volume = 50
+        self.position = 0
+        self.playlist = Playlist()
+        # 已预取的下一首歌曲ID
+        self.prefetched: Optional[str] = None
+        self.last_active = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "is_playing": self.is_playing,
+            "current_song": self.current_song,
+            "volume": self.volume,
+            "position": self.position,
+            "playlist": self.playlist.snapshot()
+        }
+
+    @classmethod
+    def from_dict(cls, session_id: str, data: Dict[str, Any]) -> "PlaybackSession":
+        session = cls(session_id)
+        session.is_playing = data.get("is_playing", False)
+        session.current_song = data.get("current_song")
+        session.volume = data.get("volume", 50)
+        session.position = data.get("position", 0)
+        session.playlist = Playlist.restore(data.get("playlist") or {})
+        return session
+
+
+class SessionManager:
+    """会话管理器
+
+    会话按最近使用顺序保存在 OrderedDict 中：超过 max_sessions 时淘汰最久未使用的会话，
+    空闲超过 idle_timeout 秒的会话由 evict_idle 定期清理。
+
+    设置 store 后：连接建立时通过 load 从存储刷新会话；run_flush 定期把上次写回后被访问过
+    且内容有变化的会话批量写入存储，读写播放状态本身不产生网络往返。
+    """
+
+    def __init__(self, max_sessions: int = 10000, idle_timeout: float = 3600,
+                 max_playlist_length: int = 500, store: Optional[SessionStore] = None):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_playlist_length = max_playlist_length
+        self.store = store
+        self._sessions: "OrderedDict[str, PlaybackSession]" = OrderedDict()
+        # 每个会话最近一次写回存储的内容，用于判断是否有未写回的修改
+        self._saved: Dict[str, bytes] = {}
+        # 被淘汰但尚未写回的会话
+        self._unsaved: Dict[str, bytes] = {}
+        self._last_flush = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._sessions
+
+    def __iter__(self):
+        """遍历会话，不更新最近使用顺序"""
+        return iter(self._sessions.values())
+
+    def get(self, key: str) -> PlaybackSession:
+        """获取会话，不存在时创建"""
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = PlaybackSession(key)
+            while len(self._sessions) > self.max_sessions:
+                evicted, evicted_session = self._sessions.popitem(last=False)
+                self._forget(evicted, evicted_session)
+                logger.info("会话数达到上限，淘汰会话: %s", evicted)
+        else:
+            self._sessions.move_to_end(key)
+        session.last_active = time.monotonic()
+        return session
+
+    def touch(self, session: PlaybackSession):
+        """标记会话被修改，下次写回时检查；用于不经过 get 修改状态的场景"""
+        session.last_active = time.monotonic()
+
+    def remove(self, key: str):
+        """删除会话"""
+        self._sessions.pop(key, None)
+        self._saved.pop(key, None)
+        self._unsaved.pop(key, None)
+
+    def _forget(self, key: str, session: PlaybackSession):
+        """会话从本地移除时保留未写回的修改"""
+        saved = self._saved.pop(key, None)
+        if self.store is not None:
+            data = dumps(session.to_dict())
+            if data != saved:
+                self._unsaved[key] = data
+
+    async def load(self, key: str) -> Optional[PlaybackSession]:
+        """从存储刷新会话；本地有未写回的修改时保留本地状态"""
+        local = self._sessions.get(key)
+        if self.store is None:
+            return local
+        if local is not None and dumps(local.to_dict()) != self._saved.get(key):
+            return local
+        try:
+            data = await self.store.load(key)
+        except Exception as e:
+            logger.warning("加载会话失败 %s: %s", key, e)
+            return local
+        if data is None:
+            return local
+        session = PlaybackSession.from_dict(key, loads(data))
+        if local is not None:
+            # 保持对象不变，已持有引用的连接继续可用
+            for name in ("is_playing", "current_song", "volume", "position", "playlist"):
+                setattr(local, name, getattr(session, name))
+            session = local
+        else:
+            self._sessions[key] = session
+        self._saved[key] = data
+        return self.get(key)
+
+    async def flush(self):
+        """把有变化的会话批量写入存储"""
+        if self.store is None:
+            return
+        since, self._last_flush = self._last_flush, time.monotonic()
+        items, self._unsaved = self._unsaved, {}
+        for key, session in self._sessions.items():
+            if session.last_active >= since:
+                data = dumps(session.to_dict())
+                if data != self._saved.get(key):
+                    items[key] = data
+        if not items:
+            return
+        try:
+            await self.store.save_many(items, int(self.idle_timeout))
+        except Exception as e:
+            logger.warning("写回 %d 个会话失败，稍后重试: %s", len(items), e)
+            # 下一轮重新检查这些会话
+            self._last_flush = since
+            for key, data in items.items():
+                if key not in self._sessions:
+                    self._unsaved.setdefault(key, data)
+            return
+        for key, data in items.items():
+            if key in self._sessions:
+                self._saved[key] = data
+
+    async def run_flush(self, interval: float = 1):
+        """定期写回"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def bind(self, key: str):
+        """将当前上下文(连接)绑定到会话，之后创建的任务都会继承该绑定"""
+        return _current_session_key.set(key)
+
+    def current(self) -> PlaybackSession:
+        """获取当前上下文绑定的会话"""
+        return self.get(_current_session_key.get() or DEFAULT_SESSION_KEY)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """淘汰空闲会话，返回淘汰数量"""
+        deadline = (now if now is not None else time.monotonic()) - self.idle_timeout
+        evicted = 0
+        # 按最近使用顺序排列，遇到第一个未过期的会话即可停止
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if session.last_active > deadline:
+                break
+            del self._sessions[key]
+            self._forget(key, session)
+            evicted += 1
+        return evicted
+
+    async def run_eviction(self, interval: float = 60):
+        """定期淘汰空闲会话"""
+        while True:
+            await asyncio.sleep(interval)
+            evicted = self.evict_idle()
+            if evicted:
+                logger.info("已淘汰 %d 个空闲会话，剩余 %d 个", evicted, len(self._sessions))
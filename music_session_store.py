@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+会话存储
+SessionManager 在本地保存热会话，定期把有变化的会话批量写入外部存储(write-behind)；
+设备重连到其他进程或节点时从存储加载，不需要粘性路由。
+提供进程内存储与 Redis 协议(RESP)存储两种实现
+"""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore(ABC):
+    """会话存储接口，值为序列化后的 bytes"""
+
+    @abstractmethod
+    async def load(self, key: str) -> Optional[bytes]:
+        """读取会话，不存在或已过期时返回None"""
+
+    @abstractmethod
+    async def save_many(self, items: Dict[str, bytes], ttl: int):
+        """批量写入，ttl 秒后过期"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """删除会话"""
+
+    async def aclose(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """进程内存储，用于单进程部署与测试"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, bytes]] = {}
+
+    async def load(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires <= asyncio.get_running_loop().time():
+            del self._data[key]
+            return None
+        return value
+
+    async def save_many(self, items: Dict[str, bytes], ttl: int):
+        expires = asyncio.get_running_loop().time() + ttl
+        for key, value in items.items():
+            self._data[key] = (expires, value)
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+
+class RedisError(Exception):
+    """Redis 返回的错误"""
+
+
+class RedisSessionStore(SessionStore):
+    """Redis 存储
+
+    使用单个连接与最小的 RESP 实现(GET/SET EX/DEL)，批量写入时流水线发送；
+    连接断开时下一次请求自动重连一次。
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "music:session:",
+                 timeout: float = 2.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            elif isinstance(arg, int):
+                arg = str(arg).encode("ascii")
+            parts.append(b"$%d\r\n%b\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis 连接已关闭")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return RedisError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            return None if count < 0 else [await self._read_reply() for _ in range(count)]
+        raise RedisError(f"无法解析的响应: {line!r}")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        for reply in await self._send(setup):
+            if isinstance(reply, RedisError):
+                raise reply
+
+    async def _send(self, commands: List[tuple]) -> list:
+        self._writer.write(b"".join(self._encode(*command) for command in commands))
+        await self._writer.drain()
+        return [await self._read_reply() for _ in commands]
+
+    async def execute(self, *commands: tuple) -> list:
+        """流水线执行多条命令，返回各自的结果"""
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await asyncio.wait_for(self._connect(), self.timeout)
+                    return await asyncio.wait_for(self._send(list(commands)), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, OSError):
+                    await self._disconnect()
+                    if attempt:
+                        raise
+
+    async def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = self._reader = None
+
+    async def load(self, key: str) -> Optional[bytes]:
+        reply, = await self.execute(("GET", self.prefix + key))
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    async def save_many(self, items: Dict[str, bytes], ttl: int):
+        if not items:
+            return
+        replies = await self.execute(*(("SET", self.prefix + key, value, "EX", ttl)
+                                       for key, value in items.items()))
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+
+    async def delete(self, key: str):
+        await self.execute(("DEL", self.prefix + key))
+
+    async def aclose(self):
+        async with self._lock:
+            await self._disconnect()
+
+
+def create_session_store(url: Optional[str]) -> Optional[SessionStore]:
+    """按 SESSION_STORE 配置创建存储：memory 或 redis://[:password@]host:port/db，未配置时不使用"""
+    if not url:
+        return None
+    if url == "memory":
+        return MemorySessionStore()
+    if url.startswith("redis://"):
+        return RedisSessionStore(url)
+    raise ValueError(f"未知的会话存储: {url}")
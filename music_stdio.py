@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+stdio 传输
+把标准输入/输出接入事件循环，按行读取JSON-RPC消息、批量写出响应，不经过线程池；
+标准输入输出被重定向到普通文件时(事件循环不支持)退回阻塞读写
+"""
+
+import asyncio
+import sys
+from typing import Tuple, Union
+
+# 单行消息的长度上限，超过时整行丢弃
+DEFAULT_LINE_LIMIT = 16 * 1024 * 1024
+
+# 退回阻塞读取时的读取任务，保持引用
+_feeders = set()
+
+
+class _BlockingWriter:
+    """普通文件上的写入端，接口与 StreamWriter 的写入部分一致"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, data: bytes):
+        self._stream.write(data)
+
+    async def drain(self):
+        self._stream.flush()
+
+    def close(self):
+        self._stream.flush()
+
+
+async def _feed_blocking(reader: asyncio.StreamReader, stream):
+    """在线程池中读取普通文件，写入 reader"""
+    loop = asyncio.get_running_loop()
+    while True:
+        data = await loop.run_in_executor(None, stream.read1, 64 * 1024)
+        if not data:
+            reader.feed_eof()
+            return
+        reader.feed_data(data)
+
+
+async def read_line(reader: asyncio.StreamReader) -> bytes:
+    """读取一行消息，输入结束时返回剩余内容(可能为空)
+
+    超过 reader 长度上限的行一直读到换行符为止整行丢弃，然后抛出一次 ValueError，
+    剩余部分不会被当作下一条消息
+    """
+    try:
+        return await reader.readuntil(b'\n')
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError as e:
+        consumed = e.consumed
+    while True:
+        try:
+            await reader.readexactly(consumed)
+            await reader.readuntil(b'\n')
+            break
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+        except asyncio.IncompleteReadError:
+            break
+    raise ValueError('Message too large')
+
+
+async def open_stdio(limit: int = DEFAULT_LINE_LIMIT
+                     ) -> Tuple[asyncio.StreamReader, Union[asyncio.StreamWriter, _BlockingWriter]]:
+    """返回标准输入的 StreamReader 与标准输出的写入端"""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=limit)
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+    except ValueError:
+        feeder = asyncio.ensure_future(_feed_blocking(reader, sys.stdin.buffer))
+        _feeders.add(feeder)
+        feeder.add_done_callback(_feeders.discard)
+
+    try:
+        transport, protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, sys.stdout.buffer)
+    except ValueError:
+        return reader, _BlockingWriter(sys.stdout.buffer)
+    return reader, asyncio.StreamWriter(transport, protocol, None, loop)
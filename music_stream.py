@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+音频流代理
+在同一事件循环中提供 HTTP 端点 GET /stream/<song_id>，把上游MP3按固定大小分块转发给音响：
+每块写出后等待 drain，发送缓冲只保留少量分块，音响读得慢时上游读取也随之暂停；
+支持 Range 请求，没有 Range 时按会话的播放位置(秒)换算成字节偏移续播；
+配置了分块缓存时从磁盘缓存经 sendfile 发送，上游每个分块只拉取一次
+"""
+
+import asyncio
+import logging
+import math
+import re
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import httpx
+
+from music_chunk_cache import ChunkCache, RangeNotSupported
+from music_metrics import UPSTREAM_LATENCY
+from music_session import SessionManager
+
+logger = logging.getLogger(__name__)
+
+# 透传给音响的上游响应头
+FORWARDED_HEADERS = ("content-type", "content-length", "content-range", "content-encoding",
+                     "accept-ranges", "last-modified", "etag")
+
+# 透传的上游状态码，其余视为上游错误
+FORWARDED_STATUSES = {200: "OK", 206: "Partial Content", 416: "Range Not Satisfiable"}
+
+# 读取请求头的超时(秒)
+HEADER_TIMEOUT = 10
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-")
+_RANGE = re.compile(r"bytes=(\d+)-(\d*)$")
+
+
+def parse_range(range_header: str) -> Optional[Tuple[int, Optional[int]]]:
+    """解析单段 Range 请求头 bytes=start-[end]，返回 (start, end)；后缀、多段等其他形式返回 None"""
+    match = _RANGE.match(range_header.strip())
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2)) if match.group(2) else None
+
+
+def _close_result(future: asyncio.Future):
+    """预取被取消时关闭已经打开的分块文件"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class StreamServer:
+    """音频流代理服务器
+
+    resolve_url 根据歌曲ID返回上游播放地址，找不到时返回None；
+    传入 sessions 时，按 ?device_id= 找到会话，用 position 续播并在传输过程中更新 position；
+    传入 cache 时 GET 请求经分块缓存发送，上游不支持 Range 时退回直接转发。
+    """
+
+    def __init__(self, resolve_url: Callable[[str], Awaitable[Optional[str]]],
+                 sessions: Optional[SessionManager] = None, chunk_size: int = 64 * 1024,
+                 bitrate: int = 128000, max_streams: int = 256, cache: Optional[ChunkCache] = None):
+        self.resolve_url = resolve_url
+        self.sessions = sessions
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.bitrate = bitrate
+        self.max_streams = max_streams
+        self.active = 0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """上游连接池，首次使用时创建"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(10, read=30),
+                limits=httpx.Limits(max_connections=self.max_streams),
+                follow_redirects=True,
+                headers={"User-Agent": "music-mcp-server/1.0"}
+            )
+        return self._client
+
+    async def start(self, host: str, port: int, reuse_port: bool = False):
+        self._server = await asyncio.start_server(self.handle, host, port, reuse_port=reuse_port)
+
+    async def aclose(self):
+        """停止监听并断开进行中的传输，音响可按 Range 重新请求续播"""
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def position_to_range(self, position: float) -> Optional[str]:
+        """把播放位置(秒)按码率换算为 Range 请求头"""
+        if position <= 0:
+            return None
+        return f"bytes={int(position * self.bitrate / 8)}-"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个HTTP请求，响应后关闭连接"""
+        self._writers.add(writer)
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers: Dict[str, str] = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            if method not in ("GET", "HEAD"):
+                return await self._reply(writer, 405, "Method Not Allowed")
+            url = urlsplit(target)
+            if not url.path.startswith("/stream/"):
+                return await self._reply(writer, 404, "Not Found")
+            if self.active >= self.max_streams:
+                return await self._reply(writer, 503, "Service Unavailable")
+
+            song_id = unquote(url.path[len("/stream/"):])
+            upstream_url = await self.resolve_url(song_id)
+            if not upstream_url:
+                return await self._reply(writer, 404, "Not Found")
+
+            query = parse_qs(url.query)
+            session = None
+            device_id = query.get("device_id", [None])[0]
+            if self.sessions is not None and device_id:
+                # 配置了会话存储时，设备的会话可能在其他进程中创建
+                session = await self.sessions.load(device_id)
+                current = session.current_song if session is not None else None
+                if not current or str(current.get("id")) != song_id:
+                    session = None
+
+            range_header = headers.get("range")
+            if range_header is None:
+                if "position" in query:
+                    position = float(query["position"][0])
+                    if not math.isfinite(position) or position < 0:
+                        raise ValueError(f"无效的播放位置: {position}")
+                    range_header = self.position_to_range(position)
+                elif session is not None:
+                    range_header = self.position_to_range(session.position)
+
+            byte_range = parse_range(range_header) if range_header else None
+            if byte_range is not None and byte_range[1] is not None and byte_range[1] < byte_range[0]:
+                # 结束位置在起始位置之前
+                info = await self.cache.track(song_id) if self.cache is not None else None
+                return await self._reply(writer, 416, "Range Not Satisfiable",
+                                         f"Content-Range: bytes */{info.length}\r\n" if info else "")
+
+            self.active += 1
+            try:
+                if self.cache is not None and method == "GET":
+                    try:
+                        return await self._serve_cached(song_id, upstream_url, range_header, writer, session)
+                    except RangeNotSupported:
+                        pass
+                await self._relay(method, upstream_url, range_header, writer, session)
+            finally:
+                self.active -= 1
+        except (ValueError, OverflowError, asyncio.TimeoutError):
+            await self._reply(writer, 400, "Bad Request")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except httpx.HTTPError as e:
+            logger.warning("上游音频请求失败: %s", e)
+            await self._reply(writer, 502, "Bad Gateway")
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _reply(self, writer: asyncio.StreamWriter, status: int, reason: str, extra: str = ""):
+        if writer.is_closing():
+            return
+        writer.write(f"HTTP/1.1 {status} {reason}\r\n{extra}Content-Length: 0\r\nConnection: close\r\n\r\n"
+                     .encode("latin-1"))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _relay(self, method: str, url: str, range_header: Optional[str],
+                     writer: asyncio.StreamWriter, session=None):
+        request_headers = {"Range": range_header} if range_header else {}
+        started = time.perf_counter()
+        async with self.client.stream("GET", url, headers=request_headers) as upstream:
+            reason = FORWARDED_STATUSES.get(upstream.status_code)
+            # 上游响应头到达的时间
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, "stream", "ok" if reason else "error")
+            if reason is None:
+                logger.warning("上游音频返回 %s: %s", upstream.status_code, url)
+                return await self._reply(writer, 502, "Bad Gateway")
+
+            head = [f"HTTP/1.1 {upstream.status_code} {reason}"]
+            for name in FORWARDED_HEADERS:
+                value = upstream.headers.get(name)
+                if value is not None:
+                    head.append(f"{name}: {value}")
+            head.append("Connection: close")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+            await writer.drain()
+            if method == "HEAD" or upstream.status_code == 416:
+                return
+
+            match = _CONTENT_RANGE.match(upstream.headers.get("content-range", ""))
+            offset = int(match.group(1)) if match else 0
+            # 发送缓冲超过两个分块时 drain 阻塞，上游读取随之暂停
+            writer.transport.set_write_buffer_limits(high=self.chunk_size * 2)
+            try:
+                async for chunk in upstream.aiter_raw(self.chunk_size):
+                    writer.write(chunk)
+                    await writer.drain()
+                    offset += len(chunk)
+                    if session is not None:
+                        session.position = offset * 8 // self.bitrate
+                        self.sessions.touch(session)
+            except httpx.HTTPError as e:
+                # 响应头已发出，只能断开连接，由音响按 Range 重新请求
+                logger.warning("上游音频中断: %s", e)
+
+    async def _serve_cached(self, song_id: str, url: str, range_header: Optional[str],
+                            writer: asyncio.StreamWriter, session=None):
+        """从分块缓存发送，发送当前分块时预取下一个分块"""
+        start, end = 0, None
+        if range_header:
+            byte_range = parse_range(range_header)
+            if byte_range is None:
+                # 后缀、多段等形式的 Range 直接转发给上游处理
+                raise RangeNotSupported(range_header)
+            start, end = byte_range
+
+        info = await self.cache.track(song_id)
+        if info is not None and start >= info.length:
+            return await self._reply(writer, 416, "Range Not Satisfiable",
+                                     f"Content-Range: bytes */{info.length}\r\n")
+
+        chunk_size = self.cache.chunk_size
+        index = start // chunk_size
+        try:
+            f = await self.cache.open_chunk(self.client, song_id, url, index)
+        except IndexError:
+            f = None
+        except FileNotFoundError as e:
+            # 刚下载的分块又被淘汰，响应头尚未发出
+            logger.warning("音频分块已被淘汰: %s", e)
+            return await self._reply(writer, 503, "Service Unavailable")
+        info = await self.cache.track(song_id)
+        if info is None:
+            if f is not None:
+                f.close()
+            raise RangeNotSupported(url)
+        if f is None or start >= info.length:
+            if f is not None:
+                f.close()
+            return await self._reply(writer, 416, "Range Not Satisfiable",
+                                     f"Content-Range: bytes */{info.length}\r\n")
+        end = info.length - 1 if end is None else min(end, info.length - 1)
+
+        head = ["HTTP/1.1 206 Partial Content" if range_header else "HTTP/1.1 200 OK",
+                f"Content-Type: {info.content_type}",
+                f"Content-Length: {end - start + 1}",
+                "Accept-Ranges: bytes"]
+        if range_header:
+            head.append(f"Content-Range: bytes {start}-{end}/{info.length}")
+        head.append("Connection: close")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+        loop = asyncio.get_running_loop()
+        offset = start
+        prefetch: Optional[asyncio.Future] = None
+        try:
+            while True:
+                chunk_start = index * chunk_size
+                chunk_end = min(chunk_start + chunk_size, end + 1)
+                if chunk_end <= end:
+                    prefetch = asyncio.ensure_future(self.cache.open_chunk(self.client, song_id, url, index + 1))
+                with f:
+                    # 普通TCP连接上由 os.sendfile 完成，数据不经过用户态
+                    await loop.sendfile(writer.transport, f, offset - chunk_start, chunk_end - offset)
+                f = None
+                offset = chunk_end
+                if session is not None:
+                    session.position = offset * 8 // self.bitrate
+                    self.sessions.touch(session)
+                if prefetch is None:
+                    break
+                f = await prefetch
+                prefetch = None
+                index += 1
+        except (httpx.HTTPError, RangeNotSupported, IndexError, FileNotFoundError) as e:
+            # 响应头已发出，只能断开连接，由音响按 Range 重新请求
+            logger.warning("上游音频中断: %s", e)
+        finally:
+            if f is not None:
+                f.close()
+            if prefetch is not None:
+                prefetch.cancel()
+                prefetch.add_done_callback(_close_result)
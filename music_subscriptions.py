@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+资源订阅
+客户端通过 resources/subscribe 订阅会话的资源，播放状态变化时推送 notifications/resources/updated；
+连续的变化(如拖动音量)合并后延迟发送，内容与上次推送相同时不发送
+"""
+
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceSubscriptions:
+    """资源订阅管理
+
+    订阅按 (会话ID, 资源URI) 登记连接，连接需提供 send(message)。
+    changed() 标记会话的资源可能已变化：距最后一次变化 debounce 秒后推送，
+    持续变化时最迟 max_delay 秒推送一次。推送前用 fingerprint(会话ID, URI) 计算内容指纹，
+    与上次推送相同则跳过。
+    """
+
+    def __init__(self, fingerprint: Callable[[str, str], Any], debounce: float = 0.2,
+                 max_delay: float = 1.0):
+        self.fingerprint = fingerprint
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.sent = 0
+        self._subscribers: Dict[Tuple[str, str], Set[Any]] = {}
+        # 会话ID -> 被订阅的资源URI
+        self._uris: Dict[str, Set[str]] = {}
+        # 连接 -> 其订阅的资源，断开时按此清理
+        self._by_connection: Dict[Any, Set[Tuple[str, str]]] = {}
+        self._fingerprints: Dict[Tuple[str, str], Any] = {}
+        # 等待推送的资源: (首次变化时间, 定时器)
+        self._pending: Dict[Tuple[str, str], Tuple[float, asyncio.TimerHandle]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(connections) for connections in self._subscribers.values())
+
+    def subscribe(self, connection: Any, session_id: str, uri: str):
+        key = (session_id, uri)
+        connections = self._subscribers.setdefault(key, set())
+        if not connections:
+            # 以订阅时的内容为基准，之后只推送真正的变化
+            self._fingerprints[key] = self.fingerprint(session_id, uri)
+            self._uris.setdefault(session_id, set()).add(uri)
+        connections.add(connection)
+        self._by_connection.setdefault(connection, set()).add(key)
+
+    def unsubscribe(self, connection: Any, session_id: str, uri: str):
+        key = (session_id, uri)
+        connections = self._subscribers.get(key)
+        if connections is None:
+            return
+        connections.discard(connection)
+        if not connections:
+            self._drop(key)
+        keys = self._by_connection.get(connection)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_connection[connection]
+
+    def discard(self, connection: Any):
+        """连接断开时移除其全部订阅"""
+        for key in self._by_connection.pop(connection, ()):
+            connections = self._subscribers.get(key)
+            if connections is not None:
+                connections.discard(connection)
+                if not connections:
+                    self._drop(key)
+
+    def _drop(self, key: Tuple[str, str]):
+        session_id, uri = key
+        uris = self._uris.get(session_id)
+        if uris is not None:
+            uris.discard(uri)
+            if not uris:
+                del self._uris[session_id]
+        self._subscribers.pop(key, None)
+        self._fingerprints.pop(key, None)
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            pending[1].cancel()
+
+    def changed(self, session_id: str):
+        """会话的播放状态可能已变化，安排推送其被订阅的资源"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        for uri in self._uris.get(session_id, ()):
+            key = (session_id, uri)
+            first, timer = self._pending.get(key, (now, None))
+            if timer is not None:
+                timer.cancel()
+            delay = min(self.debounce, first + self.max_delay - now)
+            self._pending[key] = (first, loop.call_later(max(0.0, delay), self._notify, key))
+
+    def _notify(self, key: Tuple[str, str]):
+        self._pending.pop(key, None)
+        connections = self._subscribers.get(key)
+        if not connections:
+            return
+        session_id, uri = key
+        try:
+            fingerprint = self.fingerprint(session_id, uri)
+        except Exception as e:
+            logger.warning("计算资源内容失败 %s: %s", uri, e)
+            return
+        if fingerprint == self._fingerprints.get(key):
+            return
+        self._fingerprints[key] = fingerprint
+        notification = {
+            "jsonrpc": "2.0",
+            "method": "notifications/resources/updated",
+            "params": {"uri": uri}
+        }
+        for connection in connections:
+            connection.send(notification)
+        self.sent += len(connections)
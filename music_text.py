@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文本归一化工具
+供音乐目录索引、搜索缓存等模块共用
+"""
+
+import unicodedata
+from functools import lru_cache
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # 未安装 pypinyin 时关闭拼音匹配
+    lazy_pinyin = None
+
+# 常用繁体字到简体字的映射，覆盖歌名、歌手名中的高频字
+_TRADITIONAL_SIMPLIFIED_PAIRS = (
+    "愛爱 罷罢 備备 貝贝 筆笔 畢毕 邊边 變变 賓宾 標标 別别 並并 補补 財财 參参 蠶蚕 "
+    "燦灿 層层 產产 長长 場场 嘗尝 車车 陳陈 塵尘 稱称 誠诚 遲迟 齒齿 蟲虫 醜丑 處处 "
+    "傳传 創创 純纯 詞词 從从 叢丛 達达 帶带 單单 當当 黨党 島岛 導导 燈灯 鄧邓 敵敌 "
+    "遞递 點点 電电 東东 動动 凍冻 鬥斗 獨独 讀读 對对 噸吨 奪夺 兒儿 爾尔 發发 飛飞 "
+    "費费 豐丰 風风 鳳凤 婦妇 復复 個个 給给 鞏巩 溝沟 構构 夠够 顧顾 關关 觀观 廣广 "
+    "歸归 貴贵 國国 過过 還还 漢汉 號号 紅红 後后 壺壶 護护 華华 畫画 話话 歡欢 環环 "
+    "換换 黃黄 揮挥 輝辉 會会 夥伙 貨货 獲获 機机 積积 極极 際际 幾几 記记 紀纪 價价 "
+    "間间 見见 監监 劍剑 將将 講讲 獎奖 驕骄 腳脚 覺觉 節节 潔洁 結结 緊紧 盡尽 進进 "
+    "淨净 經经 驚惊 靜静 鏡镜 舊旧 舉举 據据 軍军 開开 課课 寬宽 虧亏 擴扩 來来 藍蓝 "
+    "蘭兰 攔拦 勞劳 樂乐 淚泪 類类 離离 裡里 裏里 禮礼 麗丽 歷历 曆历 憐怜 聯联 戀恋 "
+    "煉炼 練练 糧粮 兩两 輛辆 療疗 遼辽 鄰邻 靈灵 齡龄 領领 劉刘 龍龙 樓楼 錄录 陸陆 "
+    "亂乱 倫伦 輪轮 論论 羅罗 邏逻 馬马 嗎吗 買买 賣卖 滿满 貓猫 門门 們们 夢梦 彌弥 "
+    "謎谜 綿绵 麵面 廟庙 滅灭 鳴鸣 難难 腦脑 鬧闹 內内 擬拟 鳥鸟 寧宁 農农 濃浓 歐欧 "
+    "盤盘 噴喷 鵬鹏 飄飘 頻频 蘋苹 憑凭 撲扑 齊齐 騎骑 豈岂 氣气 棄弃 遷迁 錢钱 淺浅 "
+    "槍枪 牆墙 橋桥 親亲 輕轻 傾倾 請请 慶庆 窮穷 區区 驅驱 權权 勸劝 確确 讓让 熱热 "
+    "認认 榮荣 軟软 灑洒 賽赛 傘伞 喪丧 掃扫 殺杀 曬晒 傷伤 燒烧 紹绍 設设 攝摄 聲声 "
+    "勝胜 師师 詩诗 時时 實实 識识 勢势 視视 試试 適适 釋释 壽寿 書书 術术 樹树 數数 "
+    "雙双 誰谁 說说 絲丝 訴诉 雖虽 隨随 歲岁 孫孙 態态 談谈 歎叹 嘆叹 湯汤 濤涛 討讨 "
+    "騰腾 題题 體体 條条 鐵铁 聽听 廳厅 頭头 圖图 團团 萬万 灣湾 網网 偉伟 圍围 為为 "
+    "衛卫 溫温 聞闻 問问 穩稳 烏乌 無无 霧雾 務务 誤误 戲戏 係系 細细 蝦虾 嚇吓 鮮鲜 "
+    "閒闲 顯显 險险 現现 線线 鄉乡 響响 項项 蕭萧 曉晓 協协 寫写 謝谢 興兴 學学 尋寻 "
+    "訓训 壓压 鴨鸭 亞亚 煙烟 顏颜 嚴严 艷艳 陽阳 楊杨 樣样 養养 搖摇 葉叶 頁页 業业 "
+    "醫医 億亿 憶忆 藝艺 議议 異异 陰阴 銀银 隱隐 應应 營营 優优 憂忧 遊游 郵邮 魚鱼 "
+    "與与 語语 園园 圓圆 遠远 願愿 約约 躍跃 雲云 運运 雜杂 災灾 載载 讚赞 贊赞 臟脏 "
+    "髒脏 則则 責责 澤泽 這这 貞贞 針针 陣阵 鎮镇 爭争 徵征 證证 隻只 織织 職职 紙纸 "
+    "誌志 緻致 鐘钟 鍾钟 種种 眾众 週周 晝昼 豬猪 諸诸 燭烛 轉转 莊庄 裝装 壯壮 狀状 "
+    "準准 資资 總总 縱纵 鑽钻 蹤踪 麼么 淒凄 臺台 颱台 檯台 幹干 乾干 髮发 鬆松 餘余 "
+    "範范 鬱郁 傑杰 鄭郑 蔣蒋 張张 趙赵 許许 馮冯 韓韩 呂吕 蘇苏 盧卢 龔龚 閻阎 賈贾 "
+    "譚谭 萊莱 懷怀 綠绿 寶宝 滄沧 遙遥 聖圣 誕诞 調调 彈弹 鋼钢 隊队 麥麦 鵲鹊 劃划 "
+    "轟轰 爛烂 塊块 壞坏 錯错 驛驿 嶼屿 義义 沒没 幫帮 幣币 懶懒 瀟潇 瘋疯 閃闪 爍烁 "
+    "蓋盖 覽览 賞赏 喚唤 緣缘 續续 斷断 縷缕 鎖锁 終终 絕绝 紛纷 級级 納纳 絡络 維维 "
+    "編编 緒绪 聰聪 臉脸 膽胆 藥药 蘿萝 蔔卜 螢萤 蟬蝉 蠟蜡 觸触 計计 訂订 諾诺 謊谎 "
+    "貼贴 賀贺 質质 購购 賴赖 趕赶 輩辈 辦办 釣钓 鈴铃 錦锦 鍋锅 閉闭 闖闯 雞鸡 順顺 "
+    "預预 頌颂 顆颗 飯饭 飲饮 飽饱 餅饼 館馆 騙骗 驗验 魯鲁 鯨鲸 鴿鸽 鶴鹤 鷹鹰 龜龟 "
+    "殘残 嶺岭 廢废 彎弯 徑径 徹彻 戰战 擁拥 擇择 擊击 擔担 擺摆 擾扰 攜携 敗败 敘叙 "
+    "斬斩 於于 晉晋 暫暂 槓杠 樸朴 橫横 檔档 櫻樱 殼壳 決决 沖冲 況况 涼凉 減减 測测 "
+    "湧涌 滾滚 漁渔 漲涨 潛潜 潤润 澀涩 濕湿 濟济 濱滨 瀏浏 爐炉 牽牵 獅狮 獻献 瑪玛 "
+    "癡痴 盜盗 盞盏 睜睁 矯矫 碼码 礎础 祕秘 禍祸 稅税 窩窝 競竞 築筑 簡简 籃篮 籠笼 "
+    "糾纠 紐纽 組组 綁绑 緩缓 繞绕 繪绘 罰罚 習习 聳耸 肅肃 腸肠 膚肤 艦舰 蒼苍 蓮莲 "
+    "蕩荡 薦荐 虛虚 衝冲 襲袭 規规 覓觅 訊讯 託托 評评 詢询 該该 詳详 誇夸 誘诱 諒谅 "
+    "謀谋 謹谨 譯译 豎竖 負负 貢贡 貧贫 販贩 貪贪 賊贼 賜赐 賠赔 賢贤 贏赢 趨趋 跡迹 "
+    "踐践 蹟迹 軌轨 較较 輔辅 輸输 轄辖 辭辞 迴回 連连 違违 選选 遺遗 邁迈 釀酿 銅铜 "
+    "銷销 鋒锋 錶表 鏈链 鑰钥 閱阅 闊阔 韻韵 頂顶 須须 頑顽 頓顿 頸颈 額额 餓饿 駐驻 "
+    "駕驾"
+)
+
+_T2S_TABLE = str.maketrans({pair[0]: pair[1] for pair in _TRADITIONAL_SIMPLIFIED_PAIRS.split()})
+
+
+def fold_chinese(text: str) -> str:
+    """繁体字折叠为简体字"""
+    return text.translate(_T2S_TABLE)
+
+
+def normalize_text(text: str) -> str:
+    """归一化文本：全角转半角、统一大小写、繁简折叠、合并空白"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return " ".join(fold_chinese(text).split())
+
+
+def pinyin_available() -> bool:
+    """是否可以生成拼音"""
+    return lazy_pinyin is not None
+
+
+@lru_cache(maxsize=65536)
+def _char_pinyin(char: str, initials: bool) -> str:
+    """单字拼音；逐字缓存，建索引时避免对每个字段做整句分词"""
+    style = Style.FIRST_LETTER if initials else Style.NORMAL
+    return "".join(lazy_pinyin(char, style=style, errors="default"))
+
+
+def to_pinyin(text: str) -> str:
+    """生成不带声调的全拼，如 马頔 -> madi；未安装 pypinyin 时返回空串"""
+    if lazy_pinyin is None or not text:
+        return ""
+    return "".join(_char_pinyin(char, False) for char in text if not char.isspace())
+
+
+def to_initials(text: str) -> str:
+    """生成拼音首字母，如 青花瓷 -> qhc；未安装 pypinyin 时返回空串"""
+    if lazy_pinyin is None or not text:
+        return ""
+    return "".join(_char_pinyin(char, True) for char in text if not char.isspace())
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """计算受限编辑距离(含相邻交换)，超过 max_distance 时返回 max_distance + 1"""
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = current[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous2 is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return min(previous[-1], max_distance + 1)
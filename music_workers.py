@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程工作模式
+主进程派生 N 个工作进程，各自运行一个事件循环并通过 SO_REUSEPORT 共享监听端口，由内核分配连接；
+主进程转发退出信号、重启意外退出的进程，并汇总各进程定期上报的指标
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+REUSE_PORT_AVAILABLE = hasattr(socket, "SO_REUSEPORT")
+
+# 工作进程收到退出信号后等待连接关闭的时间(秒)，超时后强制结束
+SHUTDOWN_TIMEOUT = 15
+
+
+def aggregate(snapshots: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+    """按键累加各进程的计数指标，嵌套字典逐层累加"""
+    totals: Dict[str, Any] = {}
+    for snapshot in snapshots.values():
+        _accumulate(totals, snapshot)
+    return totals
+
+
+def _accumulate(totals: Dict[str, Any], snapshot: Dict[str, Any]):
+    for key, value in snapshot.items():
+        if isinstance(value, dict):
+            _accumulate(totals.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            totals[key] = totals.get(key, 0) + value
+
+
+class WorkerSupervisor:
+    """工作进程管理
+
+    target(worker_id, metrics_queue) 在子进程中运行，应定期向 metrics_queue 放入
+    (worker_id, 指标字典)，收到 SIGTERM 后优雅退出。
+    """
+
+    def __init__(self, target: Callable[[int, Any], None], workers: int,
+                 report_interval: float = 60):
+        self.target = target
+        self.workers = workers
+        self.report_interval = report_interval
+        self.snapshots: Dict[int, Dict[str, Any]] = {}
+        self._context = multiprocessing.get_context("fork")
+        self._queue = self._context.Queue()
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._stopping = False
+
+    def _start(self, worker_id: int):
+        process = self._context.Process(target=self._child, args=(worker_id,),
+                                        name=f"music-worker-{worker_id}", daemon=False)
+        process.start()
+        self._processes[worker_id] = process
+        logger.info("工作进程 %s 已启动 (pid %s)", worker_id, process.pid)
+
+    def _child(self, worker_id: int):
+        # 工作进程在事件循环中安装自己的 SIGUSR1 处理，此前忽略，避免沿用主进程的转发处理
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        self.target(worker_id, self._queue)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _forward(self, signum, frame):
+        """把 SIGUSR1(开始/结束剖析)转发给所有工作进程"""
+        for process in self._processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def totals(self) -> Dict[str, Any]:
+        """所有工作进程的指标汇总"""
+        # 复制一份，指标端点可能在其他线程中调用
+        totals = aggregate(dict(self.snapshots))
+        totals["workers"] = sum(1 for process in self._processes.values() if process.is_alive())
+        return totals
+
+    def run(self):
+        """启动工作进程并阻塞到收到退出信号"""
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self._forward)
+        for worker_id in range(self.workers):
+            self._start(worker_id)
+
+        next_report = time.monotonic() + self.report_interval
+        while not self._stopping:
+            self._drain_metrics(timeout=1)
+            for worker_id, process in list(self._processes.items()):
+                if not process.is_alive() and not self._stopping:
+                    logger.warning("工作进程 %s 意外退出 (exit %s)，重新启动", worker_id, process.exitcode)
+                    self.snapshots.pop(worker_id, None)
+                    self._start(worker_id)
+            if time.monotonic() >= next_report:
+                next_report += self.report_interval
+                # Prometheus 快照较大，只在 /metrics 输出
+                summary = {key: value for key, value in self.totals().items() if key != "prometheus"}
+                logger.info("工作进程指标汇总: %s", summary)
+
+        self.shutdown()
+
+    def _drain_metrics(self, timeout: Optional[float] = None):
+        try:
+            worker_id, snapshot = self._queue.get(timeout=timeout)
+            self.snapshots[worker_id] = snapshot
+            while True:
+                worker_id, snapshot = self._queue.get_nowait()
+                self.snapshots[worker_id] = snapshot
+        except queue.Empty:
+            pass
+        except InterruptedError:
+            pass
+
+    def shutdown(self):
+        """向工作进程发送 SIGTERM，等待其关闭连接后退出"""
+        logger.info("正在关闭工作进程...")
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for worker_id, process in self._processes.items():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("工作进程 %s 未在 %s 秒内退出，强制结束", worker_id, SHUTDOWN_TIMEOUT)
+                process.kill()
+                process.join()
+        self._drain_metrics()
+        totals = aggregate(self.snapshots)
+        totals.pop("prometheus", None)
+        logger.info("工作进程已全部退出，最终指标: %s", totals)
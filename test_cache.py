@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试搜索缓存的合并加载与元数据缓存的过期策略
+"""
+
+import asyncio
+
+import music_cache
+from music_cache import MetadataCache, SearchCache
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    """首个请求被取消时，合并等待的请求仍然得到结果"""
+    async def scenario():
+        cache = SearchCache()
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return ["稻香"]
+
+        leader = asyncio.ensure_future(cache.get_or_load("稻香", loader))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.get_or_load("稻香", loader))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        assert await waiter == ["稻香"]
+        assert leader.cancelled()
+        assert calls == 1
+        assert cache.stats()["coalesced"] == 1
+        # 加载结果已写入缓存
+        assert await cache.get_or_load("稻香", loader) == ["稻香"]
+        assert calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_loader_error_reaches_all_waiters_and_is_not_cached():
+    """加载失败时所有等待者都收到异常，下次请求重新加载"""
+    async def scenario():
+        cache = SearchCache()
+        calls = 0
+
+        async def failing():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise RuntimeError("上游错误")
+
+        results = await asyncio.gather(
+            cache.get_or_load("q", failing), cache.get_or_load("q", failing),
+            return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert calls == 1
+
+        async def empty():
+            return []
+
+        assert await cache.get_or_load("q", empty) == []
+        assert len(cache) == 0
+
+    asyncio.run(scenario())
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_metadata_stale_entry_served_while_one_refresh_runs(monkeypatch):
+    """过期但仍在 stale_ttl 内的条目立即返回旧值，后台只刷新一次"""
+    clock = _Clock()
+    monkeypatch.setattr(music_cache.time, "monotonic", clock)
+
+    async def scenario():
+        cache = MetadataCache(ttl=10, stale_ttl=100)
+        cache.put("song", {"url": "old"})
+        calls = 0
+        release = asyncio.Event()
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return {"url": "new"}
+
+        clock.now += 20
+        results = await asyncio.gather(*(cache.get("song", loader) for _ in range(5)))
+        assert results == [{"url": "old"}] * 5
+        assert calls == 1 and cache.stats()["stale_hits"] == 5
+
+        release.set()
+        await asyncio.gather(*cache._inflight.values())
+        assert await cache.get("song", loader) == {"url": "new"}
+        assert calls == 1
+
+        # 超过 stale_ttl 后不再返回旧值，等待加载
+        clock.now += 200
+        assert await cache.get("song", loader) == {"url": "new"}
+        assert calls == 2 and cache.stats()["misses"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_metadata_negative_entry_expires_after_negative_ttl(monkeypatch):
+    """未找到的结果只缓存 negative_ttl 秒，且过期后不作为旧值返回"""
+    clock = _Clock()
+    monkeypatch.setattr(music_cache.time, "monotonic", clock)
+
+    async def scenario():
+        cache = MetadataCache(ttl=600, stale_ttl=3600, negative_ttl=30)
+        found = None
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            return found
+
+        assert await cache.get("song", loader) is None
+        clock.now += 29
+        assert await cache.get("song", loader) is None
+        assert calls == 1 and cache.stats()["negative_hits"] == 1
+
+        found = {"url": "u"}
+        clock.now += 2
+        assert await cache.get("song", loader) == {"url": "u"}
+        assert calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_metadata_provider_ttls(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(music_cache.time, "monotonic", clock)
+
+    async def scenario():
+        cache = MetadataCache(ttl=600, stale_ttl=0, provider_ttls={"qq": 60})
+        cache.put("qq:1", {"url": "a"}, "qq")
+        cache.put("netease:1", {"url": "b"}, "netease")
+        calls = []
+
+        async def loader(key):
+            calls.append(key)
+            return {"url": "reloaded"}
+
+        clock.now += 120
+        assert await cache.get("netease:1", lambda: loader("netease:1"), "netease") == {"url": "b"}
+        assert await cache.get("qq:1", lambda: loader("qq:1"), "qq") == {"url": "reloaded"}
+        assert calls == ["qq:1"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试音乐目录索引
+"""
+
+import asyncio
+
+import music_mcp_websocket_server
+from music_catalog import FUZZY_INITIALS, FUZZY_PINYIN, CatalogIndex
+from music_render import render_search
+from music_text import pinyin_available
+
+SONGS = [
+    {"id": "1", "name": "青花瓷", "artist": "周杰伦", "album": "我很忙"},
+    {"id": "2", "name": "稻香", "artist": "周杰伦", "album": "魔杰座"},
+    {"id": "3", "name": "南山南", "artist": "马頔", "album": "孤岛"},
+    {"id": "4", "name": "Yesterday", "artist": "The Beatles", "album": "Help!"},
+]
+
+
+def _ids(results):
+    return [song["id"] for song in results]
+
+
+def test_fuzzy_lookup_tolerates_typos_and_pinyin():
+    """错别字、全拼、首字母都能找到歌曲"""
+    index = CatalogIndex(SONGS)
+    assert _ids(index.search("青花磁")) == ["1"]
+    assert _ids(index.search("yesterdy")) == ["4"]
+    if pinyin_available():
+        assert _ids(index.search("qinghuaci")) == ["1"]
+        assert _ids(index.search("qhc")) == ["1"]
+        assert _ids(index.search("马迪")) == ["3"]
+
+
+def test_fuzzy_index_skips_pinyin_identical_to_text():
+    """纯英文字段的拼音与原文相同，只索引一次"""
+    index = CatalogIndex(SONGS[3:])
+    assert not index._fuzzy._term_ids[FUZZY_PINYIN]
+    assert not index._fuzzy._term_ids[FUZZY_INITIALS]
+
+
+def test_fuzzy_index_can_be_disabled():
+    index = CatalogIndex(SONGS, fuzzy=False)
+    assert index.search("青花磁") == []
+    assert _ids(index.search("青花瓷")) == ["1"]
+
+
+def test_search_tiers_rank_exact_then_prefix_then_contains():
+    """完全匹配 > 前缀匹配 > 包含匹配，同层内歌名 > 歌手 > 专辑"""
+    index = CatalogIndex([
+        {"id": "contains", "name": "我的稻香", "artist": "甲", "album": "乙"},
+        {"id": "prefix", "name": "稻香村", "artist": "甲", "album": "乙"},
+        {"id": "album", "name": "丙", "artist": "甲", "album": "稻香"},
+        {"id": "exact", "name": "稻香", "artist": "甲", "album": "乙"},
+    ])
+    assert _ids(index.search("稻香")) == ["exact", "album", "prefix", "contains"]
+    assert _ids(index.search("稻香", limit=2)) == ["exact", "album"]
+    assert _ids(index.search("稻")) == ["exact", "prefix", "album", "contains"]
+
+
+def test_prefix_tier_uses_sorted_values():
+    """前缀匹配只访问以查询开头的值，逐个添加后也能查到"""
+    index = CatalogIndex({"id": str(i), "name": f"s{i}"} for i in range(1000))
+    assert _ids(index.search("s999")) == ["999"]
+    assert _ids(index.search("s99", limit=3)) == ["99", "990", "991"]
+    index.add({"id": "new", "name": "s9999"})
+    assert _ids(index.search("s999")) == ["999", "new"]
+
+
+def test_fuzzy_only_fills_in_without_exact_matches():
+    """有完全匹配时不再用模糊结果补足"""
+    index = CatalogIndex(SONGS)
+    assert _ids(index.search("稻香")) == ["2"]
+    assert _ids(index.search("稻乡")) == ["2"]
+
+
+def test_search_without_match_returns_nothing():
+    """没有匹配时不返回无关歌曲"""
+    assert asyncio.run(music_mcp_websocket_server._search_catalog("完全不存在的歌", 5)) == []
+    result = render_search("完全不存在的歌", [])
+    assert "未找到" in result.text and result.data["songs"] == []
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试JSON-RPC批量请求调度与参数检查
+"""
+
+import asyncio
+import json
+
+import music_mcp_server
+import music_mcp_websocket_server
+from music_jsonrpc import INVALID_PARAMS, INVALID_REQUEST, run_batch
+
+MALFORMED_BATCH = [
+    {"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": [1]},
+    {"jsonrpc": "2.0", "id": 2, "method": "tools/list"},
+    {"jsonrpc": "2.0", "id": 3, "method": "tools/call", "params": 5},
+    {"jsonrpc": "2.0", "method": "tools/call", "params": "x"},
+]
+
+
+def _check_malformed_batch(responses):
+    """每个请求各自得到响应，通知不响应"""
+    assert [response["id"] for response in responses] == [1, 2, 3]
+    assert responses[0]["error"]["code"] == INVALID_PARAMS
+    assert "result" in responses[1]
+    assert responses[2]["error"]["code"] == INVALID_PARAMS
+
+
+def test_run_batch_orders_writes_between_reads():
+    """修改状态的请求作为屏障，响应顺序与请求一致"""
+    async def scenario():
+        events = []
+
+        async def handle(request):
+            events.append(("start", request["id"]))
+            await asyncio.sleep(0.01)
+            events.append(("end", request["id"]))
+            return {"id": request["id"]}
+
+        batch = [{"id": 1, "write": False}, {"id": 2, "write": False},
+                 {"id": 3, "write": True}, {"id": 4, "write": False}]
+        responses = await run_batch(batch, handle, lambda request: not request["write"])
+        assert [response["id"] for response in responses] == [1, 2, 3, 4]
+        # 3 在 1、2 都结束之后开始，4 在 3 结束之后开始
+        assert events.index(("start", 3)) > max(events.index(("end", 1)), events.index(("end", 2)))
+        assert events.index(("start", 4)) > events.index(("end", 3))
+        assert (await run_batch([], handle, lambda request: True))["error"]["code"] == INVALID_REQUEST
+
+    asyncio.run(scenario())
+
+
+def test_websocket_batch_with_malformed_params():
+    server = music_mcp_websocket_server.server
+    responses = asyncio.run(server.process_message(json.dumps(MALFORMED_BATCH)))
+    _check_malformed_batch(responses)
+
+    single = asyncio.run(server.process_message(json.dumps(MALFORMED_BATCH[0])))
+    assert single["error"]["code"] == INVALID_PARAMS
+
+
+def test_stdio_batch_with_malformed_params():
+    server = music_mcp_server.server
+    responses = asyncio.run(server.handle_message(MALFORMED_BATCH))
+    _check_malformed_batch(responses)
+
+    single = asyncio.run(server.handle_message(MALFORMED_BATCH[0]))
+    assert single["error"]["code"] == INVALID_PARAMS
+    # params 为 null 时按空对象处理
+    assert "result" in asyncio.run(server.handle_message(
+        {"jsonrpc": "2.0", "id": 4, "method": "tools/list", "params": None}))
+
+
+class _SlowClient:
+    """不及时读取响应的客户端：发送阻塞直到 reading 被设置"""
+
+    def __init__(self, count: int):
+        self.count = count
+        self.received = 0
+        self.sent = []
+        self.reading = asyncio.Event()
+
+    async def __aiter__(self):
+        for i in range(self.count):
+            self.received += 1
+            yield json.dumps({"jsonrpc": "2.0", "id": i, "method": "tools/list"})
+        # 保持连接，直到所有响应发出
+        while len(self.sent) < self.count:
+            await asyncio.sleep(0.01)
+
+    async def send(self, data, text=None):
+        await self.reading.wait()
+        self.sent.append(data)
+
+
+def test_websocket_connection_bounds_unsent_responses():
+    """客户端不读取响应时，服务器最多读取 max_concurrency 条请求后暂停"""
+    async def scenario():
+        client = _SlowClient(20)
+        connection = music_mcp_websocket_server.ClientConnection(
+            music_mcp_websocket_server.server, client, max_concurrency=4)
+        running = asyncio.ensure_future(connection.run())
+        await asyncio.sleep(0.1)
+        # 4 条占用名额，第 5 条已读取、等待名额
+        assert client.received == 5
+        assert connection._outbox.qsize() <= 4
+        client.reading.set()
+        await asyncio.wait_for(running, 5)
+        assert len(client.sent) == 20
+
+    asyncio.run(scenario())
+
+
+class _BufferWriter:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data: bytes):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_stdio_orders_batches_containing_writes(monkeypatch):
+    """包含修改状态请求的批量请求与单个修改请求依次执行"""
+    events = []
+
+    async def slow_write(arguments):
+        events.append(("start", arguments["tag"]))
+        await asyncio.sleep(0.02)
+        events.append(("end", arguments["tag"]))
+        return "ok"
+
+    def call(msg_id, tag):
+        return {"jsonrpc": "2.0", "id": msg_id, "method": "tools/call",
+                "params": {"name": "slow_write", "arguments": {"tag": tag}}}
+
+    async def scenario():
+        server = music_mcp_server.MCPServer("test")
+        server.add_tool("slow_write", "修改状态", {"type": "object", "properties": {"tag": {"type": "string"}}},
+                        slow_write)
+        reader = asyncio.StreamReader()
+        reader.feed_data((json.dumps(call(1, "single")) + "\n" + json.dumps([call(2, "batch")]) + "\n").encode())
+        reader.feed_eof()
+        writer = _BufferWriter()
+
+        async def open_stdio(limit):
+            return reader, writer
+
+        monkeypatch.setattr(music_mcp_server, "open_stdio", open_stdio)
+        await server.run_stdio()
+        assert len(writer.data.splitlines()) == 2
+
+    asyncio.run(scenario())
+    assert events == [("start", "single"), ("end", "single"), ("start", "batch"), ("end", "batch")]
+
+
+def _run_stdio(monkeypatch, server, reader, writer, **kwargs):
+    async def open_stdio(limit):
+        return reader, writer
+
+    monkeypatch.setattr(music_mcp_server, "open_stdio", open_stdio)
+    return server.run_stdio(**kwargs)
+
+
+def test_stdio_oversized_line_gets_one_error(monkeypatch):
+    """超长的行整行丢弃，只回复一次错误，后续请求正常处理"""
+    async def scenario():
+        reader = asyncio.StreamReader(limit=1024)
+        writer = _BufferWriter()
+        running = asyncio.ensure_future(_run_stdio(monkeypatch, music_mcp_server.MCPServer("test"),
+                                                   reader, writer, line_limit=1024))
+        # 分多次到达，超过缓冲区的部分也要丢弃
+        for _ in range(30):
+            reader.feed_data(b"x" * 1000)
+            await asyncio.sleep(0)
+        reader.feed_data(b"\n" + json.dumps({"jsonrpc": "2.0", "id": 7, "method": "tools/list"}).encode() + b"\n")
+        reader.feed_eof()
+        await asyncio.wait_for(running, 5)
+        responses = [json.loads(line) for line in writer.data.splitlines()]
+        assert [response.get("id") for response in responses] == [None, 7]
+        assert responses[0]["error"]["code"] == INVALID_REQUEST
+
+    asyncio.run(scenario())
+
+
+class _StalledWriter(_BufferWriter):
+    """宿主不读取标准输出：drain 阻塞直到 reading 被设置"""
+
+    def __init__(self):
+        super().__init__()
+        self.reading = asyncio.Event()
+
+    async def drain(self):
+        await self.reading.wait()
+
+
+def test_stdio_bounds_unwritten_responses(monkeypatch):
+    """宿主不读取输出时，未写出的响应不超过 max_concurrency 条，读取随之暂停"""
+    async def scenario():
+        reader = asyncio.StreamReader()
+        for i in range(20):
+            reader.feed_data(json.dumps({"jsonrpc": "2.0", "id": i, "method": "tools/list"}).encode() + b"\n")
+        reader.feed_eof()
+        writer = _StalledWriter()
+        running = asyncio.ensure_future(_run_stdio(monkeypatch, music_mcp_server.MCPServer("test"),
+                                                   reader, writer, max_concurrency=4))
+        await asyncio.sleep(0.1)
+        assert len(writer.data.splitlines()) <= 4
+        assert not reader.at_eof()
+        writer.reading.set()
+        await asyncio.wait_for(running, 5)
+        assert len(writer.data.splitlines()) == 20
+
+    asyncio.run(scenario())
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试日志限速
+"""
+
+import logging
+
+from music_logging import RateLimitFilter
+
+
+def _record(message: str, lineno: int = 10) -> logging.LogRecord:
+    return logging.LogRecord("music", logging.ERROR, "server.py", lineno, message, (), None)
+
+
+def test_rate_limit_groups_formatted_messages_by_call_site():
+    """同一位置内容各不相同的错误日志共用一个令牌桶"""
+    limiter = RateLimitFilter(rate=0.001, burst=3)
+    passed = [limiter.filter(_record(f"处理消息错误: {i}")) for i in range(100)]
+    assert sum(passed) == 3
+    # 其他位置的日志不受影响
+    assert limiter.filter(_record("已加载曲库", lineno=20))
+    assert len(limiter._buckets) == 2
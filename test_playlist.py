@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试播放列表的结构不变量与播放模式
+"""
+
+import random
+
+from music_playlist import REPEAT_ALL, REPEAT_OFF, REPEAT_ONE, Playlist
+
+
+def _song(i: int):
+    return {"id": str(i), "name": f"歌曲{i}"}
+
+
+def check_invariants(playlist: Playlist):
+    """链表、随机分区数组与ID映射互相一致"""
+    forward = list(playlist._iter_entries())
+    backward = []
+    entry = playlist._tail
+    while entry is not None:
+        backward.append(entry)
+        entry = entry.prev
+    assert forward == backward[::-1]
+    assert (playlist._head is None) == (playlist._tail is None) == (not forward)
+
+    assert set(forward) == set(playlist._slots)
+    assert len(playlist) == len(forward)
+    for index, entry in enumerate(playlist._slots):
+        assert entry.slot == index
+    assert 0 <= playlist._unplayed <= len(playlist._slots)
+
+    indexed = [entry for positions in playlist._positions.values() for entry in positions]
+    assert sorted(map(id, indexed)) == sorted(map(id, forward))
+    for song_id, positions in playlist._positions.items():
+        assert positions and all(str(entry.song["id"]) == song_id for entry in positions)
+
+    assert playlist._cursor is None or playlist._cursor.slot >= 0
+    assert playlist._shuffle_next is None or playlist._shuffle_next.slot >= 0
+
+
+def test_random_operations_keep_invariants():
+    rng = random.Random(7)
+    for seed in range(20):
+        random.seed(seed)
+        playlist = Playlist()
+        entries = []
+        for step in range(300):
+            op = rng.randrange(9)
+            if op == 0:
+                entries.append(playlist.append(_song(rng.randrange(20))))
+            elif op == 1:
+                entries.append(playlist.insert_next(_song(rng.randrange(20))))
+            elif op == 2 and entries:
+                playlist.remove(entries.pop(rng.randrange(len(entries))))
+            elif op == 3:
+                removed = playlist.remove_id(str(rng.randrange(20)))
+                entries = [entry for entry in entries if entry.slot >= 0]
+                assert removed >= 0
+            elif op == 4:
+                playlist.next(auto=rng.random() < 0.5)
+            elif op == 5:
+                playlist.previous()
+            elif op == 6:
+                playlist.peek_next()
+            elif op == 7:
+                playlist.set_mode(shuffle=rng.random() < 0.5, repeat=rng.choice((REPEAT_OFF, REPEAT_ALL, REPEAT_ONE)))
+            else:
+                playlist.seek(str(rng.randrange(20)))
+            check_invariants(playlist)
+
+
+def test_shuffle_round_plays_every_entry_once():
+    """随机且不循环时，一轮内每一项恰好播放一次，之后停止"""
+    random.seed(1)
+    playlist = Playlist(shuffle=True, repeat=REPEAT_OFF)
+    for i in range(30):
+        playlist.append(_song(i))
+    played = []
+    while True:
+        song = playlist.next()
+        if song is None:
+            break
+        played.append(song["id"])
+    assert sorted(played, key=int) == [str(i) for i in range(30)]
+
+
+def test_shuffle_new_round_does_not_repeat_current():
+    random.seed(2)
+    for _ in range(50):
+        playlist = Playlist(shuffle=True, repeat=REPEAT_ALL)
+        for i in range(3):
+            playlist.append(_song(i))
+        last = [playlist.next()["id"] for _ in range(3)][-1]
+        assert playlist.next()["id"] != last
+
+
+def test_linear_navigation_and_repeat_modes():
+    playlist = Playlist(repeat=REPEAT_OFF)
+    for i in range(3):
+        playlist.append(_song(i))
+    assert [playlist.next()["id"] for _ in range(3)] == ["0", "1", "2"]
+    assert playlist.next() is None
+    assert playlist.previous()["id"] == "1"
+
+    playlist.set_mode(repeat=REPEAT_ALL)
+    playlist.seek("2")
+    assert playlist.next()["id"] == "0"
+
+    playlist.set_mode(repeat=REPEAT_ONE)
+    assert playlist.next(auto=True)["id"] == "0"
+    assert playlist.next()["id"] == "1"
+
+
+def test_snapshot_round_trip():
+    playlist = Playlist(shuffle=True, repeat=REPEAT_ONE)
+    for i in range(5):
+        playlist.append(_song(i))
+    playlist.seek("3")
+    restored = Playlist.restore(playlist.snapshot())
+    check_invariants(restored)
+    assert restored.songs() == playlist.songs()
+    assert restored.current["id"] == "3"
+    assert (restored.shuffle, restored.repeat) == (True, REPEAT_ONE)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试下一首预取
+"""
+
+import asyncio
+
+from music_prefetch import Prefetcher
+from music_session import SessionManager
+
+
+def _session(sessions: SessionManager, key: str):
+    session = sessions.get(key)
+    for i in range(3):
+        session.playlist.append({"id": str(i), "name": f"歌曲{i}", "duration": 200})
+    session.current_song = session.playlist.next()
+    session.is_playing = True
+    session.position = 190
+    return session
+
+
+def test_failed_warm_up_is_retried():
+    """预热失败后清除标记，下一次检查重新预热"""
+    async def scenario():
+        sessions = SessionManager()
+        session = _session(sessions, "speaker")
+        calls = []
+
+        async def warm(song):
+            calls.append(song["id"])
+            if len(calls) == 1:
+                raise ConnectionError("上游不可用")
+
+        prefetcher = Prefetcher(sessions, warm)
+        prefetcher.check()
+        # 预热进行中不重复发起
+        prefetcher.check()
+        await asyncio.sleep(0.01)
+        assert calls == ["1"] and session.prefetched is None
+
+        prefetcher.check()
+        await asyncio.sleep(0.01)
+        assert calls == ["1", "1"] and session.prefetched == "1"
+        prefetcher.check()
+        await asyncio.sleep(0.01)
+        assert calls == ["1", "1"] and prefetcher.warmed == 1
+
+    asyncio.run(scenario())
+
+
+def test_shared_warm_up_and_cancellation():
+    """多个会话的同一首歌只预热一次；关闭时取消的预热不算完成"""
+    async def scenario():
+        sessions = SessionManager()
+        first, second = _session(sessions, "a"), _session(sessions, "b")
+        started = asyncio.Event()
+
+        async def warm(song):
+            started.set()
+            await asyncio.sleep(10)
+
+        prefetcher = Prefetcher(sessions, warm)
+        prefetcher.check()
+        await started.wait()
+        assert len(prefetcher._pending) == 1
+        assert first.prefetched == second.prefetched == "1"
+
+        await prefetcher.aclose()
+        assert first.prefetched is None and second.prefetched is None
+
+    asyncio.run(scenario())
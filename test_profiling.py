@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试性能剖析与管理命令
+"""
+
+import asyncio
+import os
+
+import pytest
+
+import music_mcp_server
+import music_mcp_websocket_server
+from music_jsonrpc import INVALID_PARAMS
+from music_profiling import Profiler, profile_command
+
+
+def test_slowest_calls_recorded_without_profile_window():
+    profiler = Profiler(slowest=3)
+    for i, duration in enumerate([0.01, 0.5, 0.02, 0.3, 0.001, 0.4]):
+        profiler.record_call("search_music", {"query": str(i)}, duration)
+    assert not profiler.active
+    calls = profiler.slowest_calls()
+    assert [call["duration_ms"] for call in calls] == [500.0, 400.0, 300.0]
+    assert calls[0]["arguments"] == '{"query": "1"}'
+    assert profile_command(profiler, "slowest")["slowest_calls"] == calls
+
+    disabled = Profiler(slowest=0)
+    disabled.record_call("search_music", {}, 1.0)
+    assert disabled.slowest_calls() == []
+
+
+def test_profile_window_written_off_the_loop(tmp_path):
+    async def scenario():
+        profiler = Profiler(str(tmp_path / "profiles"), slowest=2)
+        assert profiler.start(60)
+        profiler.record_call("play_music", {"song_id": "1"}, 0.2)
+        base = profiler.stop()
+        # 由线程池写出，写完后更新 last_dump
+        for _ in range(100):
+            if profiler.last_dump:
+                break
+            await asyncio.sleep(0.01)
+        assert profiler.last_dump == base
+        with open(base + ".txt", encoding="utf-8") as f:
+            assert "play_music" in f.read()
+        assert os.path.exists(base + ".pstats")
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("seconds", [None, {}, "abc", "inf", float("nan"), 0, -5])
+def test_profile_command_rejects_bad_seconds(seconds):
+    with pytest.raises(ValueError):
+        profile_command(Profiler(), "start", seconds)
+
+
+def _admin(seconds):
+    return {"jsonrpc": "2.0", "id": 1, "method": "admin/profile",
+            "params": {"token": "secret", "action": "start", "seconds": seconds}}
+
+
+def test_admin_profile_bad_seconds_is_invalid_params(monkeypatch):
+    monkeypatch.setattr(music_mcp_server, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(music_mcp_websocket_server, "ADMIN_TOKEN", "secret")
+    stdio = music_mcp_server.MCPServer("test")
+    websocket = music_mcp_websocket_server.MCPWebSocketServer()
+    for seconds in (None, {"a": 1}, "nan"):
+        assert asyncio.run(stdio.handle_message(_admin(seconds)))["error"]["code"] == INVALID_PARAMS
+        assert asyncio.run(websocket.handle_request(_admin(seconds)))["error"]["code"] == INVALID_PARAMS
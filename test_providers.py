@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试上游提供方的连接池、超时与并发上限，以及多提供方并发搜索
+"""
+
+import asyncio
+import json
+
+import httpx
+
+from music_providers import (MusicProvider, NeteaseProvider, create_providers, fan_out_search,
+                             hedged_search)
+
+
+class _StubAPI:
+    """本地桩接口：keep-alive HTTP/1.1，按 delay 延迟响应，记录连接数与最大并发"""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.connections = 0
+        self.requests = 0
+        self.inflight = 0
+        self.max_inflight = 0
+        self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                self.requests += 1
+                self.inflight += 1
+                self.max_inflight = max(self.max_inflight, self.inflight)
+                try:
+                    await asyncio.sleep(self.delay)
+                finally:
+                    self.inflight -= 1
+                body = json.dumps({"result": {"songs": [
+                    {"id": self.requests, "name": "稻香", "artists": [{"name": "周杰伦"}],
+                     "album": {"name": "魔杰座"}, "duration": 223000}
+                ]}}).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n" % len(body) + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def test_provider_reuses_connections():
+    """依次发出的请求复用同一个 keep-alive 连接"""
+    async def scenario():
+        stub = _StubAPI()
+        async with stub as url:
+            provider = NeteaseProvider(url, http2=False)
+            for _ in range(5):
+                songs = await provider.search("稻香", 1)
+                assert songs[0]["name"] == "稻香" and songs[0]["provider"] == "netease"
+            await provider.aclose()
+        assert (stub.requests, stub.connections) == (5, 1)
+
+    asyncio.run(scenario())
+
+
+def test_provider_timeout():
+    async def scenario():
+        async with _StubAPI(delay=1) as url:
+            provider = NeteaseProvider(url, timeout=0.1, http2=False)
+            started = asyncio.get_running_loop().time()
+            try:
+                await provider.search("稻香")
+            except httpx.TimeoutException:
+                pass
+            else:
+                raise AssertionError("超过提供方超时应当失败")
+            assert asyncio.get_running_loop().time() - started < 0.5
+            await provider.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_provider_concurrency_cap():
+    """同时发出的请求不超过 max_concurrency 个"""
+    async def scenario():
+        stub = _StubAPI(delay=0.05)
+        async with stub as url:
+            provider = NeteaseProvider(url, max_concurrency=2, http2=False)
+            results = await asyncio.gather(*(provider.search("稻香") for _ in range(8)))
+            await provider.aclose()
+        assert all(results)
+        assert stub.requests == 8
+        assert stub.max_inflight == 2
+
+    asyncio.run(scenario())
+
+
+def test_create_providers_reads_overrides(monkeypatch):
+    monkeypatch.setenv("MUSIC_API_NETEASE", "http://127.0.0.1:1")
+    monkeypatch.setenv("MUSIC_API_NETEASE_TIMEOUT", "0.5")
+    pool = create_providers({"netease": "https://music.163.com/api", "qq": "https://c.y.qq.com"},
+                            ["netease", "qq", "unknown"])
+    assert [provider.name for provider in pool] == ["netease", "qq"]
+    assert (pool.get("netease").base_url, pool.get("netease").timeout) == ("http://127.0.0.1:1", 0.5)
+    # QQ 接口只支持按ID查询，不参与搜索
+    assert [provider.name for provider in pool.searchable()] == ["netease"]
+
+
+class _ScriptedProvider(MusicProvider):
+    """按脚本延迟返回结果的提供方，delays 依次用于每次调用，用完后重复最后一个"""
+
+    def __init__(self, name: str, songs, delays, timeout: float = 1.0):
+        super().__init__("http://stub", timeout=timeout)
+        self.name = name
+        self.songs = songs
+        self.delays = list(delays)
+        self.calls = 0
+        self.cancelled = 0
+
+    async def search(self, query, limit=10):
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return [dict(song, provider=self.name) for song in self.songs[:limit]]
+
+
+def _songs(*names):
+    return [{"id": name, "name": name, "artist": "周杰伦"} for name in names]
+
+
+def test_fan_out_dedups_by_normalized_title_and_artist():
+    async def scenario():
+        first = _ScriptedProvider("a", _songs("稻香", "晴天"), [0])
+        second = _ScriptedProvider("b", [{"id": "x", "name": " 稻香 ", "artist": "周杰倫"},
+                                         {"id": "y", "name": "Yesterday", "artist": "Beatles"}], [0.01])
+        results = await fan_out_search([first, second], "q", limit=10, hedge=False)
+        assert [(song["name"], song["provider"]) for song in results] == [
+            ("稻香", "a"), ("晴天", "a"), ("Yesterday", "b")]
+
+    asyncio.run(scenario())
+
+
+def test_fan_out_returns_early_at_limit():
+    """凑够 limit 条立即返回，取消慢的提供方"""
+    async def scenario():
+        fast = _ScriptedProvider("fast", _songs("1", "2", "3"), [0])
+        slow = _ScriptedProvider("slow", _songs("4"), [5])
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        results = await fan_out_search([fast, slow], "q", limit=3, deadline=5, hedge=False)
+        assert loop.time() - started < 0.5
+        assert [song["id"] for song in results] == ["1", "2", "3"]
+        assert slow.cancelled == 1
+
+    asyncio.run(scenario())
+
+
+def test_fan_out_deadline_cancels_pending_providers():
+    """到达截止时间返回已有结果，未完成的请求(含对冲请求)全部取消"""
+    async def scenario():
+        fast = _ScriptedProvider("fast", _songs("1"), [0])
+        slow = _ScriptedProvider("slow", _songs("2"), [5], timeout=0.1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        results = await fan_out_search([fast, slow], "q", limit=10, deadline=0.2)
+        assert 0.19 <= loop.time() - started < 0.5
+        assert [song["id"] for song in results] == ["1"]
+        # 超过 timeout/2 后发出的对冲请求也被取消
+        assert (slow.calls, slow.cancelled) == (2, 2)
+
+    asyncio.run(scenario())
+
+
+def test_hedge_fires_after_hedge_delay():
+    async def scenario():
+        # 首次请求卡住，对冲请求很快返回
+        provider = _ScriptedProvider("p", _songs("1"), [5, 0], timeout=0.2)
+        assert provider.hedge_delay() == 0.1
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        results = await hedged_search(provider, "q", 10)
+        elapsed = loop.time() - started
+        assert 0.09 <= elapsed < 0.3
+        assert [song["id"] for song in results] == ["1"]
+        assert (provider.calls, provider.cancelled) == (2, 1)
+
+        # 在对冲延迟内返回时不发出对冲请求
+        quick = _ScriptedProvider("q", _songs("1"), [0.01], timeout=0.2)
+        await hedged_search(quick, "q", 10)
+        assert quick.calls == 1
+
+        # 延迟样本足够后按 p95 计算对冲延迟
+        quick.latencies.extend([0.01] * 19 + [0.05])
+        assert quick.hedge_delay() < 0.05
+
+    asyncio.run(scenario())
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试工具注册表
+"""
+
+import json
+
+from music_registry import ToolRegistry
+
+SCHEMA = {"type": "object", "properties": {}}
+OUTPUT_SCHEMA = {"type": "object", "properties": {"songs": {"type": "array"}}}
+
+
+async def _handler(arguments):
+    return "ok"
+
+
+def _tools(registry: ToolRegistry):
+    return json.loads(registry.tools_list())["tools"]
+
+
+def test_output_schema_follows_structured_content():
+    """关闭 structuredContent 时不声明 outputSchema"""
+    enabled = ToolRegistry(structured_content=True)
+    enabled.add_tool("search", "搜索", SCHEMA, _handler, output_schema=OUTPUT_SCHEMA)
+    assert _tools(enabled)[0]["outputSchema"] == OUTPUT_SCHEMA
+
+    disabled = ToolRegistry(structured_content=False)
+    disabled.add_tool("search", "搜索", SCHEMA, _handler, output_schema=OUTPUT_SCHEMA)
+    assert "outputSchema" not in _tools(disabled)[0]
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试工具参数校验
+"""
+
+import asyncio
+
+import pytest
+
+import music_mcp_server
+import music_mcp_websocket_server
+from music_jsonrpc import INVALID_PARAMS
+from music_schema import SchemaError, compile_schema
+
+SET_VOLUME_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "volume": {"type": "integer", "description": "音量百分比 (0-100)", "minimum": 0, "maximum": 100}
+    },
+    "required": ["volume"]
+}
+
+SEARCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "query": {"type": "string", "minLength": 1},
+        "limit": {"type": "integer", "default": 10, "minimum": 1, "maximum": 50},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "mode": {"type": "string", "enum": ["song", "album"]}
+    },
+    "required": ["query"]
+}
+
+
+def _error(validate, arguments) -> str:
+    with pytest.raises(SchemaError) as info:
+        validate(arguments)
+    return str(info.value)
+
+
+def test_required_fields_and_types():
+    validate = compile_schema(SEARCH_SCHEMA)
+    assert "query" in _error(validate, {})
+    assert "query" in _error(validate, None)
+    assert "limit" in _error(validate, {"query": "稻香", "limit": "10"})
+    assert "limit" in _error(validate, {"query": "稻香", "limit": 1.5})
+    assert "tags[]" in _error(validate, {"query": "稻香", "tags": ["a", 1]})
+    assert "mode" in _error(validate, {"query": "稻香", "mode": "artist"})
+    assert "query" in _error(validate, {"query": ""})
+    assert "arguments" in _error(validate, ["稻香"])
+
+
+def test_bool_is_not_an_integer():
+    validate = compile_schema(SET_VOLUME_SCHEMA)
+    assert "volume" in _error(validate, {"volume": True})
+    assert validate({"volume": 1}) == {"volume": 1}
+
+
+def test_set_volume_bounds():
+    validate = compile_schema(SET_VOLUME_SCHEMA)
+    assert validate({"volume": 0}) == {"volume": 0}
+    assert validate({"volume": 100}) == {"volume": 100}
+    assert "不能小于" in _error(validate, {"volume": -1})
+    assert "不能大于" in _error(validate, {"volume": 101})
+
+
+def test_defaults_are_filled_without_touching_input():
+    validate = compile_schema(SEARCH_SCHEMA)
+    arguments = {"query": "稻香"}
+    assert validate(arguments) == {"query": "稻香", "limit": 10}
+    assert arguments == {"query": "稻香"}
+    assert validate({"query": "稻香", "limit": 3})["limit"] == 3
+
+
+def _call(msg_id, volume):
+    return {"jsonrpc": "2.0", "id": msg_id, "method": "tools/call",
+            "params": {"name": "set_volume", "arguments": {"volume": volume}}}
+
+
+async def _set_volume(arguments):
+    return f"音量已设置为: {arguments['volume']}%"
+
+
+def _check_invalid(response, msg_id):
+    assert response["jsonrpc"] == "2.0" and response["id"] == msg_id
+    assert response["error"]["code"] == INVALID_PARAMS
+    assert "volume" in response["error"]["message"]
+    assert "result" not in response
+
+
+def test_invalid_arguments_return_invalid_params_stdio():
+    server = music_mcp_server.MCPServer("test")
+    server.add_tool("set_volume", "设置音量", SET_VOLUME_SCHEMA, _set_volume)
+    _check_invalid(asyncio.run(server.handle_message(_call(1, 101))), 1)
+    _check_invalid(asyncio.run(server.handle_message(_call(2, True))), 2)
+    assert "result" in asyncio.run(server.handle_message(_call(3, 30)))
+
+
+def test_invalid_arguments_return_invalid_params_websocket():
+    server = music_mcp_websocket_server.MCPWebSocketServer()
+    server.add_tool("set_volume", "设置音量", SET_VOLUME_SCHEMA, _set_volume)
+    _check_invalid(asyncio.run(server.handle_request(_call(1, -5))), 1)
+    _check_invalid(asyncio.run(server.handle_request(_call(2, "50"))), 2)
+    assert "result" in asyncio.run(server.handle_request(_call(3, 30)))
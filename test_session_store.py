@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试会话存储与会话写回
+"""
+
+import asyncio
+
+import pytest
+
+from music_session import SessionManager
+from music_session_store import (MemorySessionStore, RedisError, RedisSessionStore, SessionStore,
+                                 create_session_store)
+
+
+class _FakeRedis:
+    """最小的 RESP 服务端，支持 AUTH/SELECT/GET/SET EX/DEL，各库数据分开保存"""
+
+    def __init__(self, password=None):
+        self.password = password
+        self.databases = {}
+        self.commands = []
+        self.connections = 0
+        self.writers = set()
+        self.server = None
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.writers.add(writer)
+        db, authed = 0, self.password is None
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    return
+                name = args[0].decode().upper()
+                self.commands.append(name)
+                data = self.databases.setdefault(db, {})
+                if name == "AUTH":
+                    authed = args[1].decode() == self.password
+                    reply = b"+OK\r\n" if authed else b"-WRONGPASS invalid password\r\n"
+                elif not authed:
+                    reply = b"-NOAUTH Authentication required.\r\n"
+                elif name == "SELECT":
+                    db = int(args[1])
+                    reply = b"+OK\r\n"
+                elif name == "SET":
+                    data[args[1]] = args[2]
+                    reply = b"+OK\r\n"
+                elif name == "GET":
+                    value = data.get(args[1])
+                    reply = b"$-1\r\n" if value is None else b"$%d\r\n%b\r\n" % (len(value), value)
+                elif name == "DEL":
+                    reply = b":%d\r\n" % int(data.pop(args[1], None) is not None)
+                else:
+                    reply = b"-ERR unknown command\r\n"
+                writer.write(reply)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    def drop_connections(self):
+        for writer in list(self.writers):
+            writer.close()
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+
+def test_create_session_store():
+    assert create_session_store(None) is None
+    assert isinstance(create_session_store("memory"), MemorySessionStore)
+    store = create_session_store("redis://:secret@redis.local:6380/2")
+    assert (store.host, store.port, store.password, store.db) == ("redis.local", 6380, "secret", 2)
+    with pytest.raises(ValueError):
+        create_session_store("mongodb://localhost")
+
+
+def test_memory_store_expires_entries():
+    async def scenario():
+        store = MemorySessionStore()
+        await store.save_many({"a": b"1", "b": b"2"}, ttl=60)
+        assert await store.load("a") == b"1"
+        await store.delete("a")
+        assert await store.load("a") is None
+        await store.save_many({"b": b"3"}, ttl=0)
+        assert await store.load("b") is None
+
+    asyncio.run(scenario())
+
+
+def test_redis_store_round_trip_and_reconnect():
+    async def scenario():
+        fake = _FakeRedis(password="secret")
+        async with fake as port:
+            store = RedisSessionStore(f"redis://:secret@127.0.0.1:{port}/3", prefix="t:")
+            await store.save_many({"a": b"1", "b": "会话".encode()}, ttl=60)
+            assert await store.load("b") == "会话".encode()
+            assert fake.databases[3] == {b"t:a": b"1", b"t:b": "会话".encode()}
+            assert fake.commands[:4] == ["AUTH", "SELECT", "SET", "SET"]
+
+            # 服务端断开后下一次请求自动重连
+            fake.drop_connections()
+            await asyncio.sleep(0.01)
+            await store.delete("a")
+            assert await store.load("a") is None
+            assert fake.connections == 2
+            await store.aclose()
+
+            wrong = RedisSessionStore(f"redis://:wrong@127.0.0.1:{port}/0")
+            with pytest.raises(RedisError):
+                await wrong.load("a")
+            await wrong.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_session_manager_writes_behind_and_loads_elsewhere():
+    """修改只在 flush 时批量写入，其他进程的管理器通过 load 取得最新状态"""
+    async def scenario():
+        fake = _FakeRedis()
+        async with fake as port:
+            store = RedisSessionStore(f"redis://127.0.0.1:{port}/0")
+            first = SessionManager(store=store)
+            session = first.get("speaker")
+            session.volume = 80
+            session.playlist.append({"id": "1", "name": "稻香"})
+            assert "SET" not in fake.commands
+
+            await first.flush()
+            assert fake.commands.count("SET") == 1
+            # 没有变化时不再写入
+            await first.flush()
+            assert fake.commands.count("SET") == 1
+
+            second = SessionManager(store=RedisSessionStore(f"redis://127.0.0.1:{port}/0"))
+            loaded = await second.load("speaker")
+            assert loaded.volume == 80 and [song["id"] for song in loaded.playlist.songs()] == ["1"]
+
+            # 本地有未写回的修改时 load 保留本地状态
+            loaded.volume = 10
+            assert (await second.load("speaker")).volume == 10
+
+            # 另一端写回后，已持有的会话对象就地刷新
+            await second.flush()
+            held = first.get("speaker")
+            assert (await first.load("speaker")) is held and held.volume == 10
+            await store.aclose()
+            await second.store.aclose()
+
+    asyncio.run(scenario())
+
+
+class _FailingStore(MemorySessionStore):
+    def __init__(self):
+        super().__init__()
+        self.fail = True
+
+    async def save_many(self, items, ttl):
+        if self.fail:
+            raise ConnectionError("存储不可用")
+        await super().save_many(items, ttl)
+
+
+def test_session_manager_retries_failed_and_evicted_writes():
+    """写回失败时下一轮重试，被淘汰的会话的修改也会写回"""
+    async def scenario():
+        store = _FailingStore()
+        manager = SessionManager(max_sessions=1, store=store)
+        manager.get("a").volume = 70
+        await manager.flush()
+        assert await store.load("a") is None
+
+        # a 被淘汰后仍保留未写回的内容
+        manager.get("b").volume = 30
+        assert "a" not in manager
+        store.fail = False
+        await manager.flush()
+        assert b'"volume":70' in (await store.load("a")).replace(b" ", b"")
+        assert b'"volume":30' in (await store.load("b")).replace(b" ", b"")
+
+    asyncio.run(scenario())
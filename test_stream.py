@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试音频流代理的 Range 处理
+"""
+
+import asyncio
+import os
+import re
+
+import httpx
+
+from music_chunk_cache import ChunkCache
+from music_stream import StreamServer, parse_range
+
+AUDIO = bytes(range(256)) * 40
+
+
+async def _upstream(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, truncate: bool = False):
+    """支持单段 Range 的上游；truncate 时只发送一半数据就断开"""
+    headers = {}
+    await reader.readline()
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    match = re.match(r"bytes=(\d+)-(\d*)$", headers.get("range", ""))
+    if match:
+        start = int(match.group(1))
+        stop = int(match.group(2)) + 1 if match.group(2) else len(AUDIO)
+        if start >= len(AUDIO) or stop <= start:
+            writer.write(f"HTTP/1.1 416 Range Not Satisfiable\r\nContent-Range: bytes */{len(AUDIO)}\r\n"
+                         f"Content-Length: 0\r\n\r\n".encode())
+        else:
+            body = AUDIO[start:stop]
+            writer.write(f"HTTP/1.1 206 Partial Content\r\nContent-Type: audio/mpeg\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Content-Range: bytes {start}-{start + len(body) - 1}/{len(AUDIO)}\r\n\r\n".encode()
+                         + (body[:len(body) // 2] if truncate else body))
+    else:
+        writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: audio/mpeg\r\nContent-Length: {len(AUDIO)}\r\n\r\n"
+                     .encode() + AUDIO)
+    await writer.drain()
+    writer.close()
+
+
+async def _get(port: int, range_header: str = None, target: str = "/stream/song"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    range_line = f"Range: {range_header}\r\n" if range_header else ""
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: test\r\n{range_line}\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = {name.lower(): value.strip() for name, _, value in (line.partition(":") for line in lines[1:])}
+    return int(lines[0].split()[1]), headers, body
+
+
+def _run(cache_dir=None):
+    async def scenario():
+        upstream = await asyncio.start_server(_upstream, "127.0.0.1", 0)
+        upstream_port = upstream.sockets[0].getsockname()[1]
+
+        async def resolve_url(song_id):
+            return f"http://127.0.0.1:{upstream_port}/audio"
+
+        cache = ChunkCache(cache_dir, chunk_size=4096) if cache_dir else None
+        proxy = StreamServer(resolve_url, cache=cache)
+        await proxy.start("127.0.0.1", 0)
+        port = proxy._server.sockets[0].getsockname()[1]
+        try:
+            status, headers, body = await _get(port, "bytes=10-19")
+            assert (status, body) == (206, AUDIO[10:20])
+            assert headers["content-range"] == f"bytes 10-19/{len(AUDIO)}"
+
+            status, headers, body = await _get(port, f"bytes={len(AUDIO) - 5}-{len(AUDIO) + 100}")
+            assert (status, body) == (206, AUDIO[-5:])
+
+            # 结束位置在起始位置之前
+            status, headers, body = await _get(port, "bytes=100-50")
+            assert status == 416 and body == b""
+
+            status, headers, body = await _get(port, f"bytes={len(AUDIO)}-")
+            assert status == 416
+            assert headers["content-range"] == f"bytes */{len(AUDIO)}"
+
+            # 播放位置按码率换算为字节偏移，非有限值或负数返回 400
+            status, headers, body = await _get(port, target="/stream/song?position=0.0005")
+            assert (status, body) == (206, AUDIO[8:])
+            for position in ("inf", "-inf", "nan", "-1", "1e308", "abc"):
+                status, headers, body = await _get(port, target=f"/stream/song?position={position}")
+                assert status == 400, position
+        finally:
+            await proxy.aclose()
+            upstream.close()
+            await upstream.wait_closed()
+
+    asyncio.run(scenario())
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-") == (0, None)
+    assert parse_range("bytes=5-10") == (5, 10)
+    assert parse_range("bytes=-500") is None
+    assert parse_range("bytes=0-1,5-6") is None
+
+
+def test_range_edge_cases_with_chunk_cache(tmp_path):
+    _run(str(tmp_path))
+
+
+def test_range_edge_cases_relayed():
+    _run()
+
+
+class _CountingUpstream:
+    """记录收到的 Range 请求，可以让下一次响应中途断开"""
+
+    def __init__(self):
+        self.ranges = []
+        self.truncate = False
+        self.server = None
+
+    async def handle(self, reader, writer):
+        truncate, self.truncate = self.truncate, False
+        # 请求行与请求头由 _upstream 读取，这里只借用 Range 记录
+        peek = _RecordingReader(reader, self.ranges)
+        await _upstream(peek, writer, truncate)
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/audio"
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class _RecordingReader:
+    def __init__(self, reader, ranges):
+        self._reader = reader
+        self._ranges = ranges
+
+    async def readline(self):
+        line = await self._reader.readline()
+        if line.lower().startswith(b"range:"):
+            self._ranges.append(line.split(b"=", 1)[1].strip().decode())
+        return line
+
+
+def _chunk_files(directory):
+    return sorted(name for name in os.listdir(directory) if not name.endswith(".json"))
+
+
+def test_chunk_cache_fetches_once_then_hits(tmp_path):
+    async def scenario():
+        upstream = _CountingUpstream()
+        async with upstream as url, httpx.AsyncClient() as client:
+            cache = ChunkCache(str(tmp_path), chunk_size=4096)
+            paths = await asyncio.gather(*(cache.get(client, "song", url, 1) for _ in range(5)))
+            assert len(set(paths)) == 1
+            assert upstream.ranges == ["4096-8191"]
+            with open(paths[0], "rb") as f:
+                assert f.read() == AUDIO[4096:8192]
+            assert await cache.get(client, "song", url, 1) == paths[0]
+            assert upstream.ranges == ["4096-8191"]
+            assert cache.stats()["hits"] == 1
+            info = await cache.track("song")
+            assert (info.length, info.content_type) == (len(AUDIO), "audio/mpeg")
+
+    asyncio.run(scenario())
+
+
+def test_chunk_cache_evicts_within_budget(tmp_path):
+    """按字节预算淘汰最久未使用的分块"""
+    async def scenario():
+        async with _CountingUpstream() as url, httpx.AsyncClient() as client:
+            cache = ChunkCache(str(tmp_path), chunk_size=1024, max_bytes=3 * 1024)
+            for index in range(6):
+                await cache.get(client, "song", url, index)
+                assert cache.size <= cache.max_bytes
+                # 第 0 块一直被访问，不会被淘汰
+                await cache.get(client, "song", url, 0)
+            key = ChunkCache.track_key("song")
+            assert _chunk_files(tmp_path) == [f"{key}.{index}" for index in (0, 4, 5)]
+            assert sum(os.path.getsize(tmp_path / name) for name in _chunk_files(tmp_path)) <= 3 * 1024
+
+    asyncio.run(scenario())
+
+
+def test_chunk_cache_cleans_up_interrupted_download(tmp_path):
+    """下载中断时删除 .part 文件，下次重新拉取该分块"""
+    async def scenario():
+        upstream = _CountingUpstream()
+        async with upstream as url, httpx.AsyncClient() as client:
+            cache = ChunkCache(str(tmp_path), chunk_size=4096)
+            await cache.get(client, "song", url, 0)
+            upstream.truncate = True
+            try:
+                await cache.get(client, "song", url, 1)
+            except httpx.HTTPError:
+                pass
+            else:
+                raise AssertionError("中断的下载应当失败")
+            assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+            # 只补拉缺失的分块
+            path = await cache.get(client, "song", url, 1)
+            assert upstream.ranges == ["0-4095", "4096-8191", "4096-8191"]
+            with open(path, "rb") as f:
+                assert f.read() == AUDIO[4096:8192]
+
+    asyncio.run(scenario())
+
+
+def test_chunk_cache_restores_index_from_directory(tmp_path):
+    async def scenario():
+        upstream = _CountingUpstream()
+        async with upstream as url, httpx.AsyncClient() as client:
+            cache = ChunkCache(str(tmp_path), chunk_size=4096)
+            for index in range(3):
+                await cache.get(client, "song", url, index)
+
+            restored = ChunkCache(str(tmp_path), chunk_size=4096)
+            assert restored.stats()["chunks"] == 3 and restored.size == cache.size
+            assert (await restored.track("song")).length == len(AUDIO)
+            await restored.get(client, "song", url, 2)
+            assert restored.stats()["hits"] == 1
+            assert len(upstream.ranges) == 3
+
+            # 预算变小时启动即淘汰
+            smaller = ChunkCache(str(tmp_path), chunk_size=4096, max_bytes=8192)
+            assert smaller.size <= 8192
+            assert len(_chunk_files(tmp_path)) == 2
+
+    asyncio.run(scenario())
+
+
+def test_chunk_cache_refetches_chunk_evicted_before_open(tmp_path):
+    """取得路径后分块被其他进程淘汰，打开时重新下载"""
+    async def scenario():
+        upstream = _CountingUpstream()
+        async with upstream as url, httpx.AsyncClient() as client:
+            cache = ChunkCache(str(tmp_path), chunk_size=4096)
+            path = await cache.get(client, "song", url, 0)
+            os.remove(path)
+            with await cache.open_chunk(client, "song", url, 0) as f:
+                assert f.read() == AUDIO[:4096]
+            assert upstream.ranges == ["0-4095", "0-4095"]
+
+            get = cache.get
+
+            async def get_then_evict(*args):
+                result = await get(*args)
+                if len(upstream.ranges) == 2:
+                    os.remove(result)
+                return result
+
+            cache.get = get_then_evict
+            with await cache.open_chunk(client, "song", url, 0) as f:
+                assert f.read() == AUDIO[:4096]
+            assert upstream.ranges == ["0-4095", "0-4095", "0-4095"]
+
+    asyncio.run(scenario())